@@ -135,7 +135,8 @@ def select_X_y(symptoms, gs, cause_col='gs_analytic', cause_map=None,
     return symptoms.loc[idx], causes
 
 
-def calc_tariffs_and_endorsement_rates(X, y, bootstraps, ui=UI, rs=None):
+def calc_tariffs_and_endorsement_rates(X, y, bootstraps, ui=UI, rs=None,
+                                       n_jobs=1):
     """Calculate tariffs and endorsement rates.
 
     For these results, we want raw tariffs where we haven't dropped or rounded
@@ -150,17 +151,10 @@ def calc_tariffs_and_endorsement_rates(X, y, bootstraps, ui=UI, rs=None):
     endors = X.groupby(y).mean()
     tariffs = tariff.calc_tariffs(X, y)
 
-    bs_endors = tariff.boostrap_endorsements_by_causes(X, y, bootstraps, rs) \
-                      .swaplevel(0, 1).sort_index()
-    bs_tariffs = bs_endors.groupby(level='draw').apply(
-        lambda df: df.apply(tariff.tariffs_from_endorsements, raw=True))
-
-    endors_lb, endors_ub = np.percentile(
-        np.dstack([bs_endors.loc[i].values for i in range(bootstraps)]),
-        ui, -1)
-    tariffs_lb, tariffs_ub = np.percentile(
-        np.dstack([bs_tariffs.loc[i].values for i in range(bootstraps)]),
-        ui, -1)
+    _, bs_endors = tariff.bootstrap_endorsements(X, y, bootstraps, rs,
+                                                 n_jobs=n_jobs)
+    endors_lb, endors_ub = np.percentile(bs_endors, ui, axis=0)
+    tariffs_lb, tariffs_ub = tariff.calc_tariff_ui(bs_endors, ui)
 
     names = ('tariff', 'tariff_lb', 'tariff_ub', 'endorsement_rate',
              'endorsement_rate_lb', 'endorsement_rate_ub')
@@ -229,7 +223,7 @@ def load_gold_standards(path=INPUT_FILE):
     return df
 
 
-def main_tariffs():
+def main_tariffs(n_jobs=1):
     """Run the primary analysis calculating tariffs."""
     output = []
     gold_standards = load_gold_standards()
@@ -247,7 +241,8 @@ def main_tariffs():
         for name, condition in SUBSETS.items():
             logging.info(f'    Calculating tariffs for {name}')
             X, y = select_X_y(symptoms, gold_standards, condition=condition)
-            df = calc_tariffs_and_endorsement_rates(X, y, bootstraps, UI, rs)
+            df = calc_tariffs_and_endorsement_rates(X, y, bootstraps, UI, rs,
+                                                    n_jobs)
             df.columns = pd.MultiIndex.from_arrays([
                 np.full(6, name),
                 np.repeat(['endorsement_rate', 'tariff'], 3),
@@ -284,16 +279,17 @@ def main_tariffs():
 @click.option('-c', '--condition', help='query string')
 @click.option('-d', '--draws', default=100)
 @click.option('--seed', type=int, default=2301598125)
+@click.option('-j', '--jobs', default=1, help='number of bootstrap threads')
 @click.pass_context
-def tariffs(ctx, main, module, condition, draws, seed):
+def tariffs(ctx, main, module, condition, draws, seed, jobs):
     """Make tariff matricies"""
     if main:
-        main_tariffs()
+        main_tariffs(jobs)
         ctx.exit()
     symptoms = load_smartva_output(module)
     gold_standards = load_gold_standards()
     X, y = select_X_y(symptoms, gold_standards, condition=condition)
-    df = calc_tariffs_and_endorsement_rates(X, y, draws, seed)
+    df = calc_tariffs_and_endorsement_rates(X, y, draws, seed, n_jobs=jobs)
     print(np.round(df, 3))
 
 
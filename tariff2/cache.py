@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class ArtifactCache(object):
+    """Directory of arrays keyed by a hash of the inputs which made them
+
+    Each entry is an uncompressed `.npz` file named by its key. Entries are
+    written to a temporary file in the same directory and renamed into
+    place, which is atomic, so processes sharing the directory never read
+    a partially written entry and concurrent writers of the same key leave
+    one complete copy. No locks are taken.
+
+    Reading an entry updates its modification time. Once the entries take
+    more than `max_size` bytes, the least recently used are removed. An
+    entry removed by another process in the meantime is a cache miss.
+
+    Args:
+        path (str): directory of the entries. It is created if needed.
+        max_size (int or None): maximum total size of the entries in bytes.
+            None means no limit.
+    """
+
+    suffix = '.npz'
+
+    def __init__(self, path, max_size=2 ** 30):
+        self.path = os.fspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        return '{}({!r}, max_size={!r})'.format(type(self).__name__,
+                                               self.path, self.max_size)
+
+    def key(self, *parts):
+        """Hash the inputs of an entry (see `content_key`)"""
+        return content_key(*parts)
+
+    def get(self, key):
+        """Read an entry
+
+        Args:
+            key (str): key of the entry
+
+        Returns:
+            arrays (dict or None): arrays by name or None if there is no
+                readable entry for the key
+        """
+        path = self._entry(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return arrays
+
+    def put(self, key, arrays):
+        """Write an entry and evict the least recently used entries
+
+        Args:
+            key (str): key of the entry
+            arrays (dict): arrays by name. They must not need pickling.
+        """
+        fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self._entry(key))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries above the maximum size"""
+        if self.max_size is None:
+            return
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+
+def check_cache(cache):
+    """Turn a directory into an ArtifactCache
+
+    Args:
+        cache (None, str or ArtifactCache): cache or its directory
+
+    Returns:
+        (ArtifactCache or None)
+    """
+    if cache is None or isinstance(cache, ArtifactCache):
+        return cache
+    return ArtifactCache(cache)
+
+
+def content_key(*parts):
+    """Hash arrays, labels, random states and parameters
+
+    Arrays are hashed by their bytes with BLAKE2, so a key takes about as
+    long as reading the arrays once. Arrays of objects, such as string
+    labels, are hashed element-wise by `pd.util.hash_array`.
+
+    Args:
+        *parts: arrays, sparse matrices, pandas objects, random states and
+            JSON-serializable values, or lists, tuples and dicts of them
+
+    Returns:
+        (str): hexadecimal digest
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        _update(h, part)
+    return h.hexdigest()
+
+
+def _update(h, value):
+    """Add one value with its type and length to a hash"""
+    def feed(tag, data):
+        h.update(tag.encode())
+        h.update(memoryview(data).nbytes.to_bytes(8, 'little'))
+        h.update(data)
+
+    if isinstance(value, (pd.Index, pd.Series, pd.DataFrame)):
+        feed('pandas', type(value).__name__.encode())
+        if not isinstance(value, pd.Index):
+            _update(h, value.index)
+        if isinstance(value, pd.DataFrame):
+            _update(h, value.columns)
+        value = np.asarray(value)
+    if sparse.issparse(value):
+        value = value.tocsr()
+        if not value.has_sorted_indices:
+            value = value.sorted_indices()
+        feed('sparse', json.dumps(value.shape).encode())
+        for arr in (value.data, value.indices, value.indptr):
+            _update(h, arr)
+    elif isinstance(value, np.random.RandomState):
+        feed('random_state', b'')
+        _update(h, value.get_state())
+    elif isinstance(value, np.ndarray):
+        feed('array', json.dumps([value.dtype.str, value.shape]).encode())
+        if value.dtype == object:
+            value = pd.util.hash_array(value.ravel())
+        feed('data', np.ascontiguousarray(value).data)
+    elif isinstance(value, (list, tuple)):
+        feed('sequence', str(len(value)).encode())
+        for item in value:
+            _update(h, item)
+    elif isinstance(value, dict):
+        feed('mapping', str(len(value)).encode())
+        for k in sorted(value, key=repr):
+            _update(h, k)
+            _update(h, value[k])
+    else:
+        if isinstance(value, np.generic):
+            value = value.item()
+        try:
+            data = json.dumps(value)
+        except TypeError:
+            raise TypeError('Cannot hash {!r}'.format(value))
+        feed('value', data.encode())
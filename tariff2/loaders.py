@@ -1,11 +1,14 @@
 import os
 import sys
 
+import numpy as np
 import pandas as pd
 import yaml
 
 from tariff2 import MODULES, REPO_DIR
-from tariff2.utils import union_NDFrame_indicies
+from tariff2.symptoms import PackedSymptoms, SymptomMatrix
+from tariff2.tariff import best_ranked_causes
+from tariff2.utils import union_NDFrame_indicies, read_csv_chunks
 
 
 def get_gold_standard(dataset, module=None):
@@ -104,15 +107,14 @@ def get_smartva_ranks_file(path, module):
 
 
 def get_smartva_predictions(path, module, rules=True, cause_map=None):
-
-    def best_ranked(series):
-        if len(series.unique()) > 1:
-            return series.sort_values().first_valid_index()
-        else:
-            return float('nan')
-
     ranks = get_smartva_ranks_file(path, module)
-    prediction = ranks.apply(best_ranked, axis=1).fillna(0)
+    prediction = best_ranked_causes(ranks)
+
+    # Records where every cause has the same rank are undetermined
+    values = ranks.values
+    constant = (values == values[:, :1]).all(1) | ranks.isnull().all(1)
+    prediction[constant] = float('nan')
+    prediction = prediction.fillna(0)
     if rules:
         symptom = get_smartva_symptom_file(path, module)
         rules = symptom.cause
@@ -185,35 +187,94 @@ def get_smartva_config(module):
     }
 
 
-def get_X_y(dataset, module, path):
+def get_X_y(dataset, module, path, packed=False, sparse=False):
     """Load the symptoms and gold standards for a given dataset.
 
     Args:
         datasets (str): 'phmrc', 'nhmrc', 'combine'
+        packed (bool): read the symptoms in chunks and pack them into bits
+            so the full matrix is never held as floats
+        sparse (bool): read the symptoms in chunks into a sparse matrix
 
     Returns:
-        X (dataframe): samples by symptoms matrix with prepended metadata
-            columns (age_, sex_, rules_)
+        X (dataframe, PackedSymptoms or SymptomMatrix): samples by symptoms
+            matrix with prepended metadata columns (age_, sex_, rules_). If
+            packed or sparse, the metadata columns are held separately.
         y (series): gold standard cause for each sample
 
     """
-    X = get_smartva_symptom_file(path, module)
     y = get_gold_standard(dataset, module).gs_text46
+    if packed or sparse:
+        chunks = iter_smartva_X(path, module)
+        metadata = ['age_', 'sex_', 'rules_']
+        if packed:
+            X = PackedSymptoms.from_chunks(chunks, metadata)
+        else:
+            X = SymptomMatrix.from_chunks(chunks, metadata)
+        positions = pd.Series(np.arange(len(X)), X.index)
+        positions, y = union_NDFrame_indicies(positions, y)
+        return X.take(positions.values), y
+
+    X = get_smartva_symptom_file(path, module)
 
     X, y = union_NDFrame_indicies(X, y)
 
+    cause_map = get_cause_map(module, 'smartva', 'smartva_text')
+    X = format_smartva_symptoms(X, cause_map)
+
+    return X, y
+
+
+def iter_smartva_X(path, module, chunksize=10000):
+    """Read the symptoms from SmartVA output in chunks
+
+    Symptoms are stored as uint8 (see `utils.read_csv_chunks`) so memory
+    use is bounded by the chunk size.
+
+    Args:
+        path (str): directory of SmartVA output
+        module (str): 'adult', 'child' or 'neonate'
+        chunksize (int): number of samples in each chunk
+
+    Yields:
+        X (dataframe): samples by symptoms matrix with prepended metadata
+            columns (age_, sex_, rules_) formatted as by `get_X_y`
+    """
+    path = os.path.join(path, 'intermediate-files',
+                        '{}-symptom.csv'.format(module))
+    non_binary = ['cause', 'real_age', 'real_gender', 'restricted', 'age.1']
+    cause_map = get_cause_map(module, 'smartva', 'smartva_text')
+
+    chunks = read_csv_chunks(path, chunksize, index_col='sid',
+                             non_binary=non_binary, dtype={'sid': 'str'})
+    for X in chunks:
+        if 'age.1' in X.columns:
+            X = X.drop('age.1', axis=1)
+        yield format_smartva_symptoms(X, cause_map)
+
+
+def format_smartva_symptoms(X, cause_map=None):
+    """Rename the metadata columns of a SmartVA symptom file
+
+    Args:
+        X (dataframe): samples from a SmartVA symptom file
+        cause_map (dict): map from SmartVA causes to the labels used for
+            rule-based predictions
+
+    Returns:
+        X (dataframe): samples by symptoms matrix with prepended metadata
+            columns (age_, sex_, rules_) and missing symptoms set to zero
+    """
     drop_cols = X.columns.intersection(['restricted'])
     metadata_cols = ['age_', 'sex_', 'rules_']
     renames = dict(zip(['real_age', 'real_gender', 'cause'], metadata_cols))
     X = X.rename(columns=renames).drop(drop_cols, axis=1)
 
-    cause_map = get_cause_map(module, 'smartva', 'smartva_text')
-    X.rules_ = X.rules_.replace(cause_map)
+    if cause_map:
+        X.rules_ = X.rules_.replace(cause_map)
 
     symp_cols = X.columns.drop(metadata_cols)
     X[symp_cols] = X[symp_cols].fillna(0)
 
     col_order = [*metadata_cols, *symp_cols]
-    X = X[col_order]
-
-    return X, y
+    return X[col_order]
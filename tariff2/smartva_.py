@@ -60,15 +60,33 @@ RESTRICTIONS = {
 
 
 class SmartvaClassifier(TariffClassifier):
-    def __init__(self, path, module, short=False):
+    """Tariff classifier using the tariffs and training data from SmartVA
+
+    The demographic restrictions of the module are applied when predicting
+    if the test data has the metadata columns they use. By default the
+    test data is only symptoms, and no cause is restricted.
+
+    Parameters:
+        path (str): path to the SmartVA repo
+        module (str): 'adult', 'child' or 'neonate'
+        short (bool): use the short form symptoms
+        keep_intermediates (bool): see `TariffClassifier`
+        n_jobs (int): see `TariffClassifier`
+        metadata (sequence): labels of the metadata columns which come
+            before the symptoms in the test data, such as
+            ('age_', 'sex_', 'rules_'). See `TariffClassifier`.
+    """
+
+    def __init__(self, path, module, short=False, keep_intermediates=True,
+                 n_jobs=1, metadata=()):
+        super().__init__(
+            precision=0.5, top_n_symptoms=40, redistribute=True,
+            metadata=metadata, n_jobs=n_jobs,
+            keep_intermediates=keep_intermediates)
         self.path = path
         self.module = module
         self.short = short
 
-        self.precision = 0.5
-        self.top_n_symptoms = 40
-        self.redistribute = True
-
     def fit(self, *args, **kwargs):
         tariff_data = load_smartva_tariff_data(self.path, self.module)
         self.min_cause_score = tariff_data.MIN_CAUSE_SCORE
@@ -81,15 +99,19 @@ class SmartvaClassifier(TariffClassifier):
 
         validated = load_smartva_validated_data(self.path, self.module)
         trained = self.process_training_data(validated, tariffs, tariff_data)
-        X_uniform, y_uniform, cutoff_scores, cutoff_ranks = trained
+        X_uniform, y_uniform, weights, cutoff_scores, cutoff_ranks = trained
 
         self.tariffs_ = tariffs
         self.n_causes_ = len(self.causes_)
         self.symptoms_ = tariffs.columns.values
         self.X_uniform_ = X_uniform
         self.y_uniform_ = y_uniform
+        self.uniform_weights_ = weights
+        self._prepare_scoring(tariffs, X_uniform, weights)
         self.cutoff_scores_ = cutoff_scores
         self.cutoff_ranks_ = cutoff_ranks
+        self.restrictions = RESTRICTIONS[self.module]
+        self._compile_plan()
 
         return self
 
@@ -129,8 +151,12 @@ class SmartvaClassifier(TariffClassifier):
 
         # Jump through hoops to make the results match SmartVA (see below)
         # I'm looking at you reversed sorted key function.. oO
-        new_index = np.repeat(*zip(*sorted(tariff_data.FREQUENCIES.items(),
-                                           key=lambda x: x[0], reverse=True)))
+        # Each record is kept once with its frequency as its weight, which
+        # ranks the same as repeating it that many times in place
+        new_index, weights = zip(*sorted(tariff_data.FREQUENCIES.items(),
+                                         key=lambda x: x[0], reverse=True))
+        new_index = list(new_index)
+        weights = np.array(weights)
         X_uniform = scored.loc[new_index].values
         y_uniform = causes.loc[new_index].values
 
@@ -139,14 +165,10 @@ class SmartvaClassifier(TariffClassifier):
         y_num_uniform = causes_num.loc[new_index].values - 1
 
         cutoffs = self.calc_cutoffs(X_uniform, y_num_uniform,
-                                    self.cause_pct_cutoff)
+                                    self.cause_pct_cutoff, weights)
         cutoff_scores, cutoff_ranks = cutoffs
 
-        return X_uniform, y_uniform, cutoff_scores, cutoff_ranks
-
-    def predict(self, *args, **kwargs):
-        kwargs['restrictions'] = RESTRICTIONS[self.module]
-        return super(SmartvaClassifier, self).predict(*args, **kwargs)
+        return X_uniform, y_uniform, weights, cutoff_scores, cutoff_ranks
 
 
 if __name__ == '__main__':
@@ -165,14 +187,18 @@ if __name__ == '__main__':
         args.smartva = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                                     '..', '..', 'smartva')
 
-    clf = SmartvaClassifier(args.smartva, args.module).fit()
+    clf = SmartvaClassifier(args.smartva, args.module,
+                            metadata=('age_', 'sex_')).fit()
 
     # Columns must be in the same order as the tariff matrix and all columns
-    # must be present with valid values
+    # must be present with valid values. The ages and sexes come first for
+    # the restrictions.
     df = get_smartva_symptom_file(args.input, args.module)
     X = df.loc[:, clf.tariffs_.columns].fillna(0)
+    X.insert(0, 'age_', df.real_age)
+    X.insert(1, 'sex_', df.real_gender)
 
-    results = clf.predict(X, ages=df.real_age, sexes=df.real_gender)
+    results, _ = clf.predict(X)
 
     results.name = 'Prediction'
     results.index.name = 'sid'
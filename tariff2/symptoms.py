@@ -0,0 +1,481 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.utils.validation import check_array, column_or_1d
+
+
+# Number of set bits in every byte
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class PackedSymptoms(object):
+    """Binary symptom matrix packed into bits
+
+    Each symptom is stored as a vector of bits over the samples, eight
+    samples to a byte (see `np.packbits`), so the matrix takes one bit per
+    cell instead of eight bytes as float64. The samples endorsing a symptom
+    within a group of samples are counted by a popcount of the bitwise and
+    of the symptom bits and the bits of the group, and the samples
+    endorsing any of several symptoms are found with a bitwise or, without
+    unpacking the matrix.
+
+    Non-binary columns, such as the metadata used for restrictions, are
+    kept unpacked in a separate dataframe.
+
+    Args:
+        bits (np.array): packed samples by symptoms uint8 matrix with
+            ceil(n_samples / 8) rows
+        n_samples (int): number of samples
+        columns (list-like): symptom labels
+        index (list-like): sample labels. Defaults to positions if there
+            are symptom labels.
+        metadata (dataframe): non-binary columns for each sample
+
+    Attributes:
+        shape (tuple): number of samples and symptoms
+    """
+
+    # Number of samples unpacked at a time by `take`, a multiple of eight
+    block_size = 2 ** 16
+
+    def __init__(self, bits, n_samples, columns=None, index=None,
+                 metadata=None):
+        bits = np.asarray(bits, dtype=np.uint8)
+        if bits.ndim != 2 or bits.shape[0] != -(-n_samples // 8):
+            raise ValueError('Packed bits do not match {} samples'
+                             .format(n_samples))
+        self.bits = bits
+        self.shape = (n_samples, bits.shape[1])
+        self.columns = None if columns is None else pd.Index(columns)
+        self.index = None if index is None else pd.Index(index)
+        if self.columns is not None and self.index is None:
+            self.index = pd.RangeIndex(n_samples)
+        self.metadata = metadata
+        if self.columns is not None and len(self.columns) != self.shape[1]:
+            raise ValueError('Expected {} column labels'
+                             .format(self.shape[1]))
+        for labels in (self.index, metadata):
+            if labels is not None and len(labels) != n_samples:
+                raise ValueError('Expected {} samples'.format(n_samples))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @classmethod
+    def from_dense(cls, X, metadata=None):
+        """Pack a matrix of binary symptoms
+
+        Args:
+            X (array-like): samples by symptoms matrix of binaries
+            metadata (list-like): labels of non-binary columns of a
+                dataframe which are kept unpacked
+
+        Returns:
+            packed (PackedSymptoms)
+        """
+        columns = index = meta = None
+        if isinstance(X, pd.DataFrame):
+            if metadata is not None and len(metadata):
+                meta = X[list(metadata)]
+                X = X.drop(list(metadata), axis=1)
+            columns, index = X.columns, X.index
+        elif metadata is not None and len(metadata):
+            raise ValueError('Metadata columns need dataframe input')
+
+        X = check_array(X, dtype=None)
+        if not np.all((X == 1) | (X == 0)):
+            raise ValueError('Some symptoms are not binary.')
+        bits = np.packbits(X.astype(bool), axis=0)
+        return cls(bits, X.shape[0], columns, index, meta)
+
+    @classmethod
+    def from_chunks(cls, chunks, metadata=None):
+        """Pack chunks of binary symptoms one chunk at a time
+
+        Only one chunk is unpacked in memory at a time if every chunk but
+        the last has a multiple of eight samples.
+
+        Args:
+            chunks (iterable): chunks of samples as accepted by
+                `from_dense` with the same columns
+            metadata (list-like): see `from_dense`
+
+        Returns:
+            packed (PackedSymptoms)
+        """
+        return cls.concat([cls.from_dense(X, metadata) for X in chunks])
+
+    @classmethod
+    def concat(cls, parts):
+        """Join packed matrices of the same symptoms by sample
+
+        Args:
+            parts (list of PackedSymptoms)
+
+        Returns:
+            packed (PackedSymptoms)
+        """
+        if not parts:
+            raise ValueError('Nothing to concatenate')
+        first = parts[0]
+        if any(part.shape[1] != first.shape[1] for part in parts):
+            raise ValueError('All parts must have the same symptoms')
+        if all(len(part) % 8 == 0 for part in parts[:-1]):
+            bits = np.concatenate([part.bits for part in parts])
+        else:
+            dense = np.concatenate([part.to_dense() for part in parts])
+            bits = np.packbits(dense, axis=0)
+
+        index = metadata = None
+        if all(part.index is not None for part in parts):
+            index = first.index.append([part.index for part in parts[1:]])
+        if all(part.metadata is not None for part in parts):
+            metadata = pd.concat([part.metadata for part in parts])
+        return cls(bits, sum(map(len, parts)), first.columns, index,
+                   metadata)
+
+    def to_dense(self, start=0, stop=None):
+        """Unpack a range of samples
+
+        Args:
+            start (int): first sample
+            stop (int): end of the range of samples. Defaults to the last.
+
+        Returns:
+            X (np.array): samples by symptoms uint8 matrix of binaries
+        """
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        stop = max(start, stop)
+        offset = start % 8
+        dense = np.unpackbits(self.bits[start // 8:-(-stop // 8)], axis=0)
+        return dense[offset:offset + stop - start]
+
+    def to_frame(self, start=0, stop=None):
+        """Unpack a range of samples as a labelled dataframe
+
+        The metadata columns are prepended to the symptoms.
+
+        Args:
+            start (int): first sample
+            stop (int): end of the range of samples. Defaults to the last.
+
+        Returns:
+            X (dataframe): samples by symptoms matrix of binaries
+        """
+        rows = slice(start, stop)
+        index = self.index[rows] if self.index is not None else \
+            pd.RangeIndex(self.shape[0])[rows]
+        columns = self.columns if self.columns is not None else \
+            pd.RangeIndex(self.shape[1])
+        X = pd.DataFrame(self.to_dense(start, stop), index, columns)
+        if self.metadata is not None:
+            metadata = self.metadata.iloc[rows].set_axis(index, axis=0)
+            X = pd.concat([metadata, X], axis=1)
+        return X
+
+    def take(self, rows):
+        """Select samples by position
+
+        Only the bits of the selected samples are unpacked, a block of
+        samples at a time, so selecting a few samples is cheap and
+        selecting many never unpacks more than one block.
+
+        Args:
+            rows (array-like or slice): positions of samples, or a boolean
+                mask
+
+        Returns:
+            packed (PackedSymptoms)
+        """
+        if not isinstance(rows, slice):
+            rows = np.asarray(rows)
+            if rows.dtype != bool:
+                rows = rows.astype(np.intp)
+        rows = np.arange(self.shape[0])[rows]
+
+        bits = [np.empty((0, self.shape[1]), dtype=np.uint8)]
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            shifts = (7 - block % 8).astype(np.uint8)[:, None]
+            dense = (self.bits[block // 8] >> shifts) & 1
+            bits.append(np.packbits(dense, axis=0))
+
+        index = None if self.index is None else self.index[rows]
+        metadata = None if self.metadata is None else \
+            self.metadata.iloc[rows]
+        return PackedSymptoms(np.concatenate(bits), len(rows), self.columns,
+                              index, metadata)
+
+    def count_endorsements(self, y):
+        """Count samples and symptom endorsements by cause
+
+        Args:
+            y (list-like): causes for each sample
+
+        Returns:
+            causes (np.array): sorted unique causes
+            n_samples (np.array): number of samples for each cause
+            counts (np.array): causes by symptoms matrix of endorsement
+                counts
+        """
+        y = column_or_1d(y)
+        causes, y_num, n_samples = np.unique(y, return_inverse=True,
+                                             return_counts=True)
+        counts = np.empty((causes.shape[0], self.shape[1]), dtype=np.int64)
+        for i in range(causes.shape[0]):
+            group = np.packbits(y_num == i)[:, None]
+            counts[i] = POPCOUNT[self.bits & group].sum(0, dtype=np.int64)
+        return causes, n_samples, counts
+
+    def weighted_sums(self, weights):
+        """Sum the symptoms with weights for each sample
+
+        Samples at the same position within their byte are unpacked
+        together with a shift and a mask, and multiplied by their weights,
+        so only an eighth of the matrix is unpacked at a time.
+
+        Args:
+            weights (array-like): sets of weights by samples matrix
+
+        Returns:
+            sums (np.array): sets of weights by symptoms matrix of weighted
+                sums
+        """
+        weights = np.atleast_2d(np.asarray(weights, dtype=float))
+        if weights.shape[1] != self.shape[0]:
+            raise ValueError('Expected weights for {} samples'
+                             .format(self.shape[0]))
+        padded = np.zeros((weights.shape[0], self.bits.shape[0] * 8))
+        padded[:, :self.shape[0]] = weights
+
+        sums = np.zeros((weights.shape[0], self.shape[1]))
+        for k in range(8):
+            endorsed = (self.bits >> (7 - k)) & 1
+            sums += padded[:, k::8].dot(endorsed.astype(float))
+        return sums
+
+    def any_endorsed(self, symptoms):
+        """Find samples which endorse any of the given symptoms
+
+        Args:
+            symptoms (array-like): positions of symptoms, or a boolean mask
+
+        Returns:
+            endorsed (np.array): boolean for each sample
+        """
+        bits = np.bitwise_or.reduce(self.bits[:, symptoms], axis=1)
+        return np.unpackbits(bits, count=self.shape[0]).astype(bool)
+
+
+class SymptomMatrix(object):
+    """Binary symptom matrix which has already been validated
+
+    Checking that symptoms are binary scans the whole matrix and allocates
+    two boolean temporaries of the same shape. Symptoms are checked once
+    when the matrix is built, and functions given a `SymptomMatrix` use
+    its values as they are. Values which are known to be binary, such as
+    the values of another matrix, are not checked if `binary` is given.
+
+    Non-binary columns, such as the metadata used for restrictions, are
+    kept in a separate dataframe as for `PackedSymptoms`. Sparse values
+    (see `from_sparse`) are kept sparse.
+
+    Args:
+        values (array-like or sparse matrix): samples by symptoms matrix
+            of binaries, stored as uint8. Sparse matrices are stored as CSR.
+        columns (list-like): symptom labels
+        index (list-like): sample labels. Defaults to positions if there
+            are symptom labels.
+        metadata (dataframe): non-binary columns for each sample
+        binary (bool): the values have already been checked to be binary
+
+    Attributes:
+        shape (tuple): number of samples and symptoms
+    """
+
+    def __init__(self, values, columns=None, index=None, metadata=None,
+                 binary=False):
+        if sparse.issparse(values):
+            values = sparse.csr_matrix(values)
+            checked = values.data
+        else:
+            values = np.asarray(values)
+            checked = values
+        if values.ndim != 2:
+            raise ValueError('Expected a samples by symptoms matrix')
+        # Check before casting, which would truncate fractions to binaries
+        if not binary and not np.all((checked == 1) | (checked == 0)):
+            raise ValueError('Some symptoms are not binary.')
+        if sparse.issparse(values):
+            values = values.astype(np.uint8)
+        else:
+            values = np.ascontiguousarray(values, dtype=np.uint8)
+        self.values = values
+        self.shape = values.shape
+        self.columns = None if columns is None else pd.Index(columns)
+        self.index = None if index is None else pd.Index(index)
+        if self.columns is not None and self.index is None:
+            self.index = pd.RangeIndex(self.shape[0])
+        self.metadata = metadata
+        if self.columns is not None and len(self.columns) != self.shape[1]:
+            raise ValueError('Expected {} column labels'
+                             .format(self.shape[1]))
+        for labels in (self.index, metadata):
+            if labels is not None and len(labels) != self.shape[0]:
+                raise ValueError('Expected {} samples'.format(self.shape[0]))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @classmethod
+    def from_dense(cls, X, metadata=None):
+        """Validate a matrix of binary symptoms
+
+        Args:
+            X (array-like): samples by symptoms matrix of binaries
+            metadata (list-like): labels of non-binary columns of a
+                dataframe which are kept separately
+
+        Returns:
+            matrix (SymptomMatrix)
+        """
+        columns = index = meta = None
+        if isinstance(X, pd.DataFrame):
+            if metadata is not None and len(metadata):
+                meta = X[list(metadata)]
+                X = X.drop(list(metadata), axis=1)
+            columns, index = X.columns, X.index
+        elif metadata is not None and len(metadata):
+            raise ValueError('Metadata columns need dataframe input')
+
+        X = check_array(X, dtype=None)
+        if not np.all((X == 1) | (X == 0)):
+            raise ValueError('Some symptoms are not binary.')
+        return cls(X, columns, index, meta, binary=True)
+
+    @classmethod
+    def from_sparse(cls, X, columns=None, index=None, metadata=None):
+        """Validate a sparse matrix of binary symptoms
+
+        Only the stored values are checked so the matrix is never made
+        dense.
+
+        Args:
+            X (sparse matrix): samples by symptoms matrix of binaries
+            columns (list-like): symptom labels
+            index (list-like): sample labels
+            metadata (dataframe): non-binary columns for each sample
+
+        Returns:
+            matrix (SymptomMatrix)
+        """
+        X = check_array(X, accept_sparse='csr', dtype=None)
+        if not np.all((X.data == 1) | (X.data == 0)):
+            raise ValueError('Some symptoms are not binary.')
+        return cls(X, columns, index, metadata, binary=True)
+
+    @classmethod
+    def from_chunks(cls, chunks, metadata=None):
+        """Validate chunks of binary symptoms into a sparse matrix
+
+        Only one chunk is dense in memory at a time.
+
+        Args:
+            chunks (iterable): chunks of samples as accepted by
+                `from_dense` with the same columns
+            metadata (list-like): see `from_dense`
+
+        Returns:
+            matrix (SymptomMatrix): symptoms with sparse values
+        """
+        parts = []
+        for X in chunks:
+            part = cls.from_dense(X, metadata)
+            part.values = sparse.csr_matrix(part.values)
+            parts.append(part)
+        return cls.concat(parts)
+
+    @classmethod
+    def concat(cls, parts):
+        """Join matrices of the same symptoms by sample
+
+        The values are sparse if any part is sparse.
+
+        Args:
+            parts (list of SymptomMatrix)
+
+        Returns:
+            matrix (SymptomMatrix)
+        """
+        if not parts:
+            raise ValueError('Nothing to concatenate')
+        first = parts[0]
+        if any(part.shape[1] != first.shape[1] for part in parts):
+            raise ValueError('All parts must have the same symptoms')
+        if any(sparse.issparse(part.values) for part in parts):
+            values = sparse.vstack([part.values for part in parts],
+                                   format='csr')
+        else:
+            values = np.concatenate([part.values for part in parts])
+
+        index = metadata = None
+        if all(part.index is not None for part in parts):
+            index = first.index.append([part.index for part in parts[1:]])
+        if all(part.metadata is not None for part in parts):
+            metadata = pd.concat([part.metadata for part in parts])
+        return cls(values, first.columns, index, metadata, binary=True)
+
+    def take(self, rows):
+        """Select samples by position
+
+        Selecting a slice of samples does not copy dense values.
+
+        Args:
+            rows (slice or array-like): positions of samples, or a boolean
+                mask
+
+        Returns:
+            matrix (SymptomMatrix)
+        """
+        index = None if self.index is None else self.index[rows]
+        metadata = None if self.metadata is None else \
+            self.metadata.iloc[rows]
+        return SymptomMatrix(self.values[rows], self.columns, index,
+                             metadata, binary=True)
+
+    def to_dense(self, start=0, stop=None):
+        """Get a range of samples, without copying unless sparse
+
+        Args:
+            start (int): first sample
+            stop (int): end of the range of samples. Defaults to the last.
+
+        Returns:
+            X (np.array): samples by symptoms uint8 matrix of binaries
+        """
+        if sparse.issparse(self.values):
+            return self.values[start:stop].toarray()
+        return self.values[start:stop]
+
+    def to_frame(self, start=0, stop=None):
+        """Get a range of samples as a labelled dataframe
+
+        The metadata columns are prepended to the symptoms.
+
+        Args:
+            start (int): first sample
+            stop (int): end of the range of samples. Defaults to the last.
+
+        Returns:
+            X (dataframe): samples by symptoms matrix of binaries
+        """
+        rows = slice(start, stop)
+        index = self.index[rows] if self.index is not None else \
+            pd.RangeIndex(self.shape[0])[rows]
+        columns = self.columns if self.columns is not None else \
+            pd.RangeIndex(self.shape[1])
+        X = pd.DataFrame(self.to_dense(start, stop), index, columns)
+        if self.metadata is not None:
+            metadata = self.metadata.iloc[rows].set_axis(index, axis=0)
+            X = pd.concat([metadata, X], axis=1)
+        return X
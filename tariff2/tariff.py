@@ -1,8 +1,14 @@
 from __future__ import division, print_function
 
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+
 import numexpr as ne
 import numpy as np
 import pandas as pd
+from scipy import sparse, stats
 from sklearn.base import BaseEstimator, ClassifierMixin
 from sklearn.utils import check_random_state
 from sklearn.utils.validation import (
@@ -13,7 +19,24 @@ from sklearn.utils.validation import (
     column_or_1d,
 )
 
-from tariff2.utils import make_mask, is_uncertain
+from tariff2.cache import ArtifactCache, check_cache
+from tariff2.symptoms import PackedSymptoms, SymptomMatrix
+from tariff2.utils import (
+    make_mask,
+    effective_n_jobs,
+    read_csv_chunks,
+    StreamingUI,
+)
+
+
+LOG = logging.getLogger('tariff2.tariff')
+
+BOOTSTRAP_ENGINES = ('pandas', 'multinomial')
+BOOTSTRAP_METHODS = ('resample', 'binomial')
+INTERMEDIATES = ('metadata', 'scored', 'ranked', 'certain', 'valid', 'pred')
+PLAN_FORMAT = 1
+PLAN_MANIFEST = 'manifest.json'
+TARIFF_CACHE_FORMAT = 1
 
 
 class TariffClassifier(BaseEstimator, ClassifierMixin):
@@ -50,6 +73,42 @@ class TariffClassifier(BaseEstimator, ClassifierMixin):
             and are removed from the symptoms matrix. Column values which are
             currently used are: age, sex, region, rules.
         random_state (None, int, or np.RandomState): seed value
+        bootstrap_engine (str): implementation used to resample the training
+            data when testing tariff significance. See
+            `boostrap_endorsements_by_causes` for details.
+        bootstrap_method (str): 'resample' bootstraps records within each
+            cause. 'binomial' draws each cause-symptom endorsement rate
+            independently from the per-cause endorsement counts.
+        n_jobs (int): number of threads used to bootstrap. Draws are split
+            into one block per thread and each block has its own random
+            stream derived from `random_state`. Results are reproducible for
+            a given seed and value of `n_jobs`. Also the default number of
+            threads used to predict, which does not change the predictions.
+        bootstrap_block_size (int): if given, bootstrap draws are processed
+            this many at a time and only the draws needed for the bounds of
+            the uncertainty interval are kept. This bounds the memory used
+            for large numbers of bootstraps.
+        sequential_bootstrap (bool): stop bootstrapping once the
+            significance of every tariff is stable. `bootstraps` is then
+            the maximum number of draws.
+        sequential_confidence (float): confidence between 0 and 1 needed
+            for the significance of a tariff to be considered stable when
+            bootstrapping sequentially
+        sequential_tolerance (float): fraction of tariffs which may still
+            be unstable when sequential bootstrapping stops. With the
+            default of zero, it stops once every tariff is stable.
+        keep_intermediates (bool): store the intermediate results of the
+            last call to `predict` on the classifier, including each
+            metadata column under its label. If False, nothing from the
+            test data is kept on the classifier and the intermediate
+            results are not calculated. They can be retrieved for given
+            test samples with `predict_intermediates`.
+        cache (str or ArtifactCache): directory in which to cache the
+            tariffs if `random_state` is given. Refitting on the same
+            training data with the same seed and tariff parameters then
+            skips the bootstrap, so only the parameters used after it,
+            such as the cutoffs, can be changed cheaply. See
+            `make_tariff_matrix`.
 
     Attributes:
         X_ (np.array): samples by symptoms binary matrix of training data
@@ -57,20 +116,42 @@ class TariffClassifier(BaseEstimator, ClassifierMixin):
         symptoms_ (np.array): labels for symptoms
         causes_ (np.array): unique causes
         n_causes_ (int): number of unique causes
+        cause_counts_ (np.array): number of training samples for each cause
+        endorsement_counts_ (np.array): causes by symptoms matrix of the
+            number of training samples endorsing each symptom
         tariffs_ (dataframe): causes by symptoms tariff matrix
         X_uniform_ (np.array): samples by causes matrix of tariff scores for
             the training data which has been resampled to a uniform cause
-            distribution
+            distribution. Each resampled sample is kept once.
         y_uniform_ (np.array): causes for each sample in X_uniform_
+        uniform_weights_ (np.array): number of times each sample in
+            X_uniform_ was resampled
+        X_uniform_sorted_ (np.array): X_uniform_ with the scores for each
+            cause sorted in ascending order. Used for ranking.
+        uniform_cum_weights_ (np.array): cumulative weights of the sorted
+            scores (see `sort_weighted_scores`)
         cutoff_ranks_ (np.array): rank of cutoff values by cause
         cutoff_scores_ (np.array): scores at cutoff values
+        tariff_codes_ (np.array): tariffs as integer multiples of the
+            precision, or None if the tariffs are not rounded
+        sparse_tariffs_ (sparse matrix): tariffs used for scoring. Its
+            non-zero columns select the symptoms which are scored (see
+            `score_samples`).
+        rank_table_ (RankTable): ranks of every possible score, or None
+        plan_ (InferencePlan): compiled steps used to predict
+        metadata_, scored_, ranked_, certain_, valid_, pred_: intermediate
+            results of the last call to `predict` if `keep_intermediates`
     """
 
     def __init__(self, precision=0.5, bootstraps=500, tariffs_ui=95,
                  top_n_symptoms=40, min_cause_score=0, cause_pct_cutoff=100,
                  overall_pct_cutoff=100, redistribute=True, random_state=None,
                  spurious_associations=None, metadata=None, censoring=None,
-                 restrictions=None):
+                 restrictions=None, bootstrap_engine='pandas',
+                 bootstrap_method='resample', n_jobs=1,
+                 bootstrap_block_size=None, sequential_bootstrap=False,
+                 sequential_confidence=0.95, sequential_tolerance=0,
+                 keep_intermediates=True, cache=None):
         self.precision = precision
         self.bootstraps = bootstraps
         self.tariffs_ui = tariffs_ui
@@ -87,63 +168,273 @@ class TariffClassifier(BaseEstimator, ClassifierMixin):
         except TypeError:
             self.metadata = ()
         self.restrictions = restrictions
+        self.bootstrap_engine = bootstrap_engine
+        self.bootstrap_method = bootstrap_method
+        self.n_jobs = n_jobs
+        self.bootstrap_block_size = bootstrap_block_size
+        self.sequential_bootstrap = sequential_bootstrap
+        self.sequential_confidence = sequential_confidence
+        self.sequential_tolerance = sequential_tolerance
+        self.keep_intermediates = keep_intermediates
+        self.cache = cache
 
     def fit(self, X, y):
         """Train the classifier
 
         Args:
-            X (array-like): samples by symptoms matrix of binary training data
+            X (array-like, sparse matrix, PackedSymptoms or SymptomMatrix):
+                samples by symptoms matrix of binary training data. Packed
+                symptoms and symptom matrices hold the metadata separately.
             y (list-like): true causes for each sample
 
         Returns:
             self
         """
-        input_is_df = isinstance(X, pd.DataFrame)
-        symptoms = X.columns if input_is_df else None
-        check_X_y(X, y, dtype=None)
+        X = self._training_symptoms(X, y)
+        self.X_ = X
+        self.y_ = y
+        rs = check_random_state(self.random_state)
+        # Without a seed the tariffs are never the same twice
+        cache = self.cache
+        if self.random_state is None:
+            cache = None
+
+        # Validate the symptoms once for training and the uniform list
+        X = _validated(X)
+        _, n_samples, counts = count_endorsements(*_check_X_y(X, y))
+        self.cause_counts_ = n_samples
+        self.endorsement_counts_ = counts
+
+        tariffs = make_tariff_matrix(X, y, bootstraps=self.bootstraps,
+                                     ui=self._tariffs_ui(),
+                                     top_n=self.top_n_symptoms,
+                                     precision=self.precision,
+                                     spurious=self.spurious_associations,
+                                     random_state=rs,
+                                     bootstrap_engine=self.bootstrap_engine,
+                                     bootstrap_method=self.bootstrap_method,
+                                     n_jobs=self.n_jobs,
+                                     block_size=self.bootstrap_block_size,
+                                     sequential=self.sequential_bootstrap,
+                                     **self._sequential_params(),
+                                     cache=cache)
+        self._fit_uniform(X, y, *tariffs, random_state=rs)
+        return self
+
+    def partial_fit(self, X, y):
+        """Add training samples to the classifier
+
+        The tariffs and their significance are recalculated from the stored
+        endorsement counts by cause plus the counts of the new samples, so
+        the old samples are not bootstrapped again. This needs the
+        'binomial' bootstrap method, whose draws only depend on the counts.
+        Every training sample is scored again with the new tariffs for the
+        uniform list, which is a single matrix product.
+
+        With an integer `random_state` the result is the same as fitting
+        all the samples at once. If the classifier is not fitted, this is
+        the same as `fit`. Loaded artifacts (see `load_artifact`) do not
+        keep the training samples so cannot be updated.
+
+        Args:
+            X: new training samples as accepted by `fit`, of the same type
+                and with the same symptoms as the samples already fitted
+            y (list-like): true causes for each new sample
+
+        Returns:
+            self
+        """
+        if not hasattr(self, 'causes_'):
+            return self.fit(X, y)
+        if not hasattr(self, 'endorsement_counts_'):
+            raise ValueError('partial_fit needs the training samples and '
+                             'counts, which loaded artifacts do not keep')
+        if self.bootstrap_method != 'binomial':
+            raise ValueError('partial_fit needs the "binomial" bootstrap '
+                             'method since resampling needs every sample')
+
+        X = self._training_symptoms(X, y)
+        if type(X) is not type(self.X_) and not \
+                (sparse.issparse(X) and sparse.issparse(self.X_)):
+            raise ValueError('New samples must be the same type as the '
+                             'samples already fitted')
+        labelled = _is_labelled(X)
+        if X.shape[1] != len(self.symptoms_) or \
+                labelled and not X.columns.equals(pd.Index(self.symptoms_)):
+            raise ValueError('New samples must have the same symptoms as '
+                             'the samples already fitted')
+
+        X_new = _validated(X)
+        new_causes, new_n, new_counts = count_endorsements(
+            *_check_X_y(X_new, y))
+        causes = np.union1d(self.causes_, new_causes)
+        n_samples = np.zeros(causes.shape[0], dtype=np.int64)
+        counts = np.zeros((causes.shape[0], X.shape[1]))
+        for old, n, endorsed in [(self.causes_, self.cause_counts_,
+                                  self.endorsement_counts_),
+                                 (new_causes, new_n, new_counts)]:
+            rows = np.searchsorted(causes, old)
+            n_samples[rows] += n
+            counts[rows] += endorsed
+        self.cause_counts_ = n_samples
+        self.endorsement_counts_ = counts
+
+        self.X_ = _concat_samples(self.X_, X)
+        if isinstance(self.y_, pd.Series) and isinstance(y, pd.Series):
+            self.y_ = pd.concat([self.y_, y])
+        else:
+            self.y_ = np.concatenate([column_or_1d(self.y_),
+                                      column_or_1d(y)])
+        rs = check_random_state(self.random_state)
+
+        tariffs = make_tariff_matrix_from_counts(
+            causes, n_samples, counts, X.columns if labelled else None,
+            bootstraps=self.bootstraps, ui=self._tariffs_ui(),
+            random_state=rs, spurious=self.spurious_associations,
+            top_n=self.top_n_symptoms, precision=self.precision,
+            n_jobs=self.n_jobs, block_size=self.bootstrap_block_size,
+            sequential=self.sequential_bootstrap,
+            **self._sequential_params())
+        self._fit_uniform(_verified(self.X_), self.y_, *tariffs,
+                          random_state=rs)
+        return self
+
+    def _training_symptoms(self, X, y):
+        """Validate training samples and remove the metadata columns"""
+        if isinstance(X, PackedSymptoms):
+            _check_X_y(X, y)
+            return PackedSymptoms(X.bits, X.shape[0], X.columns, X.index)
+        if isinstance(X, SymptomMatrix):
+            _check_X_y(X, y)
+            return SymptomMatrix(X.values, X.columns, X.index, binary=True)
 
+        check_X_y(X, y, accept_sparse='csr', dtype=None)
         if self.metadata:
-            if input_is_df:
+            if isinstance(X, pd.DataFrame):
                 X = X.drop(list(self.metadata), axis=1)
-                symptoms = symptoms[3:]
             else:
                 X = X[:, len(self.metadata):]
+        return X
 
-        if symptoms is None:
-            symptoms = np.arange(X.shape[1])
+    def _tariffs_ui(self):
+        """Bounds of the uncertainty interval used for significance"""
+        ui_tail = (100 - self.tariffs_ui) / 2
+        return (ui_tail, 100 - ui_tail)
 
-        self.X_ = X
-        self.y_ = y
-        rs = check_random_state(self.random_state)
+    def _sequential_params(self):
+        """Stopping criterion of the sequential bootstrap"""
+        return dict(confidence=self.sequential_confidence,
+                    tolerance=self.sequential_tolerance)
 
-        ui_tail = (100 - self.tariffs_ui) / 2
-        ui = (ui_tail, 100 - ui_tail)
-        tariffs = make_tariff_matrix(X, y, bootstraps=self.bootstraps,
-                                     ui=ui, top_n=self.top_n_symptoms,
-                                     precision=self.precision,
-                                     spurious=self.spurious_associations,
-                                     random_state=rs)
-        tariffs, causes, symptoms = tariffs
+    def _fit_uniform(self, X, y, tariffs, causes, symptoms, random_state):
+        """Store the tariffs and fit the uniform list and cutoffs
+
+        Args:
+            X: validated training samples (see `_validated`)
+            y (list-like): true causes for each sample
+            tariffs, causes, symptoms: as returned by `make_tariff_matrix`
+            random_state (np.RandomState): random state after the bootstrap
+        """
+        rs = random_state
         self.causes_ = causes
         self.n_causes_ = causes.shape[0]
         self.symptoms_ = symptoms
         self.tariffs_ = tariffs
 
-        X_uniform, y_uniform = generate_uniform_list(X, y, tariffs,
-                                                     random_state=rs)
+        uniform = generate_weighted_uniform_list(X, y, tariffs,
+                                                 random_state=rs)
+        X_uniform, y_uniform, uniform_weights = uniform
         self.X_uniform_ = X_uniform
         self.y_uniform_ = y_uniform
+        self.uniform_weights_ = uniform_weights
+        self._prepare_scoring(tariffs, X_uniform, uniform_weights)
 
         cause_encoding = dict(zip(causes, range(self.n_causes_)))
         y_uniform_num = pd.Series(y_uniform).map(cause_encoding).values
-        cutoffs = calc_cutoffs(X_uniform, y_uniform_num, self.cause_pct_cutoff)
+        cutoffs = calc_cutoffs(X_uniform, y_uniform_num, self.cause_pct_cutoff,
+                               uniform_weights)
         cutoff_scores, cutoff_ranks = cutoffs
         self.cutoff_scores_ = cutoff_scores
         self.cutoff_ranks_ = cutoff_ranks
+        self._compile_plan()
 
-        return self
+    def _prepare_scoring(self, tariffs, X_uniform, weights=None):
+        """Prepare the tariffs and uniform list for predicting
+
+        If the tariffs are rounded to the precision, they are stored as
+        small integers (`tariff_codes_`) and test samples are scored with
+        exact integer arithmetic. The uniform list scores are stored in the
+        same integer units, sorted for a binary search, along with a table
+        of the rank of every possible score (`rank_table_`) so test samples
+        can be ranked with a single lookup. Otherwise the float tariffs
+        and scores are used and both attributes are None.
+
+        Only the top symptoms for each cause have non-zero tariffs, so the
+        tariffs used for scoring are also stored as a sparse matrix
+        (`sparse_tariffs_`). Symptoms without a non-zero tariff for any
+        cause are dropped before scoring, but the remaining tariffs are
+        multiplied as a dense matrix.
+
+        Args:
+            tariffs (array-like): causes by symptoms matrix of tariffs
+            X_uniform (array-like): samples by causes matrix of tariff
+                scores of the uniform list
+            weights (array-like): number of times each sample is repeated
+                in the uniform list
+        """
+        self.tariff_codes_ = None
+        self.rank_table_ = None
+        if self.precision:
+            try:
+                self.tariff_codes_ = encode_scores(tariffs, self.precision)
+                X_uniform = encode_scores(X_uniform, self.precision)
+            except ValueError as e:
+                self.tariff_codes_ = None
+                LOG.debug('Scoring with float tariffs: %s', e)
+
+        if self.tariff_codes_ is not None:
+            self.sparse_tariffs_ = sparse.csr_matrix(self.tariff_codes_)
+        else:
+            self.sparse_tariffs_ = sparse.csr_matrix(check_array(tariffs))
 
-    def predict(self, X):
+        self.uniform_cum_weights_ = None
+        if weights is None:
+            self.X_uniform_sorted_ = sort_scores(X_uniform)
+        else:
+            self.X_uniform_sorted_, self.uniform_cum_weights_ = \
+                sort_weighted_scores(X_uniform, weights)
+        if self.tariff_codes_ is not None:
+            try:
+                self.rank_table_ = RankTable(
+                    self.X_uniform_sorted_,
+                    cum_weights=self.uniform_cum_weights_)
+            except ValueError as e:
+                LOG.debug('Ranking by binary search: %s', e)
+
+    def _compile_plan(self):
+        """Compile the inference plan used to predict (`plan_`)
+
+        The plan is built from the fitted tariffs and uniform list and the
+        thresholds, censoring and restrictions set when the classifier was
+        fit.
+        """
+        scale = self.precision if self.tariff_codes_ is not None else 1
+        n_uniform = self.X_uniform_.shape[0]
+        if self.uniform_cum_weights_ is not None:
+            n_uniform = int(self.uniform_cum_weights_[-1, 0])
+        self.plan_ = InferencePlan(
+            self.sparse_tariffs_, self.X_uniform_sorted_, self.causes_,
+            rank_table=self.rank_table_,
+            cum_weights=self.uniform_cum_weights_,
+            min_score=np.asarray(self.min_cause_score) / scale,
+            cutoff_ranks=self.cutoff_ranks_,
+            overall_cutoff=n_uniform * self.overall_pct_cutoff / 100,
+            censor_mask=make_mask(self.censoring, self.symptoms_,
+                                  self.causes_),
+            restrictions=compile_restrictions(self.causes_,
+                                              self.restrictions))
+
+    def predict(self, X, n_jobs=None):
         """Predict for test samples
 
         If the input array is a dataframe, the predictions will be returned as
@@ -151,110 +442,316 @@ class TariffClassifier(BaseEstimator, ClassifierMixin):
         Otherwise the results will be returned as numpy arrays/
 
         Args:
-            X (array-like): samples by symptoms matrix of binary testing data
+            X (array-like, sparse matrix, PackedSymptoms or SymptomMatrix):
+                samples by symptoms matrix of binary testing data
+            n_jobs (int): number of threads. Chunks of samples are predicted
+                concurrently and reassembled in input order. Defaults to the
+                `n_jobs` of the classifier.
 
         Returns:
             pred (list-like): individual level predictions
         """
-        check_is_fitted(self, ['causes_', 'tariffs_', 'X_uniform_',
-                               'cutoff_ranks_'])
+        pred, results = self._predict(X, self.keep_intermediates, n_jobs)
+
+        for label in INTERMEDIATES:
+            vars(self).pop('{}_'.format(label), None)
+        for label in self.metadata:
+            vars(self).pop(label, None)
+        for label, values in (results or dict()).items():
+            setattr(self, '{}_'.format(label), values)
+        # Each metadata column is also kept under its own label
+        for label in self.metadata if results else ():
+            setattr(self, label, results['metadata'][label])
+
+        return pred, pred.value_counts(dropna=False, normalize=True)
+
+    def predict_iter(self, X, chunksize=10000):
+        """Predict for test samples one chunk at a time
+
+        Intermediate results are not calculated or stored, so memory use is
+        bounded by the size of the chunks.
+
+        Args:
+            X: test samples as accepted by `predict`, an iterable of chunks
+                of test samples or the path to a CSV file of test samples
+                with the index in the first column
+            chunksize (int): number of samples in each chunk if `X` is not
+                already an iterable of chunks
+
+        Yields:
+            pred (series): individual level predictions for each chunk
+        """
+        offset = 0
+        for chunk in iter_chunks(X, chunksize, self.metadata):
+            pred = self._predict(chunk, intermediates=False)[0]
+            if not _is_labelled(chunk):
+                pred.index = pd.RangeIndex(offset, offset + len(pred))
+            offset += len(pred)
+            yield pred
+
+    def predict_file(self, X, path, chunksize=10000):
+        """Predict for test samples one chunk at a time and save to a file
+
+        The predictions for each chunk are appended to a CSV file as soon
+        as they are made.
+
+        Args:
+            X: test samples as accepted by `predict_iter`
+            path (str): path to the output CSV file
+            chunksize (int): number of samples in each chunk if `X` is not
+                already an iterable of chunks
+        """
+        with open(path, 'w') as f:
+            for i, pred in enumerate(self.predict_iter(X, chunksize)):
+                pred.rename('prediction').to_csv(f, header=i == 0)
+
+    def predict_intermediates(self, X):
+        """Calculate the intermediate results of predicting test samples
+
+        Args:
+            X (array-like): samples by symptoms matrix of binary testing data
+
+        Returns:
+            results (dict): the metadata, scores, ranks, ranks which are
+                certain, valid ranks and predictions keyed by 'metadata',
+                'scored', 'ranked', 'certain', 'valid' and 'pred'
+        """
+        return self._predict(X, intermediates=True)[1]
+
+    def _predict(self, X, intermediates=True, n_jobs=None):
+        """Predict for test samples
+
+        Args:
+            X (array-like, sparse matrix, PackedSymptoms or SymptomMatrix):
+                samples by symptoms matrix of binary testing data
+            intermediates (bool): also calculate the intermediate results
+            n_jobs (int): number of threads. Defaults to the `n_jobs` of the
+                classifier.
+
+        Returns:
+            pred (series): individual level predictions
+            results (dict or None): intermediate results by name (see
+                `predict_intermediates`)
+        """
+        check_is_fitted(self, ['causes_', 'tariffs_', 'plan_'])
 
-        input_is_df = isinstance(X, pd.DataFrame)
+        input_is_df = _is_labelled(X)
         df_index = X.index.copy() if input_is_df else None
 
-        if input_is_df:
+        metadata = dict()
+        if isinstance(X, (PackedSymptoms, SymptomMatrix)):
             for label in self.metadata:
-                setattr(self, label, X[label])
+                metadata[label] = np.asarray(X.metadata[label])
+        elif input_is_df:
+            for label in self.metadata:
+                metadata[label] = np.asarray(X[label])
             X = X.drop(list(self.metadata), axis=1)
         else:
             for i, label in enumerate(self.metadata):
-                setattr(self, label, X[:, i])
+                values = X[:, i]
+                if sparse.issparse(values):
+                    values = values.toarray().ravel()
+                metadata[label] = np.asarray(values)
             X = X[:, len(self.metadata):]
 
-        X = check_array(X)
-
-        if not ((X == 1) | (X == 0)).all().all():
-            raise ValueError('Some symptoms are not binary.')
+        if not isinstance(X, (PackedSymptoms, SymptomMatrix)):
+            X = check_array(X, accept_sparse='csr')
+        if n_jobs is None:
+            n_jobs = self.n_jobs
+        pred, results = self.plan_.run(X, metadata, intermediates, n_jobs)
+        pred = pd.Series(pred, df_index)
 
-        scored = score_samples(X, self.tariffs_)
-        ranked = rank_samples(scored, self.X_uniform_)
-        certain = mask_uncertain(scored, ranked, self.X_uniform_.shape[0],
-                                 min_score=self.min_cause_score,
-                                 cutoffs=self.cutoff_ranks_,
-                                 min_pct=self.overall_pct_cutoff)
-        uncensored = censor_predictions(X, certain, self.censoring,
-                                        self.causes_, self.symptoms_)
-        metadata = {label: np.asarray(getattr(self, label))
-                    for label in self.metadata}
-        valid = apply_restrictions(uncensored, self.causes_, metadata,
-                                   self.restrictions)
-
-        valid = pd.DataFrame(valid, df_index, self.causes_)
-        pred = valid.apply(best_ranked, axis=1)
-
-        rules = getattr(self, 'rules_', np.full(X.shape[0], np.nan))
+        rules = metadata.get('rules_', np.full(X.shape[0], np.nan))
         rules = pd.Series(rules, df_index)
         pred[rules.notnull()] = rules
 
         if input_is_df:
-            metadata = pd.DataFrame(metadata, df_index)
-            scored = pd.DataFrame(scored, df_index, self.causes_)
-            ranked = pd.DataFrame(ranked, df_index, self.causes_)
-            certain = pd.DataFrame(certain, df_index, self.causes_)
-            uncensored = pd.DataFrame(uncensored, df_index, self.causes_)
-            valid = pd.DataFrame(valid, df_index, self.causes_)
-            pred = pd.Series(pred, df_index, name='prediction')
+            pred.name = 'prediction'
 
         if not np.issubdtype(self.causes_.dtype.type, np.number):
             pred = pred.fillna('Undetermined')
 
-        self.metadata_ = metadata
-        self.scored_ = scored
-        self.ranked_ = ranked
-        self.certain_ = certain
-        self.valid_ = valid
-        self.pred_ = pred
+        if results is None:
+            return pred, None
 
-        return pred, pred.value_counts(dropna=False, normalize=True)
+        if self.tariff_codes_ is not None:
+            results['scored'] = results['scored'] * self.precision
+
+        # The valid ranks have always been a dataframe
+        results['valid'] = pd.DataFrame(results['valid'], df_index,
+                                        self.causes_)
+        if input_is_df:
+            metadata = pd.DataFrame(metadata, df_index)
+            for label in ['scored', 'ranked', 'certain']:
+                results[label] = pd.DataFrame(results[label], df_index,
+                                              self.causes_)
+        results['metadata'] = metadata
+        results['pred'] = pred
 
-    def predict_csmf(self, X):
+        return pred, results
+
+    def predict_csmf(self, X, chunksize=10000):
         """Predict cause-specific mortality fractions
 
+        Samples are predicted one chunk at a time and only the number of
+        predictions of each cause is kept, so memory use does not grow with
+        the number of samples.
+
         Args:
-            X (array-like): samples by symptoms matrix of binary testing data
+            X: test samples as accepted by `predict_iter`
+            chunksize (int): number of samples in each chunk if `X` is not
+                already an iterable of chunks
 
         Returns:
-            csmf (series): cause-specific mortality fractions
+            csmf (series): cause-specific mortality fractions. If
+                `redistribute` is False, the undetermined fraction is
+                labelled with NaN.
         """
-        pred = self.predict(X, undetermined=np.nan)
-        csmf = pred.value_counts(dropna=False) / len(pred)
-        csmf = csmf.loc[list(self.causes_) + [np.nan]].fillna(0)
+        counts = pd.Series(0, index=list(self.causes_) + [np.nan])
+        for pred in self.predict_iter(X, chunksize):
+            chunk_counts = pred.value_counts(dropna=False)
+            chunk_counts = chunk_counts.rename({'Undetermined': np.nan})
+            counts = counts.add(chunk_counts, fill_value=0)
+
+        # Rules may predict causes which are not in the training data
+        extra = counts.index.difference(self.causes_).dropna()
+        counts = counts.reindex(list(self.causes_) + list(extra) + [np.nan])
+        csmf = counts / counts.sum()
 
         if self.redistribute:
-            rdp_csmf = self.get_undetermined_proportions()
-            csmf = self.redistribution(csmf, rdp_csmf)
+            proportions = get_undetermined_proportions(self.causes_)
+            csmf = redistribution(csmf, proportions)
 
         return csmf
 
+    def save_artifact(self, path):
+        """Save what is needed to predict as a directory of `.npy` files
+
+        Only the inference plan, labels, tariffs, cutoffs and parameters are
+        saved, not the training data or uniform list, so the artifact is
+        much smaller than a pickle of the classifier. Load it with
+        `load_artifact`, which memory-maps the largest arrays. A
+        `RandomState` is saved as None and a cache as its directory.
+
+        Args:
+            path (str): directory to save to. It is created if needed.
+        """
+        check_is_fitted(self, ['causes_', 'tariffs_', 'plan_'])
+        params = {name: _encode_param(getattr(self, name))
+                  for name in TariffClassifier._get_param_names()}
+        arrays = dict(symptoms=_label_array(self.symptoms_),
+                      float_tariffs=check_array(self.tariffs_),
+                      cutoff_ranks=np.asarray(self.cutoff_ranks_),
+                      cutoff_scores=np.asarray(self.cutoff_scores_))
+        self.plan_.save(path, arrays, params=params,
+                        encoded=self.tariff_codes_ is not None,
+                        dataframe=isinstance(self.tariffs_, pd.DataFrame))
+
+
+def _is_labelled(X):
+    """Whether symptoms have labels to return results as dataframes"""
+    if isinstance(X, (PackedSymptoms, SymptomMatrix)):
+        return X.columns is not None
+    return isinstance(X, pd.DataFrame)
+
+
+def _is_binary(X):
+    """Whether symptoms are known to be binary without checking"""
+    return isinstance(X, (PackedSymptoms, SymptomMatrix))
+
+
+def _check_X_y(X, y):
+    """Validate binary symptoms and causes, keeping packed symptoms packed
+
+    Packed symptoms and symptom matrices are not checked again. As
+    with arrays, the labels and metadata are not kept.
+    """
+    if _is_binary(X):
+        y = column_or_1d(y)
+        check_consistent_length(X, y)
+        if isinstance(X, PackedSymptoms):
+            return PackedSymptoms(X.bits, X.shape[0]), y
+        return X.values, y
+    X, y = check_X_y(X, y, accept_sparse='csr', dtype=None)
+    values = X.data if sparse.issparse(X) else X
+    if not np.all((values == 1) | (values == 0)):
+        raise ValueError('Some symptoms are not binary.')
+    return X, y
+
+
+def _validated(X):
+    """Check symptoms once, keeping their labels for the results
+
+    Symptoms which are packed or already in a symptom matrix are returned
+    as they are.
+    """
+    if sparse.issparse(X):
+        return SymptomMatrix.from_sparse(X)
+    if isinstance(X, (PackedSymptoms, SymptomMatrix)):
+        return X
+    return SymptomMatrix.from_dense(X)
+
+
+def _verified(X):
+    """Wrap symptoms which have already been checked to be binary"""
+    if isinstance(X, (PackedSymptoms, SymptomMatrix)):
+        return X
+    if isinstance(X, pd.DataFrame):
+        return SymptomMatrix(X.values, X.columns, X.index, binary=True)
+    return SymptomMatrix(X, binary=True)
+
+
+def _concat_samples(X, X_new):
+    """Join training samples of the same type"""
+    if isinstance(X, pd.DataFrame):
+        return pd.concat([X, X_new])
+    if isinstance(X, (PackedSymptoms, SymptomMatrix)):
+        return type(X).concat([X, X_new])
+    if sparse.issparse(X):
+        return sparse.vstack([X, X_new], format='csr')
+    return np.concatenate([X, X_new])
+
+
+def _rows(X, start, stop):
+    """Get a range of samples, unpacking packed symptoms"""
+    if isinstance(X, PackedSymptoms):
+        return X.to_dense(start, stop)
+    if isinstance(X, SymptomMatrix):
+        X = X.values
+    return X[start:stop]
+
+
+def _weighted_sums(weights, X):
+    """Multiply a matrix of weights by dense or sparse symptoms"""
+    if sparse.issparse(X):
+        return np.asarray(X.T.dot(weights.T)).T
+    return weights.dot(np.asarray(X, dtype=float))
+
 
 def calc_tariffs(X, y):
     """Calculate the tariffs for all cause-symptom pairs
 
     Args:
-        X (matrix-like): samples by symptoms matrix of binaries
+        X (matrix-like, sparse matrix or PackedSymptoms): samples by
+            symptoms matrix of binaries
         y (list-like): causes for each sample
 
     Returns:
         tariffs (np.array or dataframe)
     """
-    check_X_y(X, y, dtype=None)
-    if not ((X == 1) | (X == 0)).all().all():
-        raise ValueError('Some symptoms are not binary.')
-
-    tariffs = pd.DataFrame(X).groupby(y).mean() \
-                .apply(tariffs_from_endorsements, axis=0, raw=True)
+    input_is_df = _is_labelled(X)
+    symptoms = X.columns if input_is_df else None
+    X, y = _check_X_y(X, y)
+    if isinstance(X, PackedSymptoms) or sparse.issparse(X):
+        causes, n_samples, counts = count_endorsements(X, y)
+        endorsements = counts / n_samples[:, None]
+        tariffs = pd.DataFrame(tariffs_from_endorsements(endorsements),
+                               causes, symptoms)
+    else:
+        tariffs = pd.DataFrame(X, columns=symptoms).groupby(y).mean() \
+                    .apply(tariffs_from_endorsements, axis=0, raw=True)
 
-    if isinstance(X, pd.DataFrame):
+    if input_is_df:
         tariffs.index.name = 'causes'
         tariffs.columns.name = 'symptoms'
     else:
@@ -262,31 +759,255 @@ def calc_tariffs(X, y):
     return tariffs
 
 
-def tariffs_from_endorsements(arr):
+def tariffs_from_endorsements(arr, axis=0):
     """Calculate tariffs from a array of endorsement rates
 
+    Tariffs are calculated across causes. For multidimensional arrays the
+    cause axis must be specified and tariffs are calculated independently
+    for every other position.
+
     Args:
         arr (np.array): endorsement rates
+        axis (int): axis of the causes
 
     Returns:
         tariff values (np.array)
     """
-    pct25, median, pct75 = np.percentile(arr, [25, 50, 75])
-    iqr = pct75 - pct25 or 0.001
+    arr = np.asarray(arr)
+    pct25, median, pct75 = np.percentile(arr, [25, 50, 75], axis=axis,
+                                         keepdims=True)
+    iqr = pct75 - pct25
+    iqr[iqr == 0] = 0.001
     return ne.evaluate("(arr - median) / iqr")
 
 
-def boostrap_endorsements_by_causes(X, y, bootstraps=500, random_state=None):
-    """
+def boostrap_endorsements_by_causes(X, y, bootstraps=500, random_state=None,
+                                    engine='pandas', method='resample',
+                                    n_jobs=1):
+    """Bootstrap endorsement rates within each cause
 
+    See `bootstrap_endorsements` for a description of the engines and
+    methods.
+
+    Args:
+        X (matrix-like): samples by symptoms matrix of binaries
+        y (list-like): causes for each sample
+        bootstraps (int): number of bootstraps
+        random_state (None, int, np.RandomState): seed
+        engine (str): 'pandas' or 'multinomial'
+        method (str): 'resample' or 'binomial'
+        n_jobs (int): number of threads
 
     Returns:
         (dataframe): endorsement rates multi-indexed by cause and draw
     """
-    check_X_y(X, y, dtype=None)
-    if not np.all((X == 1) | (X == 0)):
-        raise ValueError('Some symptoms are not binary.')
+    columns = X.columns if isinstance(X, pd.DataFrame) else None
+    causes, endorsements = bootstrap_endorsements(X, y, bootstraps,
+                                                  random_state, engine, method,
+                                                  n_jobs)
+    index = pd.MultiIndex.from_product([causes, np.arange(bootstraps)],
+                                       names=('cause', 'draw'))
+    endorsements = endorsements.transpose(1, 0, 2) \
+                               .reshape(-1, endorsements.shape[2])
+    return pd.DataFrame(endorsements, index, columns)
+
+
+def bootstrap_endorsements(X, y, bootstraps=500, random_state=None,
+                           engine='pandas', method='resample', n_jobs=1):
+    """Bootstrap endorsement rates within each cause as a dense array
+
+    The 'pandas' engine resamples rows of the symptom data for each cause
+    and averages them by draw. This copies every resampled row. The
+    'multinomial' engine instead draws a draws by samples matrix of resample
+    counts for each cause and calculates the endorsements with a single
+    matrix product against the symptom data. No rows are copied. Both are
+    reproducible for a given seed, but do not produce the same draws.
+
+    The 'binomial' method skips resampling records entirely. Each
+    cause-symptom endorsement rate is drawn independently as
+    Binomial(n_cause, p_cause_symptom) / n_cause. This matches the
+    marginal distribution of each cell under the 'resample' method, but
+    not the correlation between symptoms within a draw. Tariffs and their
+    significance are calculated one symptom at a time, so only the
+    marginals matter there. The engine is ignored for this method.
+
+    With more than one job, the draws are split into one block per job and
+    the blocks are bootstrapped concurrently in a thread pool. Each block
+    draws from its own RandomState seeded from `random_state`, so the
+    results are identical for a given seed and number of jobs regardless of
+    scheduling. Different numbers of jobs give different, but statistically
+    equivalent, draws. The numpy random number generators and matrix
+    products release the GIL, so the 'multinomial' engine and 'binomial'
+    method benefit the most.
+
+    Args:
+        X (matrix-like): samples by symptoms matrix of binaries
+        y (list-like): causes for each sample
+        bootstraps (int): number of bootstraps
+        random_state (None, int, np.RandomState): seed
+        engine (str): 'pandas' or 'multinomial'
+        method (str): 'resample' or 'binomial'
+        n_jobs (int): number of threads. -1 uses all CPUs.
+
+    Returns:
+        causes (np.array): sorted unique causes
+        endorsements (np.array): draws by causes by symptoms array of
+            endorsement rates
+    """
+    causes, blocks = bootstrap_endorsement_blocks(X, y, bootstraps,
+                                                  random_state, engine, method,
+                                                  n_jobs)
+    blocks = list(blocks)
+    if len(blocks) == 1:
+        return causes, blocks[0]
+    return causes, np.concatenate(blocks)
+
+
+def bootstrap_endorsement_blocks(X, y, bootstraps=500, random_state=None,
+                                 engine='pandas', method='resample', n_jobs=1,
+                                 block_size=None):
+    """Bootstrap endorsement rates within each cause in blocks of draws
+
+    The draws are split into blocks of `block_size` draws, or into one block
+    per job if no block size is given. A single block uses `random_state`
+    directly. Otherwise each block draws from its own RandomState seeded
+    from `random_state`, so the draws only depend on the seed and the
+    blocking, not on the scheduling. With a fixed block size the results
+    are identical for any number of jobs. Blocks are bootstrapped `n_jobs`
+    at a time and yielded in order, so at most `n_jobs` blocks are held in
+    memory at once.
+
+    See `bootstrap_endorsements` for a description of the other arguments.
+
+    Args:
+        block_size (int): number of draws per block
+
+    Returns:
+        causes (np.array): sorted unique causes
+        blocks (iterator): draws by causes by symptoms arrays of endorsement
+            rates
+    """
+    X, y = _check_X_y(X, y)
+    if engine not in BOOTSTRAP_ENGINES:
+        raise ValueError('Unknown bootstrap engine: "{}"'.format(engine))
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError('Unknown bootstrap method: "{}"'.format(method))
+
+    if method == 'binomial':
+        causes, n_samples, counts = count_endorsements(X, y)
+        return causes, binomial_endorsement_blocks(
+            n_samples, counts, bootstraps, random_state, n_jobs, block_size)
+
+    causes = np.unique(y)
+
+    def draw(size, rs):
+        return _bootstrap_endorsements(X, y, causes, size, rs, engine, method)
+
+    return causes, _draw_blocks(draw, bootstraps, random_state, n_jobs,
+                                block_size)
+
+
+def binomial_endorsement_blocks(n_samples, counts, bootstraps=500,
+                                random_state=None, n_jobs=1, block_size=None):
+    """Bootstrap endorsement rates from counts in blocks of draws
+
+    The draws are the same as the 'binomial' method of
+    `bootstrap_endorsement_blocks` for samples with these counts, which
+    only depend on the counts.
+
+    Args:
+        n_samples (np.array): number of samples for each cause
+        counts (np.array): causes by symptoms matrix of endorsement counts
+        bootstraps (int): number of bootstraps
+        random_state (None, int, np.RandomState): seed
+        n_jobs (int): number of threads. -1 uses all CPUs.
+        block_size (int): number of draws per block
+
+    Returns:
+        blocks (iterator): draws by causes by symptoms arrays of endorsement
+            rates
+    """
+    def draw(size, rs):
+        return binomial_endorsements(counts, n_samples, size, rs)
+
+    return _draw_blocks(draw, bootstraps, random_state, n_jobs, block_size)
+
+
+def _draw_blocks(draw, bootstraps, random_state, n_jobs, block_size):
+    """Split draws into blocks and draw them concurrently
+
+    See `bootstrap_endorsement_blocks` for how the draws are blocked and
+    seeded.
+
+    Args:
+        draw (callable): draws a block given the number of draws and a
+            RandomState
+
+    Returns:
+        blocks (iterator): the blocks in order
+    """
     rs = check_random_state(random_state)
+    n_jobs = effective_n_jobs(n_jobs)
+
+    if block_size:
+        sizes = [block_size] * (bootstraps // block_size)
+        if bootstraps % block_size:
+            sizes.append(bootstraps % block_size)
+    else:
+        n_blocks = min(n_jobs, bootstraps)
+        sizes = [len(block)
+                 for block in np.array_split(range(bootstraps), n_blocks)]
+
+    if len(sizes) == 1:
+        # A generator, like the threaded blocks, so it can be closed early
+        return (block for block in [draw(bootstraps, rs)])
+
+    seeds = rs.randint(np.iinfo(np.int32).max, size=len(sizes))
+
+    def bootstrap_block(args):
+        size, seed = args
+        return draw(size, np.random.RandomState(seed))
+
+    def iter_blocks():
+        with ThreadPoolExecutor(n_jobs) as executor:
+            for start in range(0, len(sizes), n_jobs):
+                wave = zip(sizes[start:start + n_jobs],
+                           seeds[start:start + n_jobs])
+                for block in executor.map(bootstrap_block, wave):
+                    yield block
+
+    return iter_blocks()
+
+
+def _bootstrap_endorsements(X, y, causes, bootstraps, rs, engine, method):
+    """Bootstrap endorsement rates using a single random stream
+
+    This is a "private" version of `bootstrap_endorsements` which does not
+    perform input validation.
+
+    Returns:
+        endorsements (np.array): draws by causes by symptoms array of
+            endorsement rates
+    """
+    if method == 'binomial':
+        _, n_samples, counts = count_endorsements(X, y)
+        return binomial_endorsements(counts, n_samples, bootstraps, rs)
+
+    if engine == 'multinomial':
+        take = X.take if isinstance(X, PackedSymptoms) else X.__getitem__
+        return np.stack([
+            multinomial_endorsements(take(y == cause), bootstraps, rs)
+            for cause in causes
+        ], axis=1)
+
+    if isinstance(X, PackedSymptoms):
+        X = X.to_dense()
+
+    if sparse.issparse(X):
+        return np.stack([
+            _resampled_endorsements(X[y == cause], bootstraps, rs)
+            for cause in causes
+        ], axis=1)
 
     def bootstrapped_endorsements(df):
         n_samples = df.shape[0] * bootstraps
@@ -294,13 +1015,103 @@ def boostrap_endorsements_by_causes(X, y, bootstraps=500, random_state=None):
                  .groupby(np.repeat(np.arange(bootstraps), df.shape[0])).mean()
 
     endorsements = pd.DataFrame(X).groupby(y).apply(bootstrapped_endorsements)
-    endorsements.index.names = ('cause', 'draw')
+    return endorsements.values.astype(float) \
+                       .reshape(causes.shape[0], bootstraps, -1) \
+                       .transpose(1, 0, 2)
+
+
+def _resampled_endorsements(X, bootstraps, rs):
+    """Bootstrap endorsement rates with the draws of the pandas engine
+
+    The rows are drawn as by the 'pandas' engine, and the number of times
+    each row is drawn in each bootstrap is multiplied by the symptoms, so
+    sparse symptoms are not made dense.
+    """
+    n_samples = X.shape[0]
+    draws = rs.randint(n_samples, size=n_samples * bootstraps)
+    draws += np.repeat(np.arange(bootstraps) * n_samples, n_samples)
+    counts = np.bincount(draws, minlength=n_samples * bootstraps)
+    counts = counts.reshape(bootstraps, n_samples)
+    return _weighted_sums(counts, X) / n_samples
+
+
+def multinomial_endorsements(X, bootstraps=500, random_state=None):
+    """Bootstrap endorsement rates from resample counts
+
+    Resampling n rows with replacement is equivalent to drawing the number
+    of times each row is selected from a multinomial distribution with n
+    trials and equal probabilities. The endorsement sums for every draw are
+    then the product of the counts and the symptom matrix.
+
+    Args:
+        X (np.array, sparse matrix or PackedSymptoms): samples by symptoms
+            matrix of binaries for one cause
+        bootstraps (int): number of bootstraps
+        random_state (None, int, np.RandomState): seed
+
+    Returns:
+        endorsements (np.array): draws by symptoms matrix of endorsement rates
+    """
+    rs = check_random_state(random_state)
+    n_samples = X.shape[0]
+    counts = rs.multinomial(n_samples, np.full(n_samples, 1 / n_samples),
+                            size=bootstraps)
+    if isinstance(X, PackedSymptoms):
+        return X.weighted_sums(counts) / n_samples
+    return _weighted_sums(counts, X) / n_samples
+
+
+def count_endorsements(X, y):
+    """Count samples and symptom endorsements by cause
+
+    These are sufficient statistics for the tariff matrix of binary data.
+
+    Args:
+        X (np.array, sparse matrix or PackedSymptoms): samples by symptoms
+            matrix of binaries
+        y (np.array): causes for each sample
+
+    Returns:
+        causes (np.array): sorted unique causes
+        n_samples (np.array): number of samples for each cause
+        counts (np.array): causes by symptoms matrix of endorsement counts
+    """
+    if isinstance(X, PackedSymptoms):
+        return X.count_endorsements(y)
+    causes, y_num, n_samples = np.unique(y, return_inverse=True,
+                                         return_counts=True)
+    onehot = np.zeros((causes.shape[0], y_num.shape[0]))
+    onehot[y_num, np.arange(y_num.shape[0])] = 1
+    counts = _weighted_sums(onehot, X)
+    return causes, n_samples, counts
+
+
+def binomial_endorsements(counts, n_samples, bootstraps=500,
+                          random_state=None):
+    """Bootstrap endorsement rates independently for each cause-symptom pair
 
-    return endorsements
+    Args:
+        counts (np.array): causes by symptoms matrix of endorsement counts
+        n_samples (np.array): number of samples for each cause
+        bootstraps (int): number of bootstraps
+        random_state (None, int, np.RandomState): seed
+
+    Returns:
+        endorsements (np.array): draws by causes by symptoms array of
+            endorsement rates
+    """
+    rs = check_random_state(random_state)
+    n_samples = np.asarray(n_samples)[:, None]
+    p = np.asarray(counts) / n_samples
+    draws = rs.binomial(n_samples, p, size=(bootstraps,) + p.shape)
+    return draws / n_samples
 
 
 def calc_insignificant_tariffs(X, y, bootstraps=500, ui=(2.5, 97.5),
-                               random_state=None):
+                               random_state=None, engine='pandas',
+                               method='resample', n_jobs=1, block_size=None,
+                               return_ui=False, sequential=False,
+                               confidence=0.95, tolerance=0):
     """Bootstrap symptom data to determine which tariffs are signficant
 
     Tariff values for insignificant tariffs are set to zero. This is
@@ -311,35 +1122,259 @@ def calc_insignificant_tariffs(X, y, bootstraps=500, ui=(2.5, 97.5),
     significance.The tariff value is from the original input data, not the
     mean across bootstrap draws.
 
+    If a block size is given, the draws are bootstrapped and reduced one
+    block at a time. Only the draws needed for the exact uncertainty
+    interval bounds are kept (see `StreamingUI`) instead of every draw.
+    This allows thousands of draws for wide intervals without holding all
+    of them in memory. The draws depend on the block size (see
+    `bootstrap_endorsement_blocks`).
+
+    In sequential mode, draws are taken in blocks until the significance of
+    every tariff is stable, up to a maximum of `bootstraps` draws (see
+    `sequential_insignificant_tariffs`). The block size defaults to 50.
+
     Args:
         X: (matrix-like) samples by symptoms matrix of binaries
         y: (list-like): causes for each sample
         n: (int) number of bootstraps
         ui: (float) uncertainty interval between 0 and 100
         random_state (None, int, np.RandomState): seed
+        engine (str): bootstrap engine. See `boostrap_endorsements_by_causes`
+        method (str): bootstrap method. See `boostrap_endorsements_by_causes`
+        n_jobs (int): number of threads. See `bootstrap_endorsements`
+        block_size (int): number of draws to process at a time
+        return_ui (bool): also return the bounds of the uncertainty interval
+        sequential (bool): stop bootstrapping early once the significance of
+            every tariff is stable
+        confidence (float): confidence needed for a decision to be stable in
+            sequential mode
+        tolerance (float): fraction of borderline tariffs allowed when
+            stopping early in sequential mode
 
     Returns:
         insigificance (dataframe): booleans where true indicates
             the tariff is insignificant
+        lower (dataframe): causes by symptoms lower bounds of the tariffs.
+            Only returned if `return_ui` is True.
+        upper (dataframe): causes by symptoms upper bounds of the tariffs.
+            Only returned if `return_ui` is True.
     """
-    input_is_df = isinstance(X, pd.DataFrame)
+    input_is_df = _is_labelled(X)
+    symptoms = X.columns if input_is_df else None
 
     if len(ui) != 2:
         raise ValueError('"ui" must be a 2-tuple of floats')
-    ui = sorted(ui)
 
-    endors = boostrap_endorsements_by_causes(X, y, bootstraps, random_state)
-    insig = endors.groupby(level='draw') \
-                  .apply(lambda df: df.apply(tariffs_from_endorsements,
-                                             raw=True)) \
-                  .groupby(level='cause') \
-                  .apply(lambda df: df.apply(is_uncertain, raw=True, ui=ui))
+    if sequential:
+        block_size = block_size or 50
+    causes, blocks = bootstrap_endorsement_blocks(
+        X, y, bootstraps, random_state, engine, method, n_jobs, block_size)
+    lower, upper = _tariff_bounds(blocks, bootstraps, ui, block_size,
+                                  sequential, confidence, tolerance)
+    insig = (lower <= 0) & (upper >= 0)
+
+    if input_is_df:
+        causes = pd.Index(causes, name='cause')
+        insig = pd.DataFrame(insig, causes, symptoms)
+        lower = pd.DataFrame(lower, causes, symptoms)
+        upper = pd.DataFrame(upper, causes, symptoms)
 
-    if not input_is_df:
-        insig = insig.values
+    if return_ui:
+        return insig, lower, upper
     return insig
 
 
+def insignificant_tariffs_from_counts(n_samples, counts, bootstraps=500,
+                                      ui=(2.5, 97.5), random_state=None,
+                                      n_jobs=1, block_size=None,
+                                      sequential=False, confidence=0.95,
+                                      tolerance=0):
+    """Determine which tariffs are significant from endorsement counts
+
+    The endorsement rates are bootstrapped with the 'binomial' method,
+    which only depends on the number of samples and endorsements of each
+    cause. The results are the same as `calc_insignificant_tariffs` with
+    that method for samples with these counts.
+
+    See `calc_insignificant_tariffs` for a description of the other
+    arguments.
+
+    Args:
+        n_samples (np.array): number of samples for each cause
+        counts (np.array): causes by symptoms matrix of endorsement counts
+
+    Returns:
+        insigificance (np.array): booleans where true indicates the tariff
+            is insignificant
+    """
+    if len(ui) != 2:
+        raise ValueError('"ui" must be a 2-tuple of floats')
+
+    if sequential:
+        block_size = block_size or 50
+    blocks = binomial_endorsement_blocks(n_samples, counts, bootstraps,
+                                         random_state, n_jobs, block_size)
+    lower, upper = _tariff_bounds(blocks, bootstraps, ui, block_size,
+                                  sequential, confidence, tolerance)
+    return (lower <= 0) & (upper >= 0)
+
+
+def _tariff_bounds(blocks, bootstraps, ui, block_size, sequential,
+                   confidence, tolerance):
+    """Reduce blocks of bootstrapped endorsements to tariff bounds
+
+    See `calc_insignificant_tariffs` for the sequential, streaming and
+    all-at-once reductions.
+
+    Returns:
+        lower (np.array): causes by symptoms lower bounds of the tariffs
+        upper (np.array): causes by symptoms upper bounds of the tariffs
+    """
+    if sequential:
+        lower, upper, n_draws, borderline = _sequential_bootstrap(
+            blocks, bootstraps, ui, confidence, tolerance)
+        LOG.debug('Sequential bootstrap used %d draws with %d borderline '
+                  'tariffs', n_draws, borderline.sum())
+    elif block_size:
+        stream = StreamingUI(bootstraps, ui)
+        for endors in blocks:
+            stream.update(tariffs_from_endorsements(endors, axis=1))
+        lower, upper = stream.bounds()
+    else:
+        blocks = list(blocks)
+        endors = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+        lower, upper = calc_tariff_ui(endors, ui)
+    return lower, upper
+
+
+def sequential_insignificant_tariffs(X, y, max_bootstraps=500, batch_size=50,
+                                     ui=(2.5, 97.5), confidence=0.95,
+                                     tolerance=0, random_state=None,
+                                     engine='pandas', method='resample',
+                                     n_jobs=1):
+    """Bootstrap in batches until the significance of the tariffs is stable
+
+    After each batch, the bounds of the uncertainty interval of every
+    tariff are approximated as mean + z * sd of the draws so far, where z
+    is the normal quantile of the bound. A decision is stable once zero is
+    outside the confidence interval of each bound, using the approximate
+    standard error sd * sqrt(1 / n + z ** 2 / (2 * (n - 1))). Tariffs far
+    from zero, or identically zero, settle within a few batches.
+
+    By default, bootstrapping stops once every decision is stable, or after
+    `max_bootstraps` draws. Tariffs with a bound near zero can take many
+    draws to settle, so a `tolerance` allows stopping while that fraction
+    of the tariffs is still borderline. The final decision uses the
+    percentiles of all the draws taken, the same as
+    `calc_insignificant_tariffs`, and matches it exactly with the same
+    block size if every draw is needed.
+
+    See `calc_insignificant_tariffs` for a description of the other
+    arguments.
+
+    Args:
+        max_bootstraps (int): maximum number of draws
+        batch_size (int): number of draws between checks for stability
+        confidence (float): confidence between 0 and 1 needed for a decision
+            to be considered stable
+        tolerance (float): fraction of borderline tariffs allowed when
+            stopping early
+
+    Returns:
+        insigificance (np.array or dataframe): booleans where true indicates
+            the tariff is insignificant
+        n_draws (int): number of draws used
+        borderline (np.array or dataframe): booleans where true indicates
+            the decision had not settled when bootstrapping stopped
+    """
+    input_is_df = _is_labelled(X)
+    symptoms = X.columns if input_is_df else None
+
+    if len(ui) != 2:
+        raise ValueError('"ui" must be a 2-tuple of floats')
+
+    causes, blocks = bootstrap_endorsement_blocks(
+        X, y, max_bootstraps, random_state, engine, method, n_jobs,
+        batch_size)
+    results = _sequential_bootstrap(blocks, max_bootstraps, ui, confidence,
+                                    tolerance)
+    lower, upper, n_draws, borderline = results
+    insig = (lower <= 0) & (upper >= 0)
+
+    if input_is_df:
+        causes = pd.Index(causes, name='cause')
+        insig = pd.DataFrame(insig, causes, symptoms)
+        borderline = pd.DataFrame(borderline, causes, symptoms)
+
+    return insig, n_draws, borderline
+
+
+def _sequential_bootstrap(blocks, max_bootstraps, ui, confidence, tolerance):
+    """Take blocks of bootstrapped endorsements until the decisions are stable
+
+    Returns:
+        lower (np.array): causes by symptoms lower bounds of the tariffs
+        upper (np.array): causes by symptoms upper bounds of the tariffs
+        n_draws (int): number of draws used
+        borderline (np.array): causes by symptoms matrix of booleans where
+            true indicates the decision is not stable
+    """
+    ui = sorted(ui)
+    z_lower, z_upper = stats.norm.ppf(np.true_divide(ui, 100))
+    z = stats.norm.ppf(0.5 + confidence / 2)
+
+    tariffs = None
+    n_draws = 0
+    for endors in blocks:
+        if tariffs is None:
+            tariffs = np.empty((max_bootstraps,) + endors.shape[1:])
+        n_block = endors.shape[0]
+        tariffs[n_draws:n_draws + n_block] = \
+            tariffs_from_endorsements(endors, axis=1)
+        n_draws += n_block
+
+        draws = tariffs[:n_draws]
+        mean = draws.mean(0)
+        sd = draws.std(0, ddof=1) if n_draws > 1 else np.zeros(mean.shape)
+        df = max(n_draws - 1, 1)
+        lower = mean + z_lower * sd
+        upper = mean + z_upper * sd
+        lower_se = sd * np.sqrt(1 / n_draws + z_lower ** 2 / (2 * df))
+        upper_se = sd * np.sqrt(1 / n_draws + z_upper ** 2 / (2 * df))
+
+        significant = (lower > z * lower_se) | (upper < -z * upper_se)
+        insignificant = (lower <= -z * lower_se) & (upper >= z * upper_se)
+        borderline = ~(significant | insignificant)
+        if borderline.mean() <= tolerance:
+            blocks.close()
+            break
+
+    lower, upper = np.percentile(tariffs[:n_draws], ui, axis=0)
+    return lower, upper, n_draws, borderline
+
+
+def calc_tariff_ui(endorsements, ui=(2.5, 97.5)):
+    """Calculate the uncertainty interval of tariffs across bootstrap draws
+
+    Tariffs for every draw are calculated across the cause axis and the
+    bounds are calculated across the draw axis, each in a single vectorized
+    call.
+
+    Args:
+        endorsements (np.array): draws by causes by symptoms array of
+            endorsement rates
+        ui (tuple of 2 floats): lower and upper bounds of uncertainty interval
+            between 0 and 100
+
+    Returns:
+        lower (np.array): causes by symptoms matrix of lower bounds
+        upper (np.array): causes by symptoms matrix of upper bounds
+    """
+    tariffs = tariffs_from_endorsements(endorsements, axis=1)
+    lower, upper = np.percentile(tariffs, sorted(ui), axis=0)
+    return lower, upper
+
+
 def round_tariffs(tariffs, p=0.5, check=True):
     """Round tariffs to a given precision
 
@@ -403,26 +1438,161 @@ def keep_top_symptoms(tariffs, top_n=40):
 
 
 def make_tariff_matrix(X, y, bootstraps=500, ui=(2.5, 97.5), random_state=None,
-                       spurious=None, top_n=40, precision=0.5):
+                       spurious=None, top_n=40, precision=0.5,
+                       bootstrap_engine='pandas', bootstrap_method='resample',
+                       n_jobs=1, block_size=None, sequential=False,
+                       confidence=0.95, tolerance=0, cache=None):
     """Fully process raw symptom data to create a tariff matrix.
 
+    See `calc_insignificant_tariffs` for a description of the bootstrap
+    arguments.
+
     Args:
+        cache (str or ArtifactCache): directory in which to cache the
+            tariffs. The key is a hash of the symptoms, causes, random
+            state and all other arguments, so a cached matrix is only
+            reused for exactly the same inputs and the bootstrap is
+            skipped. A RandomState is left in the same state as if the
+            bootstrap had run. Nothing is cached without a random_state.
 
     Returns:
         tariffs (np.array or dataframe): causes by symptoms matrix of tariffs
         causes (np.array): cause labels as ordered in the tariffs matrix
         symptoms (np.array): symptoms labels as ordered in tariff matrix.
     """
-    input_is_df = isinstance(X, pd.DataFrame)
+    input_is_df = _is_labelled(X)
     symptoms = X.columns if input_is_df else None
-    X, y = check_X_y(X, y, dtype=None)
+    X, y = _check_X_y(X, y)
+
+    cache = check_cache(cache) if random_state is not None else None
+    if cache is not None:
+        symptoms_ = X.bits if isinstance(X, PackedSymptoms) else X
+        key = cache.key(TARIFF_CACHE_FORMAT, type(X).__name__, symptoms_,
+                        X.shape, y, symptoms, random_state, bootstraps, ui,
+                        spurious, top_n, precision, bootstrap_engine,
+                        bootstrap_method, effective_n_jobs(n_jobs),
+                        block_size, sequential, confidence, tolerance)
+        cached = cache.get(key)
+        if cached is not None:
+            LOG.debug('Loaded cached tariffs %s', key)
+            return _cached_tariff_matrix(cached, random_state, input_is_df)
+
+    if not isinstance(X, PackedSymptoms):
+        X = SymptomMatrix(X, binary=True)
     if symptoms is None:
         symptoms = np.arange(X.shape[1])
 
     causes = np.unique(y)
     tariffs = calc_tariffs(X, y)
     insig = calc_insignificant_tariffs(X, y, ui=ui, bootstraps=bootstraps,
-                                       random_state=random_state)
+                                       random_state=random_state,
+                                       engine=bootstrap_engine,
+                                       method=bootstrap_method,
+                                       n_jobs=n_jobs, block_size=block_size,
+                                       sequential=sequential,
+                                       confidence=confidence,
+                                       tolerance=tolerance)
+    tariffs = _significant_tariffs(tariffs, insig, spurious, top_n,
+                                   precision)
+
+    if cache is not None:
+        try:
+            cache.put(key, _tariff_cache_arrays(tariffs, causes, symptoms,
+                                                random_state))
+        except (OSError, ValueError) as e:
+            LOG.debug('Could not cache tariffs: %s', e)
+
+    if input_is_df:
+        tariffs = pd.DataFrame(tariffs, causes, symptoms)
+
+    return tariffs, causes, symptoms
+
+
+def _tariff_cache_arrays(tariffs, causes, symptoms, random_state):
+    """Arrays needed to restore the result of `make_tariff_matrix`"""
+    arrays = dict(tariffs=tariffs, causes=_label_array(causes),
+                  object_causes=np.asarray(causes.dtype == object),
+                  symptoms=_label_array(symptoms))
+    if isinstance(random_state, np.random.RandomState):
+        _, keys, pos, has_gauss, cached_gaussian = random_state.get_state()
+        arrays.update(state_keys=keys, state_pos=np.asarray(pos),
+                      state_gauss=np.array([has_gauss, cached_gaussian]))
+    return arrays
+
+
+def _cached_tariff_matrix(arrays, random_state, input_is_df):
+    """Restore the result of `make_tariff_matrix` from the cache"""
+    tariffs = arrays['tariffs']
+    causes = arrays['causes']
+    if arrays['object_causes']:
+        causes = causes.astype(object)
+    symptoms = _from_label_array(arrays['symptoms'])
+    if 'state_keys' in arrays:
+        has_gauss, cached_gaussian = arrays['state_gauss']
+        random_state.set_state(('MT19937', arrays['state_keys'],
+                                int(arrays['state_pos']), int(has_gauss),
+                                cached_gaussian))
+
+    if input_is_df:
+        symptoms = pd.Index(symptoms)
+        tariffs = pd.DataFrame(tariffs, causes, symptoms)
+    return tariffs, causes, symptoms
+
+
+def make_tariff_matrix_from_counts(causes, n_samples, counts, symptoms=None,
+                                   bootstraps=500, ui=(2.5, 97.5),
+                                   random_state=None, spurious=None,
+                                   top_n=40, precision=0.5, n_jobs=1,
+                                   block_size=None, sequential=False,
+                                   confidence=0.95, tolerance=0):
+    """Create a tariff matrix from endorsement counts by cause
+
+    The counts are sufficient statistics for the tariffs and, with the
+    'binomial' bootstrap method, for their significance. The tariffs are
+    the same as from `make_tariff_matrix` with that method for samples
+    with these counts, so samples can be added by adding their counts.
+
+    See `make_tariff_matrix` for a description of the other arguments.
+
+    Args:
+        causes (array-like): sorted cause labels
+        n_samples (array-like): number of samples for each cause
+        counts (array-like): causes by symptoms matrix of endorsement counts
+        symptoms (list-like): symptom labels. If given, the tariffs are
+            returned as a dataframe.
+
+    Returns:
+        tariffs (np.array or dataframe): causes by symptoms matrix of tariffs
+        causes (np.array): cause labels as ordered in the tariffs matrix
+        symptoms (np.array): symptoms labels as ordered in tariff matrix.
+    """
+    causes = np.asarray(causes)
+    n_samples = column_or_1d(n_samples)
+    counts = check_array(counts, dtype=np.float64)
+    check_consistent_length(causes, n_samples, counts)
+    if np.any(n_samples <= 0) or np.any((counts < 0) |
+                                        (counts > n_samples[:, None])):
+        raise ValueError('Counts must be between zero and the number of '
+                         'samples for each cause')
+    input_is_df = symptoms is not None
+    if symptoms is None:
+        symptoms = np.arange(counts.shape[1])
+
+    tariffs = tariffs_from_endorsements(counts / n_samples[:, None])
+    insig = insignificant_tariffs_from_counts(
+        n_samples, counts, bootstraps, ui, random_state, n_jobs, block_size,
+        sequential, confidence, tolerance)
+    tariffs = _significant_tariffs(tariffs, insig, spurious, top_n,
+                                   precision)
+
+    if input_is_df:
+        tariffs = pd.DataFrame(tariffs, causes, symptoms)
+
+    return tariffs, causes, symptoms
+
+
+def _significant_tariffs(tariffs, insig, spurious, top_n, precision):
+    """Zero the insignificant, spurious and minor tariffs and round them"""
     tariffs[insig] = 0
 
     if spurious:
@@ -434,30 +1604,57 @@ def make_tariff_matrix(X, y, bootstraps=500, ui=(2.5, 97.5), random_state=None,
     if precision:
         tariffs = round_tariffs(tariffs, precision)
 
-    if input_is_df:
-        tariffs = pd.DataFrame(tariffs, causes, symptoms)
-
-    return tariffs, causes, symptoms
+    return tariffs
 
 
-def score_samples(X, tariffs):
+def score_samples(X, tariffs, chunk_size=10000):
     """Determine tariff score by cause from symptom data
 
+    The scores are the matrix product of the symptoms and the transposed
+    tariff matrix. Samples are scored `chunk_size` rows at a time into a
+    preallocated output so only one chunk of the symptoms is converted to
+    floats at a time.
+
+    Integer tariffs (see `encode_scores`) produce integer scores. These
+    are exact since every partial sum of integers is exactly representable
+    as a float.
+
+    Sparse symptoms are multiplied as a sparse matrix so the cost is
+    proportional to the number of endorsed symptoms. Sparse tariffs are
+    only used to drop the symptoms without a non-zero tariff for any cause
+    before multiplying dense symptoms. The tariffs themselves are always
+    multiplied as a dense matrix: nearly every sample has a non-zero score
+    for every cause, so a sparse product is slower. Packed symptoms are
+    unpacked one chunk at a time.
+
     Args:
-        X (array-like) samples by symptoms matrix of binaries
-        tariffs (array-like): causes by symptoms matrix of tariffs
+        X (array-like, sparse matrix, PackedSymptoms or SymptomMatrix)
+            samples by symptoms matrix of binaries
+        tariffs (array-like or sparse matrix): causes by symptoms matrix of
+            tariffs
+        chunk_size (int): number of samples to score at a time. If None,
+            all samples are scored at once.
 
     Returns:
         scored (np.array): samples by tariff matrix of tariff scores
     """
-    input_is_df = isinstance(X, pd.DataFrame)
+    input_is_df = _is_labelled(X)
     df_index = X.index if input_is_df else None
     causes = tariffs.index if isinstance(tariffs, pd.DataFrame) else None
 
-    X = check_array(X)
-    tariffs = check_array(tariffs)
-    scored = X[:, :, None] * tariffs.T[None, :, :]
-    summed = np.apply_along_axis(np.sum, 1, scored)
+    if isinstance(X, SymptomMatrix):
+        X = X.values
+    elif not isinstance(X, PackedSymptoms):
+        X = check_array(X, accept_sparse='csr')
+    weights, used, dtype = _scoring_weights(tariffs, sparse.issparse(X))
+
+    n_samples = X.shape[0]
+    chunk_size = chunk_size or n_samples
+    summed = np.empty((n_samples, weights.shape[1]), dtype)
+    for start in range(0, n_samples, chunk_size):
+        stop = start + chunk_size
+        _score_chunk(_rows(X, start, stop), weights, used,
+                     summed[start:stop])
 
     if input_is_df:
         summed = pd.DataFrame(summed, df_index, causes)
@@ -465,6 +1662,94 @@ def score_samples(X, tariffs):
     return summed
 
 
+def _scoring_weights(tariffs, sparse_input=False):
+    """Prepare tariffs for scoring with `_score_chunk`
+
+    Sparse tariffs are made dense after dropping the symptoms without a
+    non-zero tariff (see `score_samples`).
+
+    Args:
+        tariffs (array-like or sparse matrix): causes by symptoms matrix of
+            tariffs
+        sparse_input (bool): the symptoms will be sparse matrices
+
+    Returns:
+        weights (np.array): symptoms by causes matrix of float tariffs
+        used (np.array or None): columns of the symptoms which have a
+            non-zero tariff if only these should be used for scoring
+        dtype (np.dtype): type of the scores
+    """
+    used = None
+    if sparse.issparse(tariffs):
+        tariffs = tariffs.tocsr()
+        nonzero = np.unique(tariffs.indices)
+        if not sparse_input and nonzero.size < tariffs.shape[1]:
+            used = nonzero
+            tariffs = tariffs[:, used]
+        tariffs = tariffs.toarray()
+    else:
+        tariffs = check_array(tariffs)
+
+    if np.issubdtype(tariffs.dtype, np.integer):
+        dtype = np.int32 if tariffs.dtype.itemsize <= 2 else np.int64
+    else:
+        dtype = np.float64
+    return tariffs.astype(np.float64, copy=False).T, used, dtype
+
+
+def _score_chunk(X, weights, used, out):
+    """Score a chunk of samples into a preallocated array
+
+    Args:
+        X (np.array or sparse matrix): samples by symptoms matrix of
+            binaries
+        weights, used: prepared tariffs (see `_scoring_weights`)
+        out (np.array): samples by causes array for the scores
+    """
+    if sparse.issparse(X):
+        if used is not None:
+            X = X[:, used]
+        out[:] = X.dot(weights)
+        return
+
+    if used is not None:
+        X = X[:, used]
+    X = np.asarray(X, dtype=np.float64)
+    if out.dtype == np.float64:
+        np.dot(X, weights, out=out)
+    else:
+        out[:] = np.dot(X, weights)
+
+
+def encode_scores(X, precision):
+    """Convert tariffs or tariff scores to integer multiples of a precision
+
+    Args:
+        X (array-like): tariffs or tariff scores which are multiples of
+            the precision
+        precision (float): value to which tariffs are rounded
+
+    Returns:
+        codes (np.array): values divided by the precision, stored as the
+            smallest signed integer type which holds them
+
+    Raises:
+        ValueError: if any value is not a multiple of the precision
+    """
+    X = check_array(X, dtype=np.float64)
+    codes = np.rint(X / precision)
+    if not np.allclose(codes * precision, X, rtol=0, atol=precision * 1e-6):
+        raise ValueError('Values are not multiples of {}'.format(precision))
+
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if not codes.size or info.min <= codes.min() <= codes.max() <= info.max:
+            break
+    else:
+        dtype = np.int64
+    return codes.astype(dtype)
+
+
 def generate_uniform_list(X, y, tariffs, n_samples=None, random_state=None):
     """Create an array of resampled data with even an target distribution
 
@@ -479,10 +1764,10 @@ def generate_uniform_list(X, y, tariffs, n_samples=None, random_state=None):
         X_uniform (np.array): samples by causes matrix of tariff scores
         y_uniform (np.array): causes for each sample
     """
-    input_is_df = isinstance(X, pd.DataFrame)
+    input_is_df = _is_labelled(X)
     df_index = X.index if input_is_df else None
 
-    X, y = check_X_y(X, y, dtype=None)
+    X, y = _check_X_y(X, y)
     tariffs = check_array(tariffs)
     rs = check_random_state(random_state)
     causes, counts = np.unique(y, return_counts=True)
@@ -505,7 +1790,60 @@ def generate_uniform_list(X, y, tariffs, n_samples=None, random_state=None):
     return X_uniform, y_uniform
 
 
-def calc_cutoffs(X, y, cutoff=95):
+def generate_weighted_uniform_list(X, y, tariffs, n_samples=None,
+                                   random_state=None):
+    """Create a weighted list of scores with an even target distribution
+
+    The samples are drawn as in `generate_uniform_list`, with the same
+    random state giving the same draws. Instead of repeating each drawn
+    sample, each is kept once with the number of times it was drawn.
+
+    Args:
+        X (array-like) samples by symptoms matrix of binaries
+        y (list-like) causes for each sample
+        tariffs (array-like) causes by symptoms matrix of tariffs
+        n_samples (int): number of samples per cause. Defaults to the number
+            of the most common cause in `y`
+
+    Returns:
+        X_uniform (np.array): drawn samples by causes matrix of tariff
+            scores, grouped by cause
+        y_uniform (np.array): causes for each drawn sample
+        weights (np.array): number of times each sample was drawn
+    """
+    input_is_df = _is_labelled(X)
+    df_index = X.index if input_is_df else None
+
+    X, y = _check_X_y(X, y)
+    tariffs = check_array(tariffs)
+    rs = check_random_state(random_state)
+    causes, counts = np.unique(y, return_counts=True)
+
+    scored = score_samples(X, tariffs)
+
+    if n_samples is None:
+        n_samples = np.max(counts)
+
+    idx, weights = [], []
+    for cause in causes:
+        drawn = np.bincount(rs.choice(np.where(y == cause)[0], n_samples),
+                            minlength=X.shape[0])
+        idx.append(np.flatnonzero(drawn))
+        weights.append(drawn[idx[-1]])
+    idx = np.concatenate(idx)
+    weights = np.concatenate(weights)
+    X_uniform = scored[idx]
+    y_uniform = y[idx]
+
+    if input_is_df:
+        new_index = df_index[idx]
+        X_uniform = pd.DataFrame(X_uniform, new_index, causes)
+        y_uniform = pd.Series(y_uniform, new_index)
+
+    return X_uniform, y_uniform, weights
+
+
+def calc_cutoffs(X, y, cutoff=95, weights=None):
     """Determine the minimum score and rank need for each cause
 
     The cause-specific cutoff is determined as rank within the entire
@@ -518,42 +1856,116 @@ def calc_cutoffs(X, y, cutoff=95):
         X (array-like): samples by causes matrix of tariff scores
         y (list-like): causes for each sample
         cutoff (float): percentile used as cutoff between 0 and 100
+        weights (array-like): number of times each sample is repeated. The
+            cutoffs are the same as for the data with each sample repeated
+            in place.
 
     Returns:
-        cutoffs (np.array): cutoff for each cause
+        scores (np.array): score at the cutoff for each cause
+        ranks (np.array): cutoff rank for each cause
     """
-    input_is_df = isinstance(X, pd.DataFrame)
-    causes = X.columns if input_is_df else None
+    scores, ranks = calc_cutoff_table(X, y, [cutoff], weights)
+    if isinstance(scores, pd.DataFrame):
+        return scores.iloc[0].rename(None), ranks.iloc[0].rename(None)
+    return scores[0], ranks[0]
 
-    X, y = check_X_y(X, y)
 
-    # Mergesort is needed for backwards compatibility with SmartVA
-    # See regression testing for more details. Stable sorting prevents
-    # variation in the cause rankings which could lead to discrepancies
-    # between predictions using the same data
-    X_sorted = X.argsort(0, kind='mergesort')[::-1]
+def calc_cutoff_table(X, y, cutoffs, weights=None):
+    """Determine the cutoff scores and ranks for several percentiles
 
-    ranks = np.array([np.percentile(np.where(y[X_sorted[:, j]] == j)[0] + 1, cutoff,
-                           interpolation='higher')
-             for j in range(X.shape[1])])
+    Every cause is ranked within the entire uniform list in descending
+    order of score. Ties are broken by stable sorting, which is needed for
+    backwards compatibility with SmartVA, so tied samples later in the list
+    are ranked first. The within-cause positions of every cause are counted
+    in a single pass, so each extra percentile only costs a binary search.
 
-    scores = X[ranks - 1, np.arange(X.shape[1])]
+    Args:
+        X (array-like): samples by causes matrix of tariff scores
+        y (list-like): causes for each sample, as the index of the column
+            of the cause
+        cutoffs (list-like): percentiles used as cutoffs between 0 and 100
+        weights (array-like): number of times each sample is repeated. The
+            cutoffs are the same as for the data with each sample repeated
+            in place.
 
-    if input_is_df:
-        scores = pd.Series(scores, causes)
-        ranks = pd.Series(ranks, causes)
+    Returns:
+        scores (np.array or dataframe): cutoffs by causes matrix of scores
+            at the cutoff
+        ranks (np.array or dataframe): cutoffs by causes matrix of cutoff
+            ranks
+    """
+    input_is_df = isinstance(X, pd.DataFrame)
+    causes = X.columns if input_is_df else None
+
+    X, y = check_X_y(X, y)
+    cutoffs = np.asarray(cutoffs, dtype=float)
+    if cutoffs.ndim != 1 or np.any((cutoffs < 0) | (cutoffs > 100)):
+        raise ValueError('Cutoffs must be percentiles between 0 and 100')
+    n_samples, n_causes = X.shape
+    causes_idx = np.arange(n_causes)
+
+    # Work cause by cause, with each cause contiguous in memory. Reversing
+    # a stable ascending sort puts tied samples in reverse order.
+    X_sorted = np.argsort(np.ascontiguousarray(X.T), 1, kind='mergesort')
+    X_sorted = X_sorted[:, ::-1]
+    is_cause = y[X_sorted] == causes_idx[:, None]
+    if weights is None:
+        cause_ends = np.cumsum(is_cause, 1, dtype=np.int64)
+        ends = None
+    else:
+        weights = column_or_1d(weights)
+        check_consistent_length(X, weights)
+        sorted_weights = weights[X_sorted]
+        ends = np.cumsum(sorted_weights, 1)
+        cause_ends = np.cumsum(sorted_weights * is_cause, 1)
+    n_cause = cause_ends[:, -1]
+    if np.any(n_cause == 0):
+        raise ValueError('Every cause must have samples')
+
+    # Same position within the cause as np.percentile(..., 'higher')
+    k = np.ceil((n_cause - 1) * (cutoffs[:, None] / 100)).astype(np.int64)
+
+    # Find the sample holding the kth position of each cause. The
+    # cumulative counts of each cause are offset so all causes can be
+    # searched at once.
+    offsets = causes_idx * (int(n_cause.max()) + 1)
+    flat = (cause_ends + offsets[:, None]).ravel()
+    positions = np.searchsorted(flat, k + offsets, 'right')
+    positions -= causes_idx * n_samples
+
+    if ends is None:
+        ranks = positions + 1
     else:
-        ranks = np.array(ranks)
+        ranks = (ends[causes_idx, positions] -
+                 cause_ends[causes_idx, positions] + k + 1)
+    ranks = ranks.astype(np.int64)
+    scores = X[X_sorted[causes_idx, positions], causes_idx]
+
+    if input_is_df:
+        scores = pd.DataFrame(scores, cutoffs, causes)
+        ranks = pd.DataFrame(ranks, cutoffs, causes)
+        scores.index.name = ranks.index.name = 'cutoff'
 
     return scores, ranks
 
 
-def rank_samples(X_test, X_train):
+def rank_samples(X_test, X_train, presorted=False, table=None,
+                 weights=None):
     """Determine rank of test samples within training data
 
     Args:
         X_test (array-like): samples by causes matrix of tariff scores
         X_train (array-like): samples by causes matrix of tariff scores
+        presorted (bool): the scores for each cause in the training data
+            are already sorted in ascending order (see `sort_scores`)
+        table (RankTable): ranks of every possible score built from the
+            integer-coded training data. Integer test scores are ranked by
+            lookup. Float test scores are ranked by searching the training
+            data.
+        weights (array-like): number of times each training sample is
+            repeated. The ranks are the same as ranking within the training
+            data with each sample repeated. If `presorted`, these are the
+            cumulative weights from `sort_weighted_scores`.
 
     Returns:
         ranked (np.array): samples by causes matrix of ranks within the
@@ -564,22 +1976,16 @@ def rank_samples(X_test, X_train):
     causes = X_test.columns if input_is_df else None
 
     X_test = check_array(X_test)
-    X_train = check_array(X_train)
-
-    # Number of cells * 8 bytes per float in GB
-    mem_req = X_test.shape[0] * X_test.shape[1] * X_train.shape[0] * 8 / 10**9
-    ram = 12   # well I have 12 GB of RAM on my computer. IDK about you.
-
-    if mem_req > ram:
-        # Samples are ranked within the entire training set, however they are
-        # independent of other observations in the test array. We can split
-        # the test data as much as we need to, but must leave the training
-        # data intact. This trades speed for a lower memory footprint.
-        splits = int(mem_req / ram) + 1
-        ranked = np.concatenate([_rank_samples(X_sub, X_train)
-                                 for X_sub in np.array_split(X_test, splits)])
+    if table is not None and np.issubdtype(X_test.dtype, np.integer):
+        ranked = table.lookup(X_test)
     else:
-        ranked = _rank_samples(X_test, X_train)
+        X_train = check_array(X_train)
+        if not presorted:
+            if weights is None:
+                X_train = sort_scores(X_train)
+            else:
+                X_train, weights = sort_weighted_scores(X_train, weights)
+        ranked = _rank_samples(X_test, X_train, weights)
 
     if input_is_df:
         ranked = pd.DataFrame(ranked, df_index, causes)
@@ -587,35 +1993,200 @@ def rank_samples(X_test, X_train):
     return ranked
 
 
-def _rank_samples(X_test, X_train):
+def sort_scores(X):
+    """Sort the scores of each cause for ranking
+
+    The result is column-major so the scores of each cause are contiguous.
+
+    Args:
+        X (array-like): samples by causes matrix of tariff scores
+
+    Returns:
+        X_sorted (np.array): samples by causes matrix with each column
+            sorted in ascending order
+    """
+    return np.asfortranarray(np.sort(X, axis=0))
+
+
+def sort_weighted_scores(X, weights):
+    """Sort the scores of each cause with the weight of each score
+
+    Args:
+        X (array-like): samples by causes matrix of tariff scores
+        weights (array-like): number of times each sample is repeated
+
+    Returns:
+        X_sorted (np.array): samples by causes matrix with each column
+            sorted in ascending order
+        cum_weights (np.array): (samples + 1) by causes matrix of the total
+            weight of the scores before each position in `X_sorted`, using
+            the smallest unsigned integer type which holds the total weight
+    """
+    X = check_array(X)
+    weights = column_or_1d(weights)
+    check_consistent_length(X, weights)
+    if np.any(weights < 0) or np.any(weights != np.round(weights)):
+        raise ValueError('Weights must be non-negative integers')
+
+    order = np.argsort(X, axis=0, kind='mergesort')
+    X_sorted = np.take_along_axis(X, order, 0)
+    dtype = np.min_scalar_type(int(weights.sum()))
+    cum_weights = np.zeros((X.shape[0] + 1, X.shape[1]), dtype=dtype,
+                           order='F')
+    np.cumsum(weights[order], axis=0, out=cum_weights[1:])
+    return np.asfortranarray(X_sorted), cum_weights
+
+
+def _rank_samples(X_test, X_sorted, cum_weights=None):
     """Determine rank of test samples within training data
 
     This is a "private" version of the function which performs to array
     manipulation but does not perform input validation or type conversion.
-    It is intended to be wrapped to handle memory allocation issues.
+
+    The rank is the average of the positions the test score would take if
+    it were inserted before and after any tied training scores. Both are
+    found with a binary search of the sorted training scores, so memory
+    usage is proportional to the size of the test data. The test scores
+    are searched in sorted order which is much faster than searching for
+    them in a random order.
 
     Args:
         X_test (np.array): samples by causes matrix of tariff scores
-        X_train (np.array): samples by causes matrix of tariff scores
+        X_sorted (np.array): samples by causes matrix of tariff scores with
+            each column sorted in ascending order
+        cum_weights (np.array): cumulative weights of the training scores
+            (see `sort_weighted_scores`)
 
     Returns:
         ranked (np.array): samples by causes matrix of ranks within the
             training data for each sample in the test data
-    Warning:
-        This function is NOT memory efficient. It creates an array in memory
-        which has dimensions (X_test.shape[0], n_causes, X_train.shape[0]).
-        A single 2D array of ~30,000 samples by 46 causes, the size of
-        the resampled adult uniform dataset, is about 11 MB. If the test array
-        has more than about 5000 samples, this function starts dragging. It
-        also might explode your computer's memory, hence the warning.
     """
-    X_test_3d = X_test[:, :, None]
-    X_train_3d = X_train.T[None, :, :]
+    ranked = np.empty(X_test.shape)
+    for j in range(X_test.shape[1]):
+        ranked[:, j] = _rank_column(
+            X_test[:, j], X_sorted[:, j],
+            None if cum_weights is None else cum_weights[:, j])
+    return ranked
 
-    lower = np.apply_along_axis(np.sum, 2, X_test_3d < X_train_3d)
-    higher = np.apply_along_axis(np.sum, 2, X_test_3d > X_train_3d)
 
-    return (lower + (X_train.shape[0] - higher)) / 2 + 0.5
+def _rank_column(scores, sorted_scores, cum_weights=None):
+    """Rank test scores of a single cause within sorted training scores"""
+    order = np.argsort(scores)
+    scores = scores[order]
+    n_train, below, above = _count_below_above(sorted_scores, scores,
+                                               cum_weights)
+
+    ranked = np.empty(scores.shape[0])
+    ranked[order] = (above + (n_train - below)) / 2 + 0.5
+    return ranked
+
+
+def _count_below_above(sorted_scores, scores, cum_weights=None):
+    """Count the training scores less than and greater than each score
+
+    Returns:
+        n_train (int): total number (or weight) of training scores
+        below (np.array): number of training scores less than each score
+        above (np.array): number of training scores greater than each score
+    """
+    below = np.searchsorted(sorted_scores, scores, 'left')
+    not_above = np.searchsorted(sorted_scores, scores, 'right')
+    if cum_weights is None:
+        n_train = sorted_scores.shape[0]
+    else:
+        n_train = int(cum_weights[-1])
+        below = cum_weights[below].astype(np.int64)
+        not_above = cum_weights[not_above].astype(np.int64)
+    return n_train, below, n_train - not_above
+
+
+class RankTable(object):
+    """Ranks of every possible integer-coded score
+
+    Tariffs rounded to a precision are stored as integer multiples of it
+    (see `encode_scores`), which produce a small set of distinct integer
+    scores for each cause. The rank of every integer between the lowest
+    and highest training score is calculated once so test samples can be
+    ranked by indexing into the table. Scores outside the training range
+    take the rank of being below or above every training score.
+
+    Args:
+        X_sorted (np.array): samples by causes matrix of integer-coded
+            training scores with each column sorted in ascending order
+        max_size (int): maximum number of entries in the table
+        cum_weights (np.array): cumulative weights of the training scores
+            (see `sort_weighted_scores`)
+
+    Raises:
+        ValueError: if the training scores are not integers or the table
+            would be larger than `max_size`
+    """
+
+    def __init__(self, X_sorted, max_size=2 ** 24, cum_weights=None):
+        if not np.issubdtype(X_sorted.dtype, np.integer):
+            raise ValueError('Scores must be integer-coded')
+
+        codes = X_sorted.astype(np.int64)
+        lower = codes[0]
+        widths = codes[-1] - lower + 1
+        sizes = widths + 2
+        if sizes.sum() > max_size:
+            raise ValueError('Rank table would have {} entries'
+                             .format(sizes.sum()))
+
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        ranks = np.empty(sizes.sum())
+        for j in range(codes.shape[1]):
+            values = np.arange(lower[j], lower[j] + widths[j])
+            n_train, below, above = _count_below_above(
+                codes[:, j], values,
+                None if cum_weights is None else cum_weights[:, j])
+
+            table = ranks[offsets[j]:offsets[j] + sizes[j]]
+            table[0] = n_train + 0.5  # below every training score
+            table[1:-1] = (above + (n_train - below)) / 2 + 0.5
+            table[-1] = 0.5  # above every training score
+
+        self.n_train = n_train
+        self.lower = lower
+        self.widths = widths
+        self.offsets = offsets
+        self.ranks = ranks
+
+    @classmethod
+    def from_arrays(cls, n_train, lower, widths, offsets, ranks):
+        """Restore a table from its attributes without recalculating it"""
+        table = cls.__new__(cls)
+        table.n_train = n_train
+        table.lower = lower
+        table.widths = widths
+        table.offsets = offsets
+        table.ranks = ranks
+        return table
+
+    def lookup(self, X, causes=None):
+        """Rank integer-coded test scores within the training data
+
+        Args:
+            X (np.array): samples by causes matrix of integer-coded scores
+            causes (np.array): column of each score if `X` is a 1D array of
+                scores from any of the causes
+
+        Returns:
+            ranked (np.array): ranks within the training data in the same
+                shape as `X`
+        """
+        lower, widths, offsets = self.lower, self.widths, self.offsets
+        if causes is not None:
+            lower = lower[causes]
+            widths = widths[causes]
+            offsets = offsets[causes]
+
+        codes = X.astype(np.int64)
+        codes -= lower - 1
+        np.clip(codes, 0, widths + 1, out=codes)
+        codes += offsets
+        return self.ranks[codes]
 
 
 def mask_uncertain(X_scores, X_ranks, train_n=np.inf, min_score=0,
@@ -658,7 +2229,8 @@ def censor_predictions(X, X_ranks, censor, causes, symptoms):
     """Calculate a mask of which cells should be censored.
 
     Args:
-        X (matrix-like): samples by predictors matrix of binaries
+        X (matrix-like, sparse matrix, PackedSymptoms or SymptomMatrix):
+            samples by predictors matrix of binaries
         censor (dict of lists)
         causes (list-like): sequence of outcome labels
         symptoms (list-like): sequence of predictor labels
@@ -670,14 +2242,25 @@ def censor_predictions(X, X_ranks, censor, causes, symptoms):
     input_is_df = isinstance(X_ranks, pd.DataFrame)
     df_index = X_ranks.index if input_is_df else None
 
-    X = check_array(X)
-    if not np.all((X == 1) | (X == 0)):
-        raise ValueError('Some symptoms are not binary.')
+    if isinstance(X, SymptomMatrix):
+        X = X.values
+    elif not isinstance(X, PackedSymptoms):
+        X = check_array(getattr(X, 'values', X), accept_sparse='csr')
+        values = X.data if sparse.issparse(X) else X
+        if not np.all((values == 1) | (values == 0)):
+            raise ValueError('Some symptoms are not binary.')
     uncensored = check_array(X_ranks, copy=True, force_all_finite=False)
     check_consistent_length(X, X_ranks)
 
     mask = make_mask(censor, symptoms, causes)
-    censored = (X.astype(bool)[:, :, None] & mask[None, :, :]).any(1)
+    if isinstance(X, PackedSymptoms):
+        censored = np.zeros(uncensored.shape, dtype=bool)
+        for i in np.flatnonzero(mask.any(0)):
+            censored[:, i] = X.any_endorsed(mask[:, i])
+    elif sparse.issparse(X):
+        censored = np.asarray(X.dot(mask.astype(float))) > 0
+    else:
+        censored = (X.astype(bool)[:, :, None] & mask[None, :, :]).any(1)
     uncensored[censored] = np.nan
 
     if input_is_df:
@@ -750,6 +2333,509 @@ def best_ranked(series):
         return np.nan
 
 
+def best_ranked_causes(X_ranks, causes=None, undetermined=np.nan):
+    """Determine the best ranked cause for each sample
+
+    This is a vectorized version of applying `best_ranked` to each row. The
+    best cause is the one with the lowest non-null rank. Samples where the
+    lowest rank is tied between causes are passed to `best_ranked` so ties
+    are broken exactly as before.
+
+    Args:
+        X_ranks (array-like): samples by causes matrix of ranks with null
+            values for causes which are not valid predictions
+        causes (list-like): cause for each column. Defaults to the column
+            labels of a dataframe or the column positions of an array
+        undetermined: value for samples without any valid cause
+
+    Returns:
+        pred (np.array or pd.Series): best ranked cause for each sample
+    """
+    input_is_df = isinstance(X_ranks, pd.DataFrame)
+    df_index = X_ranks.index if input_is_df else None
+    if causes is None:
+        causes = X_ranks.columns if input_is_df else range(X_ranks.shape[1])
+    causes = np.asarray(causes)
+
+    ranks = check_array(X_ranks, dtype=np.float64, force_all_finite=False)
+    filled = np.where(np.isnan(ranks), np.inf, ranks)
+    best = filled.argmin(1)
+    lowest = filled[np.arange(ranks.shape[0]), best]
+    determined = np.isfinite(lowest)
+
+    pred = np.empty(ranks.shape[0], dtype=object)
+    pred[determined] = causes[best[determined]]
+    pred[~determined] = undetermined
+
+    tied = determined & ((filled == lowest[:, None]).sum(1) > 1)
+    for i in np.where(tied)[0]:
+        pred[i] = best_ranked(pd.Series(ranks[i], causes))
+
+    pred = pd.Series(pred, df_index).infer_objects()
+    return pred if input_is_df else pred.values
+
+
+def compile_restrictions(causes, restrictions=None):
+    """Convert demographic restrictions to masks of the restricted causes
+
+    Args:
+        causes (np.array): cause labels
+        restrictions (dict): restrictions as passed to `apply_restrictions`
+
+    Returns:
+        compiled (list of tuples): metadata label, comparison ufunc,
+            threshold and boolean mask of restricted causes. A cause is
+            restricted for a sample if comparing the sample's metadata
+            value with the threshold is True.
+    """
+    restrictions = restrictions or dict()
+
+    compiled = [('age_', np.less, thre, np.in1d(causes, labels))
+                for thre, labels in restrictions.get('min_age', [])]
+
+    # Maximum ages are not compiled since `apply_restrictions` looks for
+    # them in the metadata instead of the restrictions.
+
+    males_only = restrictions.get('males_only', [])
+    compiled.append(('sex_', np.equal, 2, np.in1d(causes, males_only)))
+
+    females_only = restrictions.get('females_only', [])
+    compiled.append(('sex_', np.equal, 1, np.in1d(causes, females_only)))
+
+    compiled.extend(('region_', np.equal, r, np.in1d(causes, labels))
+                    for r, labels in restrictions.get('regions', []))
+
+    return [restriction for restriction in compiled if restriction[3].any()]
+
+
+class InferencePlan(object):
+    """Precompiled steps for predicting causes from symptoms
+
+    The plan holds everything needed to predict which does not depend on
+    the test data: the scoring tariffs, the sorted uniform list and rank
+    table, the score and rank thresholds, the censoring mask and the
+    compiled restrictions. `run` scores, ranks, masks and selects the best
+    cause for one chunk of samples at a time, giving the same predictions
+    as `score_samples`, `rank_samples`, `mask_uncertain`,
+    `censor_predictions`, `apply_restrictions` and `best_ranked_causes`.
+
+    Unless intermediate results are requested, cells which fail the score
+    threshold, are censored or are restricted are masked before ranking so
+    they are never ranked.
+
+    Args:
+        tariffs (array-like or sparse matrix): causes by symptoms matrix of
+            tariffs used for scoring
+        X_sorted (np.array): samples by causes matrix of uniform list
+            scores, in the same units as the tariffs, with each column
+            sorted in ascending order
+        causes (np.array): cause labels
+        rank_table (RankTable): ranks of every integer-coded score
+        cum_weights (np.array): cumulative weights of the uniform list
+            scores (see `sort_weighted_scores`)
+        min_score (float or array): minimum score, in the same units as
+            the tariffs, needed for a cause to be a valid prediction
+        cutoff_ranks (array-like): cause-specific maximum ranks
+        overall_cutoff (float): maximum rank for all causes
+        censor_mask (np.array): symptoms by causes boolean matrix where True
+            indicates endorsing the symptom censors the cause
+        restrictions (list): compiled restrictions (see
+            `compile_restrictions`)
+        chunk_size (int): number of samples to process at a time
+    """
+
+    def __init__(self, tariffs, X_sorted, causes, rank_table=None,
+                 cum_weights=None, min_score=0, cutoff_ranks=None,
+                 overall_cutoff=np.inf, censor_mask=None, restrictions=None,
+                 chunk_size=10000):
+        self.causes = np.asarray(causes)
+        self.X_sorted = X_sorted
+        self.rank_table = rank_table
+        self.cum_weights = cum_weights
+        self.chunk_size = chunk_size
+        self.tariffs = tariffs
+        self.weights, self.used, self.dtype = _scoring_weights(tariffs)
+        self.min_score = np.asarray(min_score)
+
+        n_causes = self.causes.shape[0]
+        rank_limit = np.full(n_causes, overall_cutoff, dtype=np.float64)
+        if cutoff_ranks is not None:
+            rank_limit = np.minimum(rank_limit, np.asarray(cutoff_ranks))
+        self.rank_limit = rank_limit
+
+        self.censor_cols = np.zeros(0, dtype=int)
+        if censor_mask is not None:
+            self.censor_cols = np.where(censor_mask.any(1))[0]
+            self.censor_weights = censor_mask[self.censor_cols].astype(float)
+        self.restrictions = restrictions or []
+
+    def run(self, X, metadata=None, intermediates=True, n_jobs=1):
+        """Predict causes for test samples
+
+        Chunks are dealt round-robin to `n_jobs` threads, each of which
+        reuses its own scratch buffers and writes into its own rows of the
+        results, so results are in input order for any number of jobs.
+        Integer-coded scores are exact however the samples are chunked, so
+        chunks are made smaller to keep every thread busy. Float scores
+        always use `chunk_size` chunks since the floating point sums depend
+        on the number of rows multiplied at a time.
+
+        Args:
+            X (np.array, sparse matrix, PackedSymptoms or SymptomMatrix):
+                samples by symptoms matrix of binaries. Chunks are checked
+                to be binary unless the symptoms are already known to be.
+            metadata (dict): metadata values for each sample by label
+            intermediates (bool): also return the scores, ranks and masked
+                ranks of every sample
+            n_jobs (int): number of threads. -1 uses all CPUs.
+
+        Returns:
+            pred (np.array): best ranked cause for each sample or NaN if no
+                cause is valid
+            intermediates (dict or None): samples by causes arrays of
+                'scored', 'ranked', 'certain' and 'valid' results
+        """
+        n_samples = X.shape[0]
+        metadata = self._restriction_metadata(metadata or dict(), n_samples)
+        pred = np.empty(n_samples, dtype=object)
+        check = not _is_binary(X)
+
+        out = None
+        if intermediates:
+            shape = (n_samples, self.causes.shape[0])
+            out = dict(scored=np.empty(shape, self.dtype),
+                       ranked=np.empty(shape), certain=np.empty(shape),
+                       valid=np.empty(shape))
+
+        n_jobs = effective_n_jobs(n_jobs)
+        chunk_size = self.chunk_size
+        if n_jobs > 1 and np.issubdtype(self.dtype, np.integer):
+            per_job = -(-n_samples // (4 * n_jobs))
+            chunk_size = min(chunk_size, max(per_job, 1000))
+        starts = list(range(0, n_samples, chunk_size))
+        n_workers = max(1, min(n_jobs, len(starts)))
+
+        def run_chunks(worker):
+            scratch = self._scratch(min(chunk_size, n_samples))
+            for start in starts[worker::n_workers]:
+                rows = slice(start, start + chunk_size)
+                pred[rows] = self._run_chunk(
+                    _rows(X, start, start + chunk_size),
+                    {k: v[rows] for k, v in metadata.items()},
+                    {k: v[rows] for k, v in out.items()} if out else None,
+                    scratch, check)
+
+        if n_workers > 1:
+            with ThreadPoolExecutor(n_workers) as executor:
+                list(executor.map(run_chunks, range(n_workers)))
+        else:
+            run_chunks(0)
+
+        return pd.Series(pred).infer_objects().values, out
+
+    def save(self, path, arrays=None, **manifest):
+        """Save the plan as a directory of `.npy` files
+
+        The arrays are stored uncompressed so `load` can memory-map them.
+        Labels must all be strings or all be numbers.
+
+        Args:
+            path (str): directory to save to. It is created if needed.
+            arrays (dict): extra arrays to save by name
+            **manifest: extra JSON-serializable values to save
+        """
+        n_causes = self.causes.shape[0]
+        tariffs = self.tariffs
+        is_sparse = sparse.issparse(tariffs)
+        tariffs = tariffs.toarray() if is_sparse else np.asarray(tariffs)
+
+        censor_mask = np.zeros((tariffs.shape[1], n_causes), dtype=bool)
+        censor_mask[self.censor_cols] = self.censor_weights > 0
+
+        restriction_masks = np.zeros((len(self.restrictions), n_causes),
+                                     dtype=bool)
+        restrictions = []
+        for i, (label, op, threshold, mask) in enumerate(self.restrictions):
+            restriction_masks[i] = mask
+            if isinstance(threshold, np.generic):
+                threshold = threshold.item()
+            restrictions.append([label, op.__name__, threshold])
+
+        arrays = dict(arrays or dict(), tariffs=tariffs,
+                      X_sorted=self.X_sorted, causes=_label_array(self.causes),
+                      min_score=self.min_score, rank_limit=self.rank_limit,
+                      censor_mask=censor_mask,
+                      restriction_masks=restriction_masks)
+        if self.cum_weights is not None:
+            arrays['cum_weights'] = self.cum_weights
+        table = self.rank_table
+        if table is not None:
+            arrays.update(rank_n_train=np.asarray(table.n_train),
+                          rank_lower=table.lower, rank_widths=table.widths,
+                          rank_offsets=table.offsets, rank_ranks=table.ranks)
+
+        manifest = dict(manifest, format=PLAN_FORMAT, arrays=sorted(arrays),
+                        chunk_size=self.chunk_size, sparse_tariffs=is_sparse,
+                        restrictions=restrictions)
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, values in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), values,
+                    allow_pickle=False)
+        with open(os.path.join(path, PLAN_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a plan saved with `save`
+
+        Args:
+            path (str): directory the plan was saved to
+            mmap_mode (str or None): memory-map the uniform list, its
+                weights and the rank table with this mode (see `np.load`)
+                instead of reading them into memory. With the default
+                read-only mode, forked processes share the same pages.
+
+        Returns:
+            plan (InferencePlan)
+            arrays (dict): all saved arrays by name
+            manifest (dict): all saved values
+        """
+        with open(os.path.join(path, PLAN_MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != PLAN_FORMAT:
+            raise ValueError('Unknown plan format: {}'
+                             .format(manifest.get('format')))
+
+        arrays = dict()
+        for name in manifest['arrays']:
+            large = name in ('X_sorted', 'cum_weights', 'rank_ranks')
+            mode = mmap_mode if large else None
+            arrays[name] = np.load(os.path.join(path, name + '.npy'),
+                                   mmap_mode=mode, allow_pickle=False)
+
+        causes = _from_label_array(arrays['causes'])
+        rank_table = None
+        if 'rank_ranks' in arrays:
+            rank_table = RankTable.from_arrays(
+                int(arrays['rank_n_train']), arrays['rank_lower'],
+                arrays['rank_widths'], arrays['rank_offsets'],
+                arrays['rank_ranks'])
+
+        tariffs = arrays['tariffs']
+        if manifest['sparse_tariffs']:
+            tariffs = sparse.csr_matrix(tariffs)
+
+        restrictions = [
+            (label, getattr(np, op), threshold, mask)
+            for (label, op, threshold), mask in zip(
+                manifest['restrictions'], arrays['restriction_masks'])]
+
+        plan = cls(tariffs, arrays['X_sorted'], causes, rank_table=rank_table,
+                   cum_weights=arrays.get('cum_weights'),
+                   min_score=arrays['min_score'],
+                   cutoff_ranks=arrays['rank_limit'],
+                   censor_mask=arrays['censor_mask'],
+                   restrictions=restrictions,
+                   chunk_size=manifest['chunk_size'])
+        return plan, arrays, manifest
+
+    def _restriction_metadata(self, metadata, n_samples):
+        """Get the metadata needed by the restrictions with defaults"""
+        defaults = {'age_': np.nan, 'sex_': 0, 'region_': np.nan}
+        labels = set(label for label, _, _, _ in self.restrictions)
+        values = {label: metadata.get(label, np.full(n_samples,
+                                                     defaults[label]))
+                  for label in labels}
+        check_consistent_length(np.empty(n_samples), *values.values())
+        return {label: column_or_1d(v) for label, v in values.items()}
+
+    def _scratch(self, n_samples):
+        """Allocate buffers which are reused for each chunk"""
+        shape = (n_samples, self.causes.shape[0])
+        return dict(scored=np.empty(shape, self.dtype),
+                    valid=np.empty(shape))
+
+    def _run_chunk(self, X, metadata, out, scratch, check=True):
+        """Predict causes for one chunk of samples"""
+        n_samples = X.shape[0]
+        values = X.data if sparse.issparse(X) else X
+        if check and not np.all((values == 1) | (values == 0)):
+            raise ValueError('Some symptoms are not binary.')
+
+        scored = out['scored'] if out else scratch['scored'][:n_samples]
+        _score_chunk(X, self.weights, self.used, scored)
+        low = scored <= self.min_score
+        excluded = self._excluded(X, metadata)
+
+        if out:
+            ranked = out['ranked']
+            if self.rank_table is not None:
+                ranked[:] = self.rank_table.lookup(scored)
+            else:
+                ranked[:] = _rank_samples(scored, self.X_sorted,
+                                          self.cum_weights)
+            certain = out['certain']
+            certain[:] = ranked
+            certain[low | (ranked > self.rank_limit)] = np.nan
+            valid = out['valid']
+            valid[:] = certain
+            valid[excluded] = np.nan
+        else:
+            valid = scratch['valid'][:n_samples]
+            valid.fill(np.nan)
+            causes, samples = np.nonzero(~(low | excluded).T)
+            ranked = self._rank_cells(scored[samples, causes], causes)
+            ranked[ranked > self.rank_limit[causes]] = np.nan
+            valid[samples, causes] = ranked
+
+        return best_ranked_causes(valid, self.causes)
+
+    def _excluded(self, X, metadata):
+        """Determine which cells are censored or restricted"""
+        excluded = np.zeros((X.shape[0], self.causes.shape[0]), dtype=bool)
+        if self.censor_cols.size:
+            endorsed = X[:, self.censor_cols]
+            excluded |= np.asarray(endorsed.dot(self.censor_weights)) > 0
+
+        for label, compare, threshold, restricted in self.restrictions:
+            excluded |= (compare(metadata[label], threshold)[:, None] &
+                         restricted)
+        return excluded
+
+    def _rank_cells(self, scores, causes):
+        """Rank scores from any cause, with scores grouped by cause"""
+        if self.rank_table is not None:
+            return self.rank_table.lookup(scores, causes)
+
+        ranked = np.empty(scores.shape[0])
+        bounds = np.cumsum(np.bincount(causes,
+                                       minlength=self.causes.shape[0]))
+        start = 0
+        for j, stop in enumerate(bounds):
+            if stop > start:
+                ranked[start:stop] = _rank_column(
+                    scores[start:stop], self.X_sorted[:, j],
+                    None if self.cum_weights is None
+                    else self.cum_weights[:, j])
+            start = stop
+        return ranked
+
+
+def _label_array(labels):
+    """Convert labels to an array which can be saved without pickling"""
+    values = list(labels)
+    labels = np.asarray(values)
+    if labels.dtype == object or (labels.dtype.kind == 'U' and not
+                                  all(isinstance(v, str) for v in values)):
+        raise ValueError('Labels must all be strings or all be numbers')
+    return labels
+
+
+def _from_label_array(labels):
+    """Convert saved labels back to the array type used when fitting"""
+    labels = np.asarray(labels)
+    return labels.astype(object) if labels.dtype.kind == 'U' else labels
+
+
+def _encode_param(value):
+    """Convert a parameter to JSON, tagging dicts and tuples"""
+    if isinstance(value, dict):
+        return {'dict': [[_encode_param(k), _encode_param(v)]
+                         for k, v in value.items()]}
+    if isinstance(value, tuple):
+        return {'tuple': [_encode_param(v) for v in value]}
+    if isinstance(value, (list, np.ndarray)):
+        return [_encode_param(v) for v in value]
+    if isinstance(value, np.random.RandomState):
+        return None
+    if isinstance(value, ArtifactCache):
+        return value.path
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode_param(value):
+    """Convert a parameter saved by `_encode_param` back"""
+    if isinstance(value, list):
+        return [_decode_param(v) for v in value]
+    if isinstance(value, dict) and 'dict' in value:
+        return {_decode_param(k): _decode_param(v) for k, v in value['dict']}
+    if isinstance(value, dict):
+        return tuple(_decode_param(v) for v in value['tuple'])
+    return value
+
+
+def load_artifact(path, mmap_mode='r'):
+    """Load a classifier saved with `TariffClassifier.save_artifact`
+
+    The classifier can predict but not be refit since the training data
+    and uniform list are not saved.
+
+    Args:
+        path (str): directory the classifier was saved to
+        mmap_mode (str or None): see `InferencePlan.load`
+
+    Returns:
+        clf (TariffClassifier)
+    """
+    plan, arrays, manifest = InferencePlan.load(path, mmap_mode)
+    clf = TariffClassifier(**{name: _decode_param(value) for name, value
+                              in manifest['params'].items()})
+    clf.plan_ = plan
+    clf.causes_ = plan.causes
+    clf.n_causes_ = plan.causes.shape[0]
+    clf.symptoms_ = _from_label_array(arrays['symptoms'])
+    clf.tariffs_ = arrays['float_tariffs']
+    clf.cutoff_ranks_ = arrays['cutoff_ranks']
+    clf.cutoff_scores_ = arrays['cutoff_scores']
+    if manifest['dataframe']:
+        clf.tariffs_ = pd.DataFrame(clf.tariffs_, clf.causes_, clf.symptoms_)
+        clf.cutoff_ranks_ = pd.Series(clf.cutoff_ranks_, clf.causes_)
+        clf.cutoff_scores_ = pd.Series(clf.cutoff_scores_, clf.causes_)
+    clf.tariff_codes_ = arrays['tariffs'] if manifest['encoded'] else None
+    clf.sparse_tariffs_ = sparse.csr_matrix(plan.tariffs)
+    clf.X_uniform_sorted_ = plan.X_sorted
+    clf.uniform_cum_weights_ = plan.cum_weights
+    clf.rank_table_ = plan.rank_table
+    return clf
+
+
+def iter_chunks(X, chunksize=10000, metadata=()):
+    """Split test samples into chunks
+
+    Args:
+        X: array, sparse matrix, dataframe, PackedSymptoms or
+            SymptomMatrix of samples, an iterable of chunks of samples or
+            the path to a CSV file of samples with the index in the first
+            column
+        chunksize (int): number of samples in each chunk if `X` is not
+            already an iterable of chunks
+        metadata (sequence): labels of metadata columns in a CSV file.
+            All other columns are read as binary symptoms.
+
+    Returns:
+        chunks (iterator): chunks of samples
+    """
+    if isinstance(X, str):
+        return read_csv_chunks(X, chunksize, non_binary=metadata)
+    if isinstance(X, pd.DataFrame):
+        return (X.iloc[i:i + chunksize]
+                for i in range(0, X.shape[0], chunksize))
+    if isinstance(X, np.ndarray) or sparse.issparse(X):
+        return (X[i:i + chunksize] for i in range(0, X.shape[0], chunksize))
+    if isinstance(X, SymptomMatrix):
+        return (X.take(slice(i, i + chunksize))
+                for i in range(0, X.shape[0], chunksize))
+    if isinstance(X, PackedSymptoms):
+        unpack = X.to_frame if _is_labelled(X) else X.to_dense
+        return (unpack(i, i + chunksize)
+                for i in range(0, X.shape[0], chunksize))
+    return iter(X)
+
+
 def get_undetermined_proportions(causes):
     """Return proportions used to redistribute the undetermined CSMF"""
     # TODO: bring in external CSMF data
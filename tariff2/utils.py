@@ -1,5 +1,6 @@
 from functools import reduce
 import operator
+import os
 
 import numpy as np
 import pandas as pd
@@ -85,6 +86,104 @@ def calc_ui(arr, ui=(2.5, 97.5), labels=None):
     return ui
 
 
+class StreamingUI(object):
+    """Exact uncertainty intervals over draws which arrive in blocks
+
+    With linear interpolation, a percentile only depends on the two order
+    statistics on either side of it. For the lower bound these are among
+    the smallest draws and for the upper bound among the largest. Only
+    those draws are kept for each cell, so the buffers hold roughly
+    (100 - width) percent of the draws, e.g. 1% for a 99% UI, no matter
+    how many blocks are added. The bounds are the same as calling
+    np.percentile on all the draws.
+
+    Args:
+        n_draws (int): total number of draws which will be added
+        ui (tuple of 2 floats): lower and upper bounds of uncertainty interval
+            between 0 and 100
+
+    Examples:
+        >>> stream = StreamingUI(1000, (2.5, 97.5))
+        >>> for block in np.split(np.random.random((1000, 3, 4)), 10):
+        ...     stream.update(block)
+        >>> lower, upper = stream.bounds()
+    """
+    def __init__(self, n_draws, ui=(2.5, 97.5)):
+        if len(ui) != 2:
+            raise ValueError('"ui" must be a 2-tuple of floats')
+        self.n_draws = n_draws
+        self.ui = sorted(ui)
+        self.n_seen = 0
+
+        # Fractional positions of the bounds within the sorted draws
+        lower, upper = np.true_divide(self.ui, 100) * (n_draws - 1)
+        self._lower_index = lower
+        self._upper_index = upper - np.floor(upper)
+        self._n_lower = min(int(np.floor(lower)) + 2, n_draws)
+        self._n_upper = n_draws - int(np.floor(upper))
+        self._lower = None
+        self._upper = None
+
+    def update(self, draws):
+        """Add a block of draws
+
+        Args:
+            draws (array-like): draws along the first axis. All other axes
+                must be the same for every block.
+        """
+        draws = np.asarray(draws)
+        if self.n_seen + draws.shape[0] > self.n_draws:
+            raise ValueError('More than {} draws added'.format(self.n_draws))
+        self.n_seen += draws.shape[0]
+
+        if self._lower is not None:
+            lower = np.concatenate([self._lower, draws])
+            upper = np.concatenate([self._upper, draws])
+        else:
+            lower = upper = draws
+
+        if lower.shape[0] > self._n_lower:
+            lower = np.partition(lower, self._n_lower - 1, axis=0)
+            lower = lower[:self._n_lower]
+        if upper.shape[0] > self._n_upper:
+            kth = upper.shape[0] - self._n_upper
+            upper = np.partition(upper, kth, axis=0)[kth:]
+
+        self._lower = lower
+        self._upper = upper
+
+    def bounds(self):
+        """Calculate the uncertainty interval once all draws are added
+
+        Returns:
+            lower (np.array): lower bound for every cell
+            upper (np.array): upper bound for every cell
+        """
+        if self.n_seen != self.n_draws:
+            raise ValueError('Expected {} draws, but {} were added'
+                             .format(self.n_draws, self.n_seen))
+        lower = _interpolate(np.sort(self._lower, axis=0), self._lower_index)
+        upper = _interpolate(np.sort(self._upper, axis=0), self._upper_index)
+        return lower, upper
+
+
+def _interpolate(arr, index):
+    """Linearly interpolate between rows of a sorted array
+
+    This uses the same arithmetic as np.percentile so the results are
+    identical.
+    """
+    previous = int(np.floor(index))
+    following = min(previous + 1, arr.shape[0] - 1)
+    gamma = index - previous
+    a = arr[previous]
+    b = arr[following]
+    diff = b - a
+    if gamma >= 0.5:
+        return b - diff * (1 - gamma)
+    return a + diff * gamma
+
+
 def make_mask(matrix, rows, cols, ignore_errors=True):
     """Transform dict of list matrix into a boolean numpy array.
 
@@ -121,3 +220,57 @@ def make_mask(matrix, rows, cols, ignore_errors=True):
             arr[row_idx, col_idx] = True
 
     return arr
+
+
+def effective_n_jobs(n_jobs=1):
+    """Resolve the number of workers to use
+
+    Negative values count back from the number of CPUs, so -1 uses all of
+    them and -2 uses all but one.
+
+    Args:
+        n_jobs (int or None): requested number of workers. None means 1.
+
+    Returns:
+        (int)
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs == 0:
+        raise ValueError('"n_jobs" cannot be zero')
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+def read_csv_chunks(path, chunksize=10000, index_col=0, non_binary=(),
+                    **kwargs):
+    """Read a CSV file of binary symptoms in chunks
+
+    Binary columns are parsed as float32, since they may have missing
+    values, and converted to uint8 with missing values set to zero. If any
+    value in a chunk is not 0 or 1 the chunk is left as floats so the
+    values are not silently truncated.
+
+    Args:
+        path (str): path to the CSV file
+        chunksize (int): number of rows in each chunk
+        index_col (int or str): column to use as the index
+        non_binary (sequence): labels of columns which are not binary
+        **kwargs: passed to `pd.read_csv`
+
+    Yields:
+        chunk (dataframe): rows of the file
+    """
+    header = pd.read_csv(path, index_col=index_col, nrows=0, **kwargs)
+    binary = [col for col in header.columns if col not in non_binary]
+    dtype = dict.fromkeys(binary, np.float32)
+    dtype.update(kwargs.pop('dtype', dict()))
+
+    for chunk in pd.read_csv(path, index_col=index_col, dtype=dtype,
+                             chunksize=chunksize, **kwargs):
+        values = chunk[binary].fillna(0)
+        if np.isin(values.values, (0, 1)).all():
+            values = values.astype(np.uint8)
+        chunk[binary] = values
+        yield chunk
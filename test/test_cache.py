@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+from src.cache import *
+
+
+def test_content_key():
+    X = np.arange(12).reshape(3, 4)
+    key = content_key(X, 'a', 1, (2.5, 97.5), {'b': ['c']})
+    assert key == content_key(X.copy(), 'a', 1, (2.5, 97.5), {'b': ['c']})
+    assert key != content_key(X.T, 'a', 1, (2.5, 97.5), {'b': ['c']})
+    assert key != content_key(X.astype(np.uint8), 'a', 1, (2.5, 97.5),
+                              {'b': ['c']})
+    assert key != content_key(X, 'a', 1, (2.5, 97.5), {'b': ['d']})
+    assert key != content_key(X, 'a', 1, 2.5, 97.5, {'b': ['c']})
+
+    y = np.array(['a', 'b', 'c'], dtype=object)
+    assert content_key(y) == content_key(pd.Series(y).values)
+    assert content_key(y) != content_key(y[::-1])
+    assert content_key(pd.DataFrame(X)) != content_key(X)
+
+    csr = sparse.csr_matrix(X)
+    assert content_key(csr) == content_key(sparse.csc_matrix(X))
+    assert content_key(csr) != content_key(X)
+
+    rs = np.random.RandomState(0)
+    key = content_key(rs)
+    assert key == content_key(np.random.RandomState(0))
+    rs.random_sample()
+    assert key != content_key(rs)
+
+    with pytest.raises(TypeError):
+        content_key(object())
+
+
+def test_artifact_cache(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')))
+    key = cache.key('entry')
+    assert cache.get(key) is None
+
+    arrays = dict(a=np.arange(5.), b=np.array(['x', 'yz']))
+    cache.put(key, arrays)
+    cached = cache.get(key)
+    assert sorted(cached) == ['a', 'b']
+    assert all((cached[name] == arrays[name]).all() for name in arrays)
+    assert os.listdir(cache.path) == [key + '.npz']
+
+    with open(os.path.join(cache.path, key + '.npz'), 'wb') as f:
+        f.write(b'corrupt')
+    assert cache.get(key) is None
+
+    assert check_cache(None) is None
+    assert check_cache(cache) is cache
+    assert check_cache(cache.path).path == cache.path
+
+
+def test_artifact_cache_eviction(tmpdir):
+    values = np.zeros(1000)
+    cache = ArtifactCache(str(tmpdir), max_size=None)
+    cache.put('probe', dict(values=values))
+    entry_size = os.path.getsize(os.path.join(str(tmpdir), 'probe.npz'))
+    os.remove(os.path.join(str(tmpdir), 'probe.npz'))
+
+    cache = ArtifactCache(str(tmpdir), max_size=3 * entry_size)
+    for i, key in enumerate('abc'):
+        cache.put(key, dict(values=values))
+        os.utime(os.path.join(cache.path, key + '.npz'), (i, i))
+    assert cache.get('a') is not None
+
+    cache.put('d', dict(values=values))
+    assert sorted(os.listdir(cache.path)) == ['a.npz', 'c.npz', 'd.npz']
+    assert cache.get('b') is None
@@ -54,3 +54,15 @@ def test_short_predict(clf_short):
     df = pd.DataFrame(arr, columns=clf_short.symptoms_)
     clf_short.predict(arr)
     clf_short.predict(df)
+
+
+@needs_smartva_repo
+def test_predict_with_metadata(smartva_repo, module, clf_full):
+    clf = SmartvaClassifier(smartva_repo, module,
+                            metadata=('age_', 'sex_')).fit()
+    df = pd.DataFrame(np.zeros((2, clf.tariffs_.shape[1])),
+                      columns=clf.symptoms_)
+    pred = clf_full.predict(df)[0]
+    df.insert(0, 'age_', [30, 30])
+    df.insert(1, 'sex_', [1, 2])
+    assert clf.predict(df)[0].shape == pred.shape
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+from src.symptoms import *
+
+
+def random_symptoms(n_samples, n_symptoms, random_state=None):
+    rs = np.random.RandomState(random_state)
+    X = (rs.random_sample((n_samples, n_symptoms)) < 0.3).astype(int)
+    y = rs.choice(['a', 'b', 'c'], n_samples)
+    return X, y
+
+
+@pytest.mark.parametrize('n_samples', [1, 8, 13, 64, 101])
+def test_packed_symptoms_round_trip(n_samples):
+    X, _ = random_symptoms(n_samples, 6, random_state=n_samples)
+    packed = PackedSymptoms.from_dense(X)
+    assert packed.shape == X.shape
+    assert packed.columns is None
+    assert (packed.to_dense() == X).all()
+
+    for start, stop in [(0, 1), (3, 11), (7, None), (5, 5)]:
+        assert (packed.to_dense(start, stop) == X[start:stop]).all()
+
+
+def test_packed_symptoms_frame():
+    X, _ = random_symptoms(21, 4, random_state=1)
+    df = pd.DataFrame(X, ['id{}'.format(i) for i in range(21)],
+                      ['s{}'.format(i) for i in range(4)])
+    df.insert(0, 'age_', np.arange(21.))
+    packed = PackedSymptoms.from_dense(df, metadata=['age_'])
+    assert packed.shape == (21, 4)
+    assert packed.columns.equals(df.columns[1:])
+    assert packed.index.equals(df.index)
+    assert packed.metadata.equals(df[['age_']])
+
+    frame = packed.to_frame(2, 9)
+    assert (frame.values == df.iloc[2:9].values).all()
+    assert frame.index.equals(df.index[2:9])
+    assert frame.columns.equals(df.columns)
+
+
+def test_packed_symptoms_not_binary():
+    X = np.ones((5, 3))
+    X[2, 1] = 2
+    with pytest.raises(ValueError):
+        PackedSymptoms.from_dense(X)
+
+    with pytest.raises(ValueError):
+        PackedSymptoms.from_dense(np.ones((5, 3)), metadata=['age_'])
+
+
+@pytest.mark.parametrize('sizes', [[8, 16, 5], [3, 10, 7]])
+def test_packed_symptoms_from_chunks(sizes):
+    X, _ = random_symptoms(sum(sizes), 5, random_state=2)
+    df = pd.DataFrame(X)
+    bounds = np.cumsum([0] + sizes)
+    chunks = [df.iloc[start:stop] for start, stop in zip(bounds, bounds[1:])]
+    packed = PackedSymptoms.from_chunks(chunks)
+    assert (packed.to_dense() == X).all()
+    assert packed.index.equals(df.index)
+
+
+def test_packed_symptoms_take():
+    X, _ = random_symptoms(30, 5, random_state=3)
+    df = pd.DataFrame(X, index=np.arange(30) * 2)
+    rows = [29, 0, 3, 3, 17]
+    taken = PackedSymptoms.from_dense(df).take(rows)
+    assert (taken.to_dense() == X[rows]).all()
+    assert taken.index.equals(df.index[rows])
+
+
+@pytest.mark.parametrize('rows', [
+    [], [5], list(range(29, -1, -2)), slice(3, 26), np.arange(30) % 3 > 0])
+def test_packed_symptoms_take_blocks(rows):
+    X, _ = random_symptoms(30, 5, random_state=11)
+    packed = PackedSymptoms.from_dense(X)
+    packed.block_size = 8
+    taken = packed.take(rows)
+    assert taken.shape == X[rows].shape
+    assert (taken.to_dense() == X[rows]).all()
+    assert not np.unpackbits(taken.bits, axis=0)[len(taken):].any()
+
+
+def test_packed_symptoms_count_endorsements():
+    X, y = random_symptoms(203, 7, random_state=4)
+    causes, n_samples, counts = PackedSymptoms.from_dense(X) \
+        .count_endorsements(y)
+    expected = pd.DataFrame(X).groupby(y).sum()
+    assert (causes == expected.index).all()
+    assert (n_samples == pd.Series(y).value_counts().sort_index()).all()
+    assert (counts == expected.values).all()
+
+
+def test_packed_symptoms_weighted_sums():
+    X, _ = random_symptoms(77, 9, random_state=5)
+    weights = np.random.RandomState(5).randint(0, 4, (3, 77))
+    sums = PackedSymptoms.from_dense(X).weighted_sums(weights)
+    assert (sums == weights.dot(X)).all()
+
+
+def test_packed_symptoms_any_endorsed():
+    X, _ = random_symptoms(45, 6, random_state=6)
+    packed = PackedSymptoms.from_dense(X)
+    assert (packed.any_endorsed([1, 4]) == X[:, [1, 4]].any(1)).all()
+    mask = np.array([True, False, False, True, False, True])
+    assert (packed.any_endorsed(mask) == X[:, mask].any(1)).all()
+
+
+def test_symptom_matrix_from_dense():
+    X, _ = random_symptoms(21, 4, random_state=7)
+    df = pd.DataFrame(X, ['id{}'.format(i) for i in range(21)],
+                      ['s{}'.format(i) for i in range(4)])
+    df.insert(0, 'age_', np.arange(21.))
+    matrix = SymptomMatrix.from_dense(df, metadata=['age_'])
+    assert matrix.shape == (21, 4)
+    assert matrix.values.dtype == np.uint8
+    assert (matrix.values == X).all()
+    assert matrix.columns.equals(df.columns[1:])
+    assert matrix.index.equals(df.index)
+    assert matrix.to_frame(3, 8).equals(df.iloc[3:8].astype(
+        dict.fromkeys(matrix.columns, np.uint8)))
+
+    matrix = SymptomMatrix.from_dense(X)
+    assert matrix.columns is None and matrix.index is None
+    assert (SymptomMatrix(X.astype(float)).values == X).all()
+
+
+@pytest.mark.parametrize('value', [2, 1.7, 0.6, -1])
+def test_symptom_matrix_not_binary(value):
+    X = np.ones((5, 3))
+    X[2, 1] = value
+    with pytest.raises(ValueError):
+        SymptomMatrix.from_dense(X)
+    with pytest.raises(ValueError):
+        SymptomMatrix(X)
+    with pytest.raises(ValueError):
+        SymptomMatrix(sparse.csr_matrix(X))
+
+    with pytest.raises(ValueError):
+        SymptomMatrix.from_dense(np.ones((5, 3)), metadata=['age_'])
+
+
+def test_symptom_matrix_take():
+    X, _ = random_symptoms(30, 5, random_state=8)
+    df = pd.DataFrame(X, index=np.arange(30) * 2)
+    matrix = SymptomMatrix.from_dense(df)
+
+    rows = [29, 0, 3, 3, 17]
+    taken = matrix.take(rows)
+    assert (taken.values == X[rows]).all()
+    assert taken.index.equals(df.index[rows])
+
+    sliced = matrix.take(slice(4, 12))
+    assert np.shares_memory(sliced.values, matrix.values)
+    assert (sliced.to_dense() == X[4:12]).all()
+
+
+@pytest.mark.parametrize('fmt', ['csr', 'csc'])
+def test_symptom_matrix_from_sparse(fmt):
+    X, _ = random_symptoms(25, 6, random_state=9)
+    matrix = SymptomMatrix.from_sparse(sparse.csr_matrix(X).asformat(fmt))
+    assert sparse.isspmatrix_csr(matrix.values)
+    assert matrix.values.dtype == np.uint8
+    assert (matrix.to_dense() == X).all()
+    assert (matrix.to_dense(3, 9) == X[3:9]).all()
+    assert (matrix.take([4, 0, 4]).to_dense() == X[[4, 0, 4]]).all()
+
+    X = X.astype(float)
+    X[np.nonzero(X)[0][0], np.nonzero(X)[1][0]] = 0.5
+    with pytest.raises(ValueError):
+        SymptomMatrix.from_sparse(sparse.csr_matrix(X).asformat(fmt))
+
+
+def test_symptom_matrix_from_chunks():
+    X, _ = random_symptoms(23, 5, random_state=10)
+    df = pd.DataFrame(X, ['id{}'.format(i) for i in range(23)])
+    df.insert(0, 'age_', np.arange(23.))
+    chunks = [df.iloc[:10], df.iloc[10:20], df.iloc[20:]]
+    matrix = SymptomMatrix.from_chunks(chunks, metadata=['age_'])
+    assert sparse.isspmatrix_csr(matrix.values)
+    assert (matrix.to_dense() == X).all()
+    assert matrix.index.equals(df.index)
+    assert matrix.metadata.equals(df[['age_']])
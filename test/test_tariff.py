@@ -1,7 +1,12 @@
+import os
+
 import numpy as np
 import pandas as pd
 import pytest
+from scipy import sparse
 
+from src.cache import ArtifactCache
+from src.symptoms import PackedSymptoms, SymptomMatrix
 from src.tariff import *
 
 
@@ -35,6 +40,37 @@ def test_tariffs_from_endorsemets_zero_iqr():
     assert (tariffs == expected).all()
 
 
+def test_tariffs_from_endorsements_axis():
+    arr = np.random.random((4, 6, 5))
+    arr[:, :, 0] = 0   # zero IQR
+
+    tariffs = tariffs_from_endorsements(arr, axis=1)
+    assert tariffs.shape == arr.shape
+    for i in range(arr.shape[0]):
+        for k in range(arr.shape[2]):
+            expected = tariffs_from_endorsements(arr[i, :, k])
+            assert (tariffs[i, :, k] == expected).all()
+
+
+def test_calc_tariff_ui():
+    bootstraps = 50
+    endors = np.random.random((bootstraps, 5, 8))
+    lower, upper = calc_tariff_ui(endors, (2.5, 97.5))
+    assert lower.shape == upper.shape == (5, 8)
+    assert (lower <= upper).all()
+
+    tariffs = np.array([np.apply_along_axis(tariffs_from_endorsements, 0, d)
+                        for d in endors])
+    for j in range(5):
+        for k in range(8):
+            expected = np.percentile(tariffs[:, j, k], [2.5, 97.5])
+            assert (np.array([lower[j, k], upper[j, k]]) == expected).all()
+
+    reversed_lower, reversed_upper = calc_tariff_ui(endors, (97.5, 2.5))
+    assert (lower == reversed_lower).all()
+    assert (upper == reversed_upper).all()
+
+
 def test_calc_tariffs_shape():
     n_causes = 5
     n_symptoms = 10
@@ -74,6 +110,126 @@ def test_bootstrap_endorsements_by_cause():
     assert False
 
 
+def test_bootstrap_endorsements_multinomial_engine_index():
+    X = random_ones_zeros((100, 10))
+    y = np.random.choice(5, 100)
+
+    expected = boostrap_endorsements_by_causes(X, y, 20, engine='pandas')
+    endors = boostrap_endorsements_by_causes(X, y, 20, engine='multinomial')
+    assert isinstance(endors, pd.DataFrame)
+    assert endors.shape == expected.shape
+    assert (endors.index == expected.index).all()
+    assert (endors.columns == expected.columns).all()
+    assert ((endors >= 0) & (endors <= 1)).all().all()
+
+    # Every draw is the mean of a resample of the same size as the cause
+    n_by_cause = pd.Series(y).value_counts()
+    sums = endors.mul(n_by_cause, axis=0, level='cause')
+    assert np.allclose(sums, np.round(sums))
+
+
+def test_bootstrap_endorsements_multinomial_engine_seed():
+    X = random_ones_zeros((100, 10))
+    y = np.random.choice(5, 100)
+
+    draws = [boostrap_endorsements_by_causes(X, y, 20, random_state=1234,
+                                             engine='multinomial')
+             for _ in range(3)]
+    assert all((draws[0] == df).all().all() for df in draws)
+
+
+def phmrc_shaped_data(n_causes=12, n_symptoms=40, random_state=None):
+    """Binary symptoms with uneven cause sizes and low endorsement rates"""
+    rs = np.random.RandomState(random_state)
+    n_by_cause = rs.randint(20, 300, n_causes)
+    rates = rs.beta(0.5, 3, (n_causes, n_symptoms))
+    y = np.repeat(np.arange(n_causes), n_by_cause)
+    X = (rs.random_sample((y.shape[0], n_symptoms)) < rates[y]).astype(int)
+    return X, y
+
+
+def test_count_endorsements():
+    X, y = phmrc_shaped_data(random_state=3)
+    causes, n_samples, counts = count_endorsements(X, y)
+    expected = pd.DataFrame(X).groupby(y).sum()
+    assert (causes == expected.index).all()
+    assert (n_samples == np.bincount(y)).all()
+    assert (counts == expected.values).all()
+
+
+def test_binomial_endorsements_shape():
+    counts = np.array([[0, 5, 10],
+                       [3, 3, 3]])
+    n_samples = np.array([10, 20])
+    endors = binomial_endorsements(counts, n_samples, 7, random_state=0)
+    assert endors.shape == (7, 2, 3)
+    assert (endors[:, 0, 0] == 0).all()
+    assert (endors[:, 0, 2] == 1).all()
+
+
+def test_bootstrap_endorsements_binomial_is_equivalent_to_resampling():
+    X, y = phmrc_shaped_data(random_state=42)
+    bootstraps = 1000
+
+    resampled = boostrap_endorsements_by_causes(
+        X, y, bootstraps, random_state=1, engine='multinomial')
+    binomial = boostrap_endorsements_by_causes(
+        X, y, bootstraps, random_state=2, method='binomial')
+    assert (resampled.index == binomial.index).all()
+
+    # Both have the same per-cell mean and standard error. Tolerances are
+    # loose enough to account for monte carlo error with 1000 draws.
+    grouped_resampled = resampled.groupby(level='cause')
+    grouped_binomial = binomial.groupby(level='cause')
+    mean_diff = grouped_resampled.mean() - grouped_binomial.mean()
+    std = grouped_resampled.std()
+    tolerance = 5 * std * np.sqrt(2 / bootstraps) + 1e-12
+    assert (mean_diff.abs() <= tolerance).all().all()
+    nonzero = std > 0
+    ratio = grouped_binomial.std()[nonzero] / std[nonzero]
+    assert ratio.stack().between(0.85, 1.15).all()
+
+    # And lead to nearly identical decisions about significance
+    insig_resampled = calc_insignificant_tariffs(
+        X, y, 500, random_state=3, engine='multinomial')
+    insig_binomial = calc_insignificant_tariffs(
+        X, y, 500, random_state=4, method='binomial')
+    assert np.mean(insig_resampled == insig_binomial) > 0.95
+
+
+@pytest.mark.parametrize('method', ['resample', 'binomial'])
+def test_bootstrap_endorsements_n_jobs_seed(method):
+    X, y = phmrc_shaped_data(random_state=7)
+
+    draws = [bootstrap_endorsements(X, y, 30, random_state=1234, n_jobs=3,
+                                    engine='multinomial', method=method)[1]
+             for _ in range(3)]
+    assert draws[0].shape == (30, 12, 40)
+    assert all((draws[0] == arr).all() for arr in draws)
+
+
+def test_bootstrap_endorsements_n_jobs_equivalent():
+    X, y = phmrc_shaped_data(random_state=7)
+    bootstraps = 1000
+
+    _, serial = bootstrap_endorsements(X, y, bootstraps, random_state=1,
+                                       engine='multinomial')
+    _, parallel = bootstrap_endorsements(X, y, bootstraps, random_state=1,
+                                         engine='multinomial', n_jobs=4)
+    assert serial.shape == parallel.shape
+
+    std = serial.std(0)
+    tolerance = 5 * std * np.sqrt(2 / bootstraps) + 1e-12
+    assert (np.abs(serial.mean(0) - parallel.mean(0)) <= tolerance).all()
+
+
+def test_multinomial_endorsements_mean():
+    X = random_ones_zeros((200, 10))
+    endors = multinomial_endorsements(X, 2000, random_state=42)
+    assert endors.shape == (2000, 10)
+    assert np.allclose(endors.mean(0), X.mean(0), atol=0.01)
+
+
 def test_calc_insignificant_tariffs_shape():
     n_causes = 5
     n_symptoms = 10
@@ -167,6 +323,100 @@ def test_calc_insignificant_tariffs_ui_order():
     assert np.all(ascending == descending)
 
 
+def test_calc_insignificant_tariffs_block_size():
+    X, y = phmrc_shaped_data(random_state=11)
+    kwargs = dict(bootstraps=95, ui=(0.5, 99.5), random_state=2301598121,
+                  engine='multinomial', block_size=10)
+
+    insig, lower, upper = calc_insignificant_tariffs(X, y, return_ui=True,
+                                                     **kwargs)
+    assert insig.shape == lower.shape == upper.shape == (12, 40)
+    assert (insig == ((lower <= 0) & (upper >= 0))).all()
+
+    # The streamed bounds are exact
+    _, blocks = bootstrap_endorsement_blocks(
+        X, y, 95, 2301598121, 'multinomial', block_size=10)
+    expected = calc_tariff_ui(np.concatenate(list(blocks)), (0.5, 99.5))
+    assert (lower == expected[0]).all()
+    assert (upper == expected[1]).all()
+
+    # and do not depend on the number of threads
+    parallel = calc_insignificant_tariffs(X, y, return_ui=True, n_jobs=3,
+                                          **kwargs)
+    assert all((a == b).all() for a, b in zip(parallel, (insig, lower, upper)))
+
+
+def test_calc_insignificant_tariffs_return_ui_dataframe():
+    X, y = phmrc_shaped_data(random_state=11)
+    X = pd.DataFrame(X, columns=['s{}'.format(i) for i in range(40)])
+    insig, lower, upper = calc_insignificant_tariffs(X, y, 20, return_ui=True)
+    for df in (insig, lower, upper):
+        assert isinstance(df, pd.DataFrame)
+        assert (df.columns == X.columns).all()
+        assert (df.index == np.unique(y)).all()
+
+
+def test_sequential_insignificant_tariffs_stops_early():
+    # Every cause strongly endorses its own symptom and rarely the others
+    rs = np.random.RandomState(5)
+    n_causes = 8
+    y = np.repeat(np.arange(n_causes), 100)
+    X = (rs.random_sample((y.shape[0], n_causes)) <
+         np.where(np.eye(n_causes, dtype=bool), 0.9, 0.05)[y]).astype(int)
+
+    kwargs = dict(max_bootstraps=500, batch_size=25, engine='multinomial')
+    insig, n_draws, borderline = sequential_insignificant_tariffs(
+        X, y, confidence=0.8, random_state=5, **kwargs)
+    assert n_draws < 500
+    assert insig.shape == borderline.shape == (n_causes, n_causes)
+    assert not np.diag(insig).any()
+    assert not borderline.any()
+
+    insig, n_draws, borderline = sequential_insignificant_tariffs(
+        X, y, tolerance=0.1, random_state=5, **kwargs)
+    assert n_draws < 500
+    assert 0 < borderline.mean() <= 0.1
+
+
+def test_sequential_insignificant_tariffs_max_bootstraps():
+    X, y = phmrc_shaped_data(random_state=13)
+    kwargs = dict(ui=(2.5, 97.5), random_state=8, engine='multinomial')
+
+    insig, n_draws, borderline = sequential_insignificant_tariffs(
+        X, y, 100, 20, tolerance=0, **kwargs)
+    expected = calc_insignificant_tariffs(X, y, 100, block_size=20, **kwargs)
+    assert n_draws == 100
+    assert borderline.any()
+    assert (insig == expected).all()
+
+
+def test_sequential_single_block():
+    # Fewer draws than the default block size of 50
+    X, y = phmrc_shaped_data(random_state=17)
+    kwargs = dict(random_state=17, engine='multinomial')
+    insig = calc_insignificant_tariffs(X, y, 40, sequential=True, **kwargs)
+    expected = calc_insignificant_tariffs(X, y, 40, **kwargs)
+    assert (insig == expected).all()
+
+    clf = TariffClassifier(bootstraps=30, sequential_bootstrap=True,
+                           random_state=17).fit(X, y)
+    assert clf.tariffs_.shape == (12, 40)
+
+
+def test_sequential_insignificant_tariffs_dataframe():
+    X, y = phmrc_shaped_data(random_state=13)
+    X = pd.DataFrame(X, columns=['s{}'.format(i) for i in range(40)])
+    insig, _, borderline = sequential_insignificant_tariffs(X, y, 40, 20)
+    for df in (insig, borderline):
+        assert isinstance(df, pd.DataFrame)
+        assert (df.columns == X.columns).all()
+        assert (df.index == np.unique(y)).all()
+
+    insig_df = calc_insignificant_tariffs(X, y, 40, block_size=20,
+                                          sequential=True, random_state=3)
+    assert isinstance(insig_df, pd.DataFrame)
+
+
 def test_round_tariffs():
     tariffs = np.array([[0, .7, 1.1],
                         [-.3, .5, .66666]])
@@ -292,6 +542,59 @@ def test_score_samples():
     assert (scored == expected).all().all()
 
 
+@pytest.mark.parametrize('chunk_size', [None, 1, 7, 1000])
+def test_score_samples_chunks(chunk_size):
+    X = random_ones_zeros((50, 30)).astype(int)
+    tariffs = np.round(np.random.normal(0, 5, (6, 30)) * 2) / 2
+    expected = (X[:, :, None] * tariffs.T[None, :, :]).sum(1)
+
+    scored = score_samples(X, tariffs, chunk_size=chunk_size)
+    assert scored.shape == (50, 6)
+    assert scored.dtype == np.float64
+    assert (scored == expected).all()
+
+
+def test_score_samples_integer_tariffs():
+    X = random_ones_zeros((50, 30)).astype(int)
+    tariffs = np.round(np.random.normal(0, 5, (6, 30)) * 2) / 2
+    codes = encode_scores(tariffs, 0.5)
+
+    scored = score_samples(X, codes, chunk_size=7)
+    assert scored.dtype == np.int32
+    assert (scored * 0.5 == score_samples(X, tariffs)).all()
+
+
+@pytest.mark.parametrize('sparse_X', [False, True])
+@pytest.mark.parametrize('integer', [False, True])
+def test_score_samples_sparse(sparse_X, integer):
+    X = random_ones_zeros((50, 30)).astype(np.uint8)
+    tariffs = np.round(np.random.normal(0, 5, (6, 30)) * 2) / 2
+    tariffs[:, :10] = 0  # symptoms without tariffs for any cause
+    tariffs = keep_top_symptoms(tariffs, top_n=8)
+    if integer:
+        tariffs = encode_scores(tariffs, 0.5)
+    expected = score_samples(X, tariffs)
+
+    X_input = sparse.csr_matrix(X) if sparse_X else X
+    for T in [tariffs, sparse.csr_matrix(tariffs)]:
+        scored = score_samples(X_input, T, chunk_size=7)
+        assert isinstance(scored, np.ndarray)
+        assert scored.dtype == expected.dtype
+        assert (scored == expected).all()
+
+
+def test_encode_scores():
+    codes = encode_scores(np.array([[-1.5, 0, 2.5]]), 0.5)
+    assert codes.dtype == np.int8
+    assert (codes == [[-3, 0, 5]]).all()
+
+    assert encode_scores(np.array([[0.5, 100]]), 0.5).dtype == np.int16
+    assert encode_scores(np.array([[0.3, 0.1 + 0.2]]), 0.1).tolist() == [[3, 3]]
+
+    with pytest.raises(ValueError):
+        encode_scores(np.array([[0.5, 0.7]]), 0.5)
+
+
 def test_generate_uniform_list_array():
     n_causes = 5
     n_symptoms = 10
@@ -351,6 +654,101 @@ def test_generate_uniform_list_dataframe():
     # assert (X_scored.loc[X_uniform.index] == X_uniform).all().all()
 
 
+def test_generate_weighted_uniform_list():
+    X, y = phmrc_shaped_data(random_state=37)
+    X = pd.DataFrame(X, ['va{}'.format(i) for i in range(X.shape[0])])
+    y = pd.Series(y, X.index)
+    tariffs = calc_tariffs(X, y)
+
+    expanded, y_expanded = generate_uniform_list(X, y, tariffs,
+                                                 random_state=37)
+    X_uniform, y_uniform, weights = generate_weighted_uniform_list(
+        X, y, tariffs, random_state=37)
+    assert (X_uniform.index == y_uniform.index).all()
+    assert X_uniform.index.is_unique
+    assert weights.sum() == expanded.shape[0]
+
+    # Same draws, with each drawn sample kept once
+    counts = y_expanded.index.value_counts()
+    assert (counts[X_uniform.index].values == weights).all()
+    assert (y_uniform == y_expanded.groupby(level=0).first()[y_uniform.index]
+            ).all()
+    unique = expanded[~expanded.index.duplicated()].sort_index()
+    assert unique.equals(X_uniform.sort_index())
+
+
+@pytest.mark.parametrize('cutoff', [0, 5, 50, 72.5, 95, 100])
+def test_calc_cutoffs_weighted(cutoff):
+    rs = np.random.RandomState(41)
+    X = rs.randint(-5, 6, (300, 6))
+    y = rs.randint(0, 6, 300)
+    weights = rs.randint(0, 5, 300)
+    weights[:6] += 1
+    y[:6] = np.arange(6)
+
+    expected = calc_cutoffs(np.repeat(X, weights, 0), np.repeat(y, weights),
+                            cutoff)
+    scores, ranks = calc_cutoffs(X, y, cutoff, weights)
+    assert (scores == expected[0]).all()
+    assert (ranks == expected[1]).all()
+
+
+@pytest.mark.parametrize('input_is_df', [True, False])
+def test_calc_cutoff_table(input_is_df):
+    rs = np.random.RandomState(47)
+    X = rs.randint(-5, 6, (300, 6)).astype(float)
+    y = rs.randint(0, 6, 300)
+    cutoffs = [0, 12.5, 50, 95, 100]
+
+    # Positions within each cause after reversing a stable sort
+    X_sorted = X.argsort(0, kind='mergesort')[::-1]
+    expected_ranks = np.array([
+        [np.percentile(np.where(y[X_sorted[:, j]] == j)[0] + 1, cutoff,
+                       interpolation='higher') for j in range(6)]
+        for cutoff in cutoffs])
+    expected_scores = np.array([
+        X[X_sorted[ranks - 1, np.arange(6)], np.arange(6)]
+        for ranks in expected_ranks])
+
+    if input_is_df:
+        X = pd.DataFrame(X, columns=['c{}'.format(j) for j in range(6)])
+    scores, ranks = calc_cutoff_table(X, y, cutoffs)
+    assert (np.asarray(ranks) == expected_ranks).all()
+    assert (np.asarray(scores) == expected_scores).all()
+    if input_is_df:
+        assert list(ranks.index) == cutoffs
+        assert (ranks.columns == X.columns).all()
+        single = calc_cutoffs(X, y, 95)
+        assert single[1].equals(ranks.loc[95].rename(None))
+    else:
+        assert (calc_cutoffs(X, y, 95)[1] == ranks[3]).all()
+
+    with pytest.raises(ValueError):
+        calc_cutoff_table(X, y, [101])
+
+
+def test_rank_samples_weighted():
+    rs = np.random.RandomState(43)
+    X_train = rs.randint(-5, 6, (200, 4))
+    weights = rs.randint(0, 5, 200)
+    X_test = rs.randint(-7, 8, (50, 4))
+    expected = rank_samples(X_test, np.repeat(X_train, weights, 0))
+
+    assert (rank_samples(X_test, X_train, weights=weights) == expected).all()
+    X_sorted, cum_weights = sort_weighted_scores(X_train, weights)
+    assert (X_sorted == np.sort(X_train, 0)).all()
+    assert cum_weights.shape == (201, 4)
+    assert (cum_weights[-1] == weights.sum()).all()
+    ranked = rank_samples(X_test.astype(float), X_sorted.astype(float), True,
+                          weights=cum_weights)
+    assert (ranked == expected).all()
+    table = RankTable(X_sorted, cum_weights=cum_weights)
+    assert (table.lookup(X_test) == expected).all()
+
+    with pytest.raises(ValueError):
+        sort_weighted_scores(X_train, weights - 1)
+
+
 def test_calc_cutoffs():
     assert False
 
@@ -386,6 +784,352 @@ def test_rank_samples():
     assert (ranked == expected).all().all()
 
 
+def test_rank_samples_matches_pairwise_comparison():
+    # Integer scores to force plenty of ties
+    X_test = np.random.randint(-5, 15, (60, 4)).astype(float)
+    X_train = np.random.randint(0, 10, (200, 4)).astype(float)
+
+    lower = (X_test[:, :, None] < X_train.T[None, :, :]).sum(2)
+    higher = (X_test[:, :, None] > X_train.T[None, :, :]).sum(2)
+    expected = (lower + (X_train.shape[0] - higher)) / 2 + 0.5
+
+    ranked = rank_samples(X_test, X_train)
+    assert (ranked == expected).all()
+
+    ranked = rank_samples(X_test, sort_scores(X_train), presorted=True)
+    assert (ranked == expected).all()
+
+
+def test_sort_scores():
+    X = np.random.random((20, 3))
+    X_sorted = sort_scores(X)
+    assert X_sorted.flags['F_CONTIGUOUS']
+    assert (np.diff(X_sorted, axis=0) >= 0).all()
+    assert (np.sort(X, axis=0) == X_sorted).all()
+
+
+@pytest.mark.parametrize('dtype', [np.int8, np.int16, np.int32])
+def test_rank_table_matches_rank_samples(dtype):
+    X_train = np.random.randint(-4, 20, (200, 4)).astype(dtype)
+    X_test = np.random.randint(-10, 30, (60, 4)).astype(dtype)
+    X_sorted = sort_scores(X_train)
+
+    table = RankTable(X_sorted)
+    expected = rank_samples(X_test.astype(float), X_train.astype(float))
+    assert (table.lookup(X_test) == expected).all()
+    assert (rank_samples(X_test, X_sorted, True, table) == expected).all()
+
+
+def test_rank_table_float_scores():
+    X_train = np.random.randint(0, 10, (50, 3))
+    table = RankTable(sort_scores(X_train))
+
+    # Float test scores are searched instead of looked up
+    X_test = np.random.randint(0, 10, (20, 3)) + 0.5
+    expected = rank_samples(X_test, X_train)
+    assert (rank_samples(X_test, X_train, table=table) == expected).all()
+
+    with pytest.raises(ValueError):
+        RankTable(sort_scores(X_train + 0.5))
+    with pytest.raises(ValueError):
+        RankTable(sort_scores(X_train), max_size=10)
+
+
+def test_classifier_integer_codes():
+    X, y = phmrc_shaped_data(random_state=5)
+    clf = TariffClassifier(bootstraps=20, random_state=5).fit(X, y)
+    assert clf.tariff_codes_.dtype == np.int8
+    assert np.issubdtype(clf.X_uniform_sorted_.dtype, np.integer)
+    assert (clf.tariff_codes_ * clf.precision == clf.tariffs_).all()
+    assert (clf.sparse_tariffs_.toarray() == clf.tariff_codes_).all()
+
+    pred, csmf = clf.predict(X)
+    scored = clf.scored_
+    assert scored.dtype == np.float64
+
+    # Predict again with the float tariffs and uniform list
+    clf.precision = None
+    clf._prepare_scoring(clf.tariffs_, clf.X_uniform_, clf.uniform_weights_)
+    clf._compile_plan()
+    assert clf.tariff_codes_ is None and clf.rank_table_ is None
+    pred_float, csmf_float = clf.predict(X)
+    assert (scored == clf.scored_).all()
+    assert pred.equals(pred_float)
+
+
+def staged_predictions(clf, X, metadata, chunk_size=10000):
+    """Predict by calling each step of the prediction in turn"""
+    # Float matrix products can differ in the last bit with the number of
+    # rows multiplied at a time, so score in the same chunks as the plan
+    scored = score_samples(X, sparse.csr_matrix(clf.tariffs_), chunk_size)
+    ranked = rank_samples(scored, clf.X_uniform_,
+                          weights=clf.uniform_weights_)
+    certain = mask_uncertain(scored, ranked, clf.uniform_weights_.sum(),
+                             min_score=clf.min_cause_score,
+                             cutoffs=clf.cutoff_ranks_,
+                             min_pct=clf.overall_pct_cutoff)
+    uncensored = censor_predictions(X, certain, clf.censoring, clf.causes_,
+                                    clf.symptoms_)
+    valid = apply_restrictions(uncensored, clf.causes_, metadata,
+                               clf.restrictions)
+    return best_ranked_causes(valid, clf.causes_), dict(
+        scored=scored, ranked=ranked, certain=certain, valid=valid)
+
+
+@pytest.mark.parametrize('precision', [0.5, None])
+@pytest.mark.parametrize('chunk_size', [7, 10000])
+@pytest.mark.parametrize('intermediates', [True, False])
+def test_inference_plan_matches_staged(precision, chunk_size, intermediates):
+    X, y = phmrc_shaped_data(random_state=13)
+    rs = np.random.RandomState(13)
+    metadata = {'age_': rs.randint(0, 90, X.shape[0]).astype(float),
+                'sex_': rs.choice([1, 2], X.shape[0]),
+                'region_': rs.choice(['a', 'b'], X.shape[0])}
+    clf = TariffClassifier(
+        bootstraps=20, random_state=13, precision=precision,
+        min_cause_score=1, cause_pct_cutoff=80, overall_pct_cutoff=60,
+        censoring={0: [1, 2], 3: [5]},
+        restrictions={'males_only': [1], 'females_only': [2, 3],
+                      'min_age': [(15, [4, 5])], 'regions': [('b', [6])]})
+    clf.fit(X, y)
+    clf.plan_.chunk_size = chunk_size
+
+    expected, steps = staged_predictions(clf, X, metadata, chunk_size)
+    pred, results = clf.plan_.run(X, metadata, intermediates)
+    assert pd.Series(pred).equals(pd.Series(expected))
+
+    if intermediates:
+        scored = results['scored'] * (precision or 1)
+        assert (scored == steps['scored']).all()
+        for key in ['ranked', 'certain', 'valid']:
+            assert np.array_equal(results[key], steps[key], equal_nan=True)
+    else:
+        assert results is None
+
+
+def kept_intermediates(clf):
+    """Intermediate results of the last prediction by label"""
+    return {label: getattr(clf, label + '_') for label in INTERMEDIATES}
+
+
+def assert_same_intermediates(clf, kept):
+    """Check the scores, ranks and masks of the last prediction"""
+    for label in ['scored', 'ranked', 'certain', 'valid']:
+        assert np.array_equal(getattr(clf, label + '_'), kept[label],
+                              equal_nan=True)
+
+
+def test_predict_without_intermediates():
+    X, y = phmrc_shaped_data(random_state=17)
+    X = pd.DataFrame(X, columns=['s{}'.format(i) for i in range(X.shape[1])])
+    y = pd.Series(y).map('cause{}'.format)
+    clf = TariffClassifier(bootstraps=20, random_state=17).fit(X, y)
+
+    pred, csmf = clf.predict(X)
+    kept = kept_intermediates(clf)
+
+    clf.keep_intermediates = False
+    pred_lean, csmf_lean = clf.predict(X)
+    assert pred_lean.equals(pred)
+    assert csmf_lean.equals(csmf)
+    for label in INTERMEDIATES:
+        assert not hasattr(clf, label + '_')
+
+    results = clf.predict_intermediates(X)
+    assert sorted(results) == sorted(INTERMEDIATES)
+    for label in INTERMEDIATES:
+        assert type(results[label]) == type(kept[label])
+        assert results[label].equals(kept[label])
+
+
+def test_predict_without_intermediates_metadata():
+    X, y = phmrc_shaped_data(random_state=19)
+    X = pd.DataFrame(X, columns=['s{}'.format(i) for i in range(X.shape[1])])
+    X.insert(0, 'age_', np.random.RandomState(19).randint(0, 90, len(X)))
+    y = pd.Series(y).map('cause{}'.format)
+    clf = TariffClassifier(bootstraps=20, random_state=19, metadata=['age_'],
+                           restrictions={'min_age': [(15, ['cause1'])]})
+    clf.fit(SymptomMatrix.from_dense(X, metadata=['age_']), y)
+    assert clf.X_.metadata is None
+
+    pred, _ = clf.predict(X)
+    assert clf.age_.equals(X.age_)
+
+    clf.keep_intermediates = False
+    assert clf.predict(X)[0].equals(pred)
+    assert not hasattr(clf, 'age_')
+    assert not any(isinstance(value, pd.DataFrame) and len(value) == len(X)
+                   for value in vars(clf).values())
+
+
+@pytest.mark.parametrize('precision', [0.5, None])
+@pytest.mark.parametrize('n_jobs', [2, 3, -1])
+def test_predict_n_jobs(precision, n_jobs):
+    X, y = phmrc_shaped_data(random_state=23)
+    X = pd.DataFrame(X, ['va{}'.format(i) for i in range(X.shape[0])],
+                     ['s{}'.format(i) for i in range(X.shape[1])])
+    y = pd.Series(y, X.index).map('cause{}'.format)
+    clf = TariffClassifier(bootstraps=20, random_state=23,
+                           precision=precision).fit(X, y)
+    clf.plan_.chunk_size = 7
+
+    pred, csmf = clf.predict(X)
+    kept = kept_intermediates(clf)
+
+    pred_jobs, csmf_jobs = clf.predict(X, n_jobs=n_jobs)
+    assert pred_jobs.equals(pred)
+    assert pred_jobs.index.equals(X.index)
+    assert csmf_jobs.equals(csmf)
+    for label in INTERMEDIATES:
+        assert getattr(clf, label + '_').equals(kept[label])
+
+    clf.n_jobs = n_jobs
+    clf.keep_intermediates = False
+    assert clf.predict(X)[0].equals(pred)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3])
+def test_predict_empty(n_jobs):
+    X, y = phmrc_shaped_data(random_state=27)
+    X = pd.DataFrame(X, columns=['s{}'.format(i) for i in range(X.shape[1])])
+    clf = TariffClassifier(bootstraps=20, random_state=27).fit(X, y)
+    empty = SymptomMatrix.from_dense(X).take(slice(0, 0))
+
+    pred, csmf = clf.predict(empty, n_jobs=n_jobs)
+    assert pred.empty and csmf.empty
+    assert clf.scored_.shape == (0, clf.n_causes_)
+
+    clf.keep_intermediates = False
+    assert clf.predict(empty, n_jobs=n_jobs)[0].empty
+
+
+@pytest.mark.parametrize('precision', [0.5, None])
+@pytest.mark.parametrize('input_is_df', [True, False])
+def test_save_artifact(tmpdir, precision, input_is_df):
+    X, y = phmrc_shaped_data(random_state=29)
+    rs = np.random.RandomState(29)
+    X = pd.DataFrame(X, columns=['s{}'.format(i) for i in range(X.shape[1])])
+    X.insert(0, 'age_', rs.randint(0, 90, X.shape[0]).astype(float))
+    X.insert(1, 'sex_', rs.choice([1, 2], X.shape[0]))
+    X.insert(2, 'region_', rs.choice(['a', 'b'], X.shape[0]))
+    y = pd.Series(y).map('cause{}'.format)
+    if not input_is_df:
+        X, y = X.values, y.values
+    clf = TariffClassifier(
+        bootstraps=20, random_state=29, precision=precision,
+        min_cause_score=1, cause_pct_cutoff=80, overall_pct_cutoff=60,
+        metadata=['age_', 'sex_', 'region_'],
+        censoring={'cause0': ['s1', 's2'] if input_is_df else [1, 2]},
+        restrictions={'males_only': ['cause1'], 'min_age': [(15, ['cause4'])],
+                      'regions': [('b', ['cause6'])]})
+    clf.fit(X, y)
+    pred, csmf = clf.predict(X)
+    kept = kept_intermediates(clf)
+
+    path = str(tmpdir.join('artifact'))
+    clf.save_artifact(path)
+    loaded = load_artifact(path)
+    assert loaded.get_params() == clf.get_params()
+    assert isinstance(loaded.plan_.X_sorted, np.memmap)
+    assert not hasattr(loaded, 'X_') and not hasattr(loaded, 'X_uniform_')
+    assert type(loaded.tariffs_) == type(clf.tariffs_)
+    assert np.array_equal(loaded.tariffs_, clf.tariffs_)
+    assert np.array_equal(loaded.cutoff_ranks_, clf.cutoff_ranks_)
+
+    pred_loaded, csmf_loaded = loaded.predict(X)
+    assert pred_loaded.equals(pred)
+    assert csmf_loaded.equals(csmf)
+    assert_same_intermediates(loaded, kept)
+
+    in_memory = load_artifact(path, mmap_mode=None)
+    assert not isinstance(in_memory.plan_.X_sorted, np.memmap)
+    assert in_memory.predict(X)[0].equals(pred)
+
+
+def test_save_artifact_mixed_labels(tmpdir):
+    X, y = phmrc_shaped_data(random_state=31)
+    X = pd.DataFrame(X, columns=['s0'] + list(range(1, X.shape[1])))
+    clf = TariffClassifier(bootstraps=20, random_state=31).fit(X, y)
+    with pytest.raises(ValueError):
+        clf.save_artifact(str(tmpdir.join('artifact')))
+
+
+def test_predict_iter(tmpdir):
+    X, y = phmrc_shaped_data(random_state=19)
+    X = pd.DataFrame(X, ['va{}'.format(i) for i in range(X.shape[0])],
+                     ['s{}'.format(i) for i in range(X.shape[1])])
+    X.index.name = 'sid'
+    y = pd.Series(y, X.index).map('cause{}'.format)
+    clf = TariffClassifier(bootstraps=20, random_state=19).fit(X, y)
+    pred, csmf = clf.predict(X)
+
+    chunks = list(clf.predict_iter(X, chunksize=300))
+    assert len(chunks) == -(-X.shape[0] // 300)
+    assert pd.concat(chunks).equals(pred)
+
+    pred_array = pd.concat(clf.predict_iter(X.values, chunksize=300))
+    assert pred_array.equals(clf.predict(X.values)[0])
+
+    path = str(tmpdir.join('symptoms.csv'))
+    X.to_csv(path)
+    assert pd.concat(clf.predict_iter(path, chunksize=300)).equals(pred)
+
+    output = str(tmpdir.join('predictions.csv'))
+    clf.predict_file((X.iloc[i:i + 500] for i in range(0, len(X), 500)),
+                     output)
+    saved = pd.read_csv(output, index_col='sid').prediction
+    assert saved.equals(pred)
+
+
+@pytest.mark.parametrize('causes', ['cause{}'.format, int])
+def test_predict_csmf(causes):
+    X, y = phmrc_shaped_data(random_state=23)
+    y = pd.Series(y).map(causes)
+    clf = TariffClassifier(bootstraps=20, random_state=23, min_cause_score=2,
+                           redistribute=False).fit(X, y)
+    pred, _ = clf.predict(X)
+    expected = pred.replace('Undetermined', np.nan).value_counts(
+        dropna=False, normalize=True)
+
+    csmf = clf.predict_csmf(X, chunksize=250)
+    assert list(csmf.index[:-1]) == list(clf.causes_)
+    assert np.isnan(csmf.index[-1]) and csmf.iloc[-1] > 0
+    assert np.allclose(csmf.loc[expected.index], expected)
+    assert np.isclose(csmf.sum(), 1)
+
+    chunks = (X[i:i + 100] for i in range(0, X.shape[0], 100))
+    assert np.allclose(clf.predict_csmf(chunks), csmf)
+
+    clf.redistribute = True
+    redistributed = clf.predict_csmf(X)
+    assert not redistributed.index.isnull().any()
+    assert np.isclose(redistributed.sum(), 1)
+    undetermined = csmf.iloc[-1] / len(clf.causes_)
+    assert np.allclose(redistributed.loc[clf.causes_],
+                       csmf.iloc[:-1] + undetermined)
+
+
+def test_inference_plan_not_binary():
+    X, y = phmrc_shaped_data(random_state=13)
+    clf = TariffClassifier(bootstraps=20, random_state=13).fit(X, y)
+    X[5, 3] = 2
+    with pytest.raises(ValueError):
+        clf.plan_.run(X)
+
+
+def test_compile_restrictions():
+    causes = np.array(['A', 'B', 'C'])
+    compiled = compile_restrictions(causes, {'males_only': ['A'],
+                                             'min_age': [(15, ['B', 'C'])]})
+    assert len(compiled) == 2
+    label, compare, threshold, restricted = compiled[0]
+    assert (label, compare, threshold) == ('age_', np.less, 15)
+    assert restricted.tolist() == [False, True, True]
+    assert compiled[1][:3] == ('sex_', np.equal, 2)
+
+    assert compile_restrictions(causes) == []
+
+
 def test_mask_uncertain():
     assert False
 
@@ -398,6 +1142,36 @@ def test_apply_restrictions():
     assert False
 
 
+@pytest.mark.parametrize('causes', [list('ABCDEFGHIJKLMNOPQRST'), range(20)])
+def test_best_ranked_causes_matches_apply(causes):
+    # Few distinct ranks to force plenty of ties
+    ranks = np.random.randint(1, 6, (300, 20)).astype(float)
+    ranks[np.random.random(ranks.shape) < 0.6] = np.nan
+    ranks[:10] = np.nan
+    df = pd.DataFrame(ranks, columns=causes)
+
+    expected = df.apply(best_ranked, axis=1)
+    pred = best_ranked_causes(df)
+    assert isinstance(pred, pd.Series)
+    assert pred.equals(expected)
+
+    pred = best_ranked_causes(ranks, causes)
+    assert isinstance(pred, np.ndarray)
+    assert (pd.Series(pred) == expected)[10:].all()
+
+
+def test_best_ranked_causes_undetermined():
+    ranks = np.array([[np.nan, 2, 1],
+                      [np.nan, np.nan, np.nan],
+                      [3, np.nan, 4]])
+    pred = best_ranked_causes(ranks, ['A', 'B', 'C'], 'Undetermined')
+    assert pred.tolist() == ['C', 'Undetermined', 'A']
+
+    pred = best_ranked_causes(ranks)
+    assert pred[0] == 2 and pred[2] == 0
+    assert np.isnan(pred[1])
+
+
 @pytest.mark.parametrize('n_causes', [1, 5, 10, 50])
 def test_get_undetermined_proportions(n_causes):
     causes = np.arange(n_causes)
@@ -436,3 +1210,215 @@ class TestPredict(object):
         y = np.random.choice(range(5), 100)
         pred = clf.fit(X, y).predict(X)
         # assert not pred.isnull().sum()
+
+
+def represent_symptoms(X, representation, metadata=None):
+    """Convert dense symptoms to a packed, validated or sparse matrix"""
+    if representation == 'packed':
+        return PackedSymptoms.from_dense(X, metadata=metadata)
+    if representation == 'matrix':
+        return SymptomMatrix.from_dense(X, metadata=metadata)
+    return sparse.csr_matrix(X).asformat(representation)
+
+
+@pytest.mark.parametrize('representation, input_is_df', [
+    ('packed', True), ('packed', False), ('matrix', True), ('matrix', False),
+    ('csr', False), ('csc', False)])
+@pytest.mark.parametrize('engine', ['pandas', 'multinomial'])
+@pytest.mark.parametrize('method', ['resample', 'binomial'])
+def test_classifier_symptom_representations(representation, input_is_df,
+                                            engine, method):
+    X, y = phmrc_shaped_data(random_state=37)
+    rs = np.random.RandomState(37)
+    X = pd.DataFrame(X, ['va{}'.format(i) for i in range(X.shape[0])],
+                     ['s{}'.format(i) for i in range(X.shape[1])])
+    y = pd.Series(y, X.index).map('cause{}'.format)
+    kwargs = dict(bootstraps=20, random_state=37, bootstrap_engine=engine,
+                  bootstrap_method=method, cause_pct_cutoff=80,
+                  min_cause_score=1, censoring={'cause0': ['s1', 's2']})
+    if input_is_df:
+        X.insert(0, 'age_', rs.randint(0, 90, X.shape[0]).astype(float))
+        kwargs.update(metadata=['age_'],
+                      restrictions={'min_age': [(15, ['cause4'])]})
+        X_other = represent_symptoms(X, representation, metadata=['age_'])
+    else:
+        X, y = X.values, y.values
+        kwargs['censoring'] = {'cause0': [1, 2]}
+        X_other = represent_symptoms(X, representation)
+        assert np.array_equal(calc_tariffs(X_other, y), calc_tariffs(X, y))
+
+    clf = TariffClassifier(**kwargs).fit(X, y)
+    pred, csmf = clf.predict(X)
+    kept = kept_intermediates(clf)
+
+    clf_other = TariffClassifier(**kwargs).fit(X_other, y)
+    assert np.array_equal(clf_other.tariffs_, clf.tariffs_)
+    assert np.array_equal(clf_other.cutoff_ranks_, clf.cutoff_ranks_)
+
+    pred_other, csmf_other = clf_other.predict(X_other)
+    assert pred_other.equals(pred)
+    assert csmf_other.equals(csmf)
+    assert_same_intermediates(clf_other, kept)
+    assert pd.concat(clf_other.predict_iter(X_other, 50)).equals(pred)
+
+
+def test_classifier_symptom_matrix_not_binary():
+    X, y = phmrc_shaped_data(random_state=43)
+    X[5, 3] = 2
+    with pytest.raises(ValueError):
+        calc_tariffs(SymptomMatrix(X), y)
+
+    clf = TariffClassifier(bootstraps=5, random_state=43)
+    with pytest.raises(ValueError):
+        clf.fit(SymptomMatrix(X), y)
+
+    X[5, 3] = 1
+    clf.fit(X, y)
+    X[5, 3] = 2
+    with pytest.raises(ValueError):
+        clf.predict(SymptomMatrix(X))
+
+    # Fractions are not truncated to binaries
+    for value in (1.7, 0.6):
+        X_float = X.astype(float)
+        X_float[5, 3] = value
+        with pytest.raises(ValueError):
+            clf.fit(SymptomMatrix(X_float), y)
+
+
+def test_censor_predictions_sparse():
+    X, y = phmrc_shaped_data(n_causes=4, n_symptoms=6, random_state=53)
+    ranks = np.random.RandomState(53).random_sample((X.shape[0], 4))
+    censor = {0: [1, 2], 3: [5]}
+    expected = censor_predictions(X, ranks, censor, np.arange(4),
+                                  np.arange(6))
+    for X_sparse in [sparse.csr_matrix(X), sparse.csc_matrix(X)]:
+        censored = censor_predictions(X_sparse, ranks, censor, np.arange(4),
+                                      np.arange(6))
+        assert np.array_equal(censored, expected, equal_nan=True)
+
+    X_sparse = sparse.csr_matrix(X * 2)
+    with pytest.raises(ValueError):
+        censor_predictions(X_sparse, ranks, censor, np.arange(4),
+                           np.arange(6))
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(n_jobs=2),
+    dict(block_size=7),
+    dict(sequential=True),
+])
+def test_make_tariff_matrix_from_counts(kwargs):
+    X, y = phmrc_shaped_data(random_state=59)
+    expected = make_tariff_matrix(X, y, bootstraps=30, random_state=59,
+                                  bootstrap_method='binomial', **kwargs)
+    causes, n_samples, counts = count_endorsements(X, y)
+    tariffs = make_tariff_matrix_from_counts(causes, n_samples, counts,
+                                             bootstraps=30, random_state=59,
+                                             **kwargs)
+    for a, b in zip(tariffs, expected):
+        assert np.array_equal(a, b)
+
+    with pytest.raises(ValueError):
+        make_tariff_matrix_from_counts(causes, n_samples, counts + 1000)
+
+
+@pytest.mark.parametrize('input_is_df', [True, False])
+@pytest.mark.parametrize('sequential', [True, False])
+def test_classifier_partial_fit(input_is_df, sequential):
+    X, y = phmrc_shaped_data(random_state=61)
+    X = pd.DataFrame(X, ['va{}'.format(i) for i in range(X.shape[0])],
+                     ['s{}'.format(i) for i in range(X.shape[1])])
+    y = pd.Series(y, X.index).map('cause{}'.format)
+    if not input_is_df:
+        X, y = X.values, y.values
+    # The new samples include a cause which was not fitted before
+    first = (np.arange(X.shape[0]) % 3 > 0) & (np.asarray(y) != 'cause11')
+    rows = np.concatenate([np.flatnonzero(first), np.flatnonzero(~first)])
+    X_first, X_new, X_all = [X.iloc[r] if input_is_df else X[r]
+                             for r in [first, ~first, rows]]
+    y_first, y_new, y_all = [y.iloc[r] if input_is_df else y[r]
+                             for r in [first, ~first, rows]]
+
+    kwargs = dict(bootstraps=30, random_state=61, bootstrap_method='binomial',
+                  sequential_bootstrap=sequential, cause_pct_cutoff=80)
+    clf = TariffClassifier(**kwargs).fit(X_first, y_first)
+    assert 'cause11' not in clf.causes_
+    clf.partial_fit(X_new, y_new)
+    expected = TariffClassifier(**kwargs).fit(X_all, y_all)
+
+    assert np.array_equal(clf.causes_, expected.causes_)
+    assert np.array_equal(clf.cause_counts_, expected.cause_counts_)
+    assert np.array_equal(clf.endorsement_counts_,
+                          expected.endorsement_counts_)
+    assert type(clf.tariffs_) == type(expected.tariffs_)
+    assert np.array_equal(clf.tariffs_, expected.tariffs_)
+    assert np.array_equal(clf.uniform_weights_, expected.uniform_weights_)
+    assert np.array_equal(clf.cutoff_ranks_, expected.cutoff_ranks_)
+    assert np.array_equal(clf.predict(X)[0], expected.predict(X)[0])
+
+
+def test_classifier_partial_fit_errors():
+    X, y = phmrc_shaped_data(random_state=67)
+    clf = TariffClassifier(bootstraps=10, random_state=67)
+    assert np.array_equal(clf.partial_fit(X, y).tariffs_,
+                          TariffClassifier(bootstraps=10, random_state=67)
+                          .fit(X, y).tariffs_)
+    with pytest.raises(ValueError):
+        clf.partial_fit(X, y)
+
+    clf.bootstrap_method = 'binomial'
+    clf.fit(X, y)
+    with pytest.raises(ValueError):
+        clf.partial_fit(X[:, 1:], y)
+    with pytest.raises(ValueError):
+        clf.partial_fit(pd.DataFrame(X), y)
+
+
+@pytest.mark.parametrize('input_is_df', [True, False])
+def test_make_tariff_matrix_cache(tmpdir, input_is_df):
+    X, y = phmrc_shaped_data(random_state=71)
+    if input_is_df:
+        X = pd.DataFrame(X, columns=['s{}'.format(i)
+                                     for i in range(X.shape[1])])
+        y = pd.Series(y).map('cause{}'.format)
+    cache = ArtifactCache(str(tmpdir))
+    kwargs = dict(bootstraps=20, spurious={y[0]: [X.shape[1] - 1]})
+
+    expected = make_tariff_matrix(X, y, random_state=71, **kwargs)
+    assert make_tariff_matrix(X, y, cache=cache, **kwargs)[0] is not None
+    assert not os.listdir(cache.path)
+
+    for _ in range(2):
+        cached = make_tariff_matrix(X, y, random_state=71, cache=cache,
+                                    **kwargs)
+        assert len(os.listdir(cache.path)) == 1
+        for result, value in zip(cached, expected):
+            assert type(result) == type(value)
+            assert np.array_equal(result, value)
+            assert np.asarray(result).dtype == np.asarray(value).dtype
+
+    make_tariff_matrix(X, y, random_state=71, cache=cache, top_n=10,
+                       **kwargs)
+    assert len(os.listdir(cache.path)) == 2
+
+
+def test_classifier_cache(tmpdir):
+    X, y = phmrc_shaped_data(random_state=73)
+    path = str(tmpdir.join('cache'))
+    kwargs = dict(bootstraps=20, random_state=73, cause_pct_cutoff=80)
+    expected = TariffClassifier(**kwargs).fit(X, y)
+
+    for cause_pct_cutoff in [80, 80, 90]:
+        clf = TariffClassifier(cache=path, **dict(
+            kwargs, cause_pct_cutoff=cause_pct_cutoff)).fit(X, y)
+        assert len(os.listdir(path)) == 1
+        assert np.array_equal(clf.tariffs_, expected.tariffs_)
+        assert np.array_equal(clf.X_uniform_, expected.X_uniform_)
+        assert np.array_equal(clf.uniform_weights_, expected.uniform_weights_)
+    assert not np.array_equal(clf.cutoff_ranks_, expected.cutoff_ranks_)
+
+    clf = TariffClassifier(cache=path, **dict(kwargs, random_state=None))
+    clf.fit(X, y)
+    assert len(os.listdir(path)) == 1
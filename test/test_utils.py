@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -50,4 +52,70 @@ def test_safe_align_sequences(seqs):
 
 
 def test_make_mask():
-  np.sum(mask) == sum([len(v) for k, v in matrix.items()])
\ No newline at end of file
+  np.sum(mask) == sum([len(v) for k, v in matrix.items()])
+
+def test_effective_n_jobs():
+    assert effective_n_jobs(None) == 1
+    assert effective_n_jobs(3) == 3
+    assert effective_n_jobs(-1) == os.cpu_count()
+    assert effective_n_jobs(-1000) == 1
+    with pytest.raises(ValueError):
+        effective_n_jobs(0)
+
+
+@pytest.mark.parametrize('n_draws', [1, 2, 11, 200, 1001])
+@pytest.mark.parametrize('ui', [(2.5, 97.5), (0.5, 99.5), (25, 75), (0, 100)])
+@pytest.mark.parametrize('block_size', [1, 7, 5000])
+def test_streaming_ui(n_draws, ui, block_size):
+    draws = np.random.normal(size=(n_draws, 3, 4))
+    draws[:, 0, 0] = 0
+
+    stream = StreamingUI(n_draws, ui)
+    for start in range(0, n_draws, block_size):
+        stream.update(draws[start:start + block_size])
+    lower, upper = stream.bounds()
+
+    expected_lower, expected_upper = np.percentile(draws, ui, axis=0)
+    assert (lower == expected_lower).all()
+    assert (upper == expected_upper).all()
+
+
+def test_streaming_ui_buffer_size():
+    stream = StreamingUI(5000, (0.5, 99.5))
+    for block in np.split(np.random.random((5000, 2, 3)), 50):
+        stream.update(block)
+        assert stream._lower.shape[0] <= 26
+        assert stream._upper.shape[0] <= 26
+
+
+def test_streaming_ui_wrong_number_of_draws():
+    stream = StreamingUI(10)
+    stream.update(np.zeros((6, 2)))
+    with pytest.raises(ValueError):
+        stream.bounds()
+    with pytest.raises(ValueError):
+        stream.update(np.zeros((6, 2)))
+
+
+def test_read_csv_chunks(tmpdir):
+    path = str(tmpdir.join('symptoms.csv'))
+    with open(path, 'w') as f:
+        f.write('sid,age_,s1,s2\nva1,20,1,0\nva2,35,,1\nva3,50,0,1\n')
+
+    chunks = list(read_csv_chunks(path, 2, non_binary=['age_']))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    df = pd.concat(chunks)
+    assert (df.dtypes[['s1', 's2']] == np.uint8).all()
+    assert df.s1.tolist() == [1, 0, 0]
+    assert df.age_.tolist() == [20, 35, 50]
+    assert df.index.tolist() == ['va1', 'va2', 'va3']
+
+
+def test_read_csv_chunks_not_binary(tmpdir):
+    path = str(tmpdir.join('symptoms.csv'))
+    with open(path, 'w') as f:
+        f.write('sid,s1,s2\nva1,1,0\nva2,3,1\n')
+
+    chunk, = read_csv_chunks(path)
+    assert chunk.s1.tolist() == [1, 3]
+    assert (chunk.dtypes == np.float32).all()